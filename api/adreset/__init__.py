@@ -3,12 +3,30 @@
 from __future__ import unicode_literals
 
 import logging
-import pkg_resources
 
 
 log = logging.getLogger('adreset')
 
-try:
-    version = pkg_resources.get_distribution('adreset').version
-except pkg_resources.DistributionNotFound:
-    version = 'unknown'
+
+def __getattr__(name):
+    """
+    Get the version of the package on first use.
+
+    Importing pkg_resources is slow, so it's only done when needed. This keeps the package fast to
+    import in the worker processes of the hashing pool.
+
+    :param str name: the name of the module attribute
+    :return: the value of the attribute
+    :raises AttributeError: if the module has no such attribute
+    """
+    if name != 'version':
+        raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
+
+    import pkg_resources
+
+    try:
+        version = pkg_resources.get_distribution('adreset').version
+    except pkg_resources.DistributionNotFound:
+        version = 'unknown'
+    globals()['version'] = version
+    return version
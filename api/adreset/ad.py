@@ -2,20 +2,99 @@
 
 from __future__ import unicode_literals
 
+import contextvars
 from datetime import datetime, timedelta, timezone
+import logging
 import re
 
 import ldap3
 from ldap3.core.exceptions import LDAPSocketOpenError
-from flask import current_app
+from ldap3.core.results import RESULT_SUCCESS
+from ldap3.protocol.formatters.formatters import format_sid
+from ldap3.utils.conv import escape_filter_chars
+from flask import current_app, g, has_app_context
 from werkzeug.exceptions import Unauthorized
 
 from adreset.error import ConfigurationError, ADError, ValidationError
+from adreset.cache import TTLCache
+from adreset.instrumentation import (
+    current_metrics,
+    get_filter_shape,
+    get_request_metrics,
+    timed_ldap,
+)
 from adreset import log
 
 
-class AD(object):
-    """Abstract the Active Directory tasks for the app."""
+# The domain's password and lockout policies are shared by all requests in the process since they
+# rarely change
+domain_cache = TTLCache('domain', maxsize=64)
+# The distinguished names and SIDs of the groups in "AD_USER_GROUPS" and "AD_ADMIN_GROUPS"
+group_cache = TTLCache('groups', maxsize=256)
+# The account statuses by the lowercase sAMAccountName, which are cached briefly since the account
+# status page is refreshed often and the route doesn't require authentication
+account_status_cache = TTLCache('account_status', maxsize=4096)
+# The GUID, sAMAccountName, and distinguished name of users keyed by both their GUID and their
+# lowercase sAMAccountName, so that a search in either direction answers the other
+identity_cache = TTLCache('identities', maxsize=8192)
+_missing = object()
+# The OID of the Simple Paged Results control (RFC 2696)
+PAGED_RESULTS_CONTROL = '1.2.840.113556.1.4.319'
+# The filters that match the user accounts and the security groups. Unlike objectClass, the
+# sAMAccountType attribute is indexed and single-valued, so the domain controllers can use the index
+# instead of scanning every object under the search base.
+_object_type_filters = {
+    'user': '(sAMAccountType=805306368)',
+    'group': '(|(sAMAccountType=268435456)(sAMAccountType=536870912))',
+}
+
+
+def build_search_filter(object_type=None, **attributes):
+    """
+    Build an LDAP filter that matches the objects of a type that have the attribute values.
+
+    The values are escaped, so they can come from user input.
+
+    :kwarg str object_type: "user" or "group" to only match user accounts or security groups
+    :kwarg attributes: the attribute values to match, where a list of values matches any of them
+    :return: the LDAP filter
+    :rtype: str
+    :raises ValueError: if the object type isn't supported
+    """
+    clauses = []
+    if object_type:
+        try:
+            clauses.append(_object_type_filters[object_type])
+        except KeyError:
+            raise ValueError(f'The object type "{object_type}" is not supported')
+
+    for attribute, value in attributes.items():
+        if isinstance(value, (list, tuple)):
+            clauses.append(
+                '(|{0})'.format(
+                    ''.join(f'({attribute}={escape_filter_chars(item)})' for item in value)
+                )
+            )
+        else:
+            clauses.append(f'({attribute}={escape_filter_chars(value)})')
+
+    if len(clauses) == 1:
+        return clauses[0]
+    return '(&{0})'.format(''.join(clauses))
+
+
+def close_sessions(exception=None):
+    """
+    Return the pooled connections checked out during the request or application context.
+
+    :kwarg Exception exception: the unhandled exception of the request, if any
+    """
+    for ad in g.pop('adreset_ad_sessions', []):
+        ad.close()
+
+
+class BaseAD(object):
+    """The Active Directory logic shared by the synchronous and asynchronous clients."""
 
     # Active Directory stores timestamps in "filetime". When the value is zero in Active Directory,
     # that is the equivalent of January 1st, 1601.
@@ -27,17 +106,65 @@ class AD(object):
         'An error occured while searching Active Directory. Please contact the '
         'administrator for help.'
     )
+    # The domain attributes that are cached for "AD_DOMAIN_CACHE_TTL" seconds. These are all
+    # retrieved in a single search whenever one of them is not cached.
+    domain_policy_attributes = (
+        'lockoutDuration',
+        'maxPwdAge',
+        'minPwdAge',
+        'minPwdLength',
+        'objectSid',
+        'pwdProperties',
+    )
+    # The attributes needed to identify and authorize a user
+    user_profile_attributes = [
+        'objectGUID',
+        'sAMAccountName',
+        'distinguishedName',
+        'primaryGroupID',
+    ]
+    # The attributes that identify a user, which are cached for "AD_IDENTITY_CACHE_TTL" seconds
+    identity_attributes = ['objectGUID', 'sAMAccountName', 'distinguishedName']
+    # The attributes needed to get the account status of a user
+    account_status_domain_attributes = [
+        'lockoutDuration',
+        'maxPwdAge',
+        'minPwdAge',
+        'minPwdLength',
+        'pwdProperties',
+    ]
+    account_status_user_attributes = ['lockoutTime', 'pwdLastSet', 'userAccountControl']
 
     def __init__(self):
-        """Initialize the AD class."""
+        """Initialize the BaseAD class."""
         self._connection = None
-        # Cache the minimum password length to avoid getting the value from AD multiple times
-        self._min_pwd_length = None
+        # The connection pool the current connection was checked out from, if any
+        self._pool = None
+        # The user the connection is bound as, which is logged instead of asking Active Directory
+        self._user = None
+        # The username the connection was bound with, which identifies the logged in user
+        self._bound_username = None
+        # Cache the users' profiles and tokenGroups for the duration of the AD session
+        self._user_profiles = {}
+        self._token_group_sids = {}
 
     def __del__(self):
         """Disconnect from Active Directory."""
-        if self._connection:
-            self._connection.unbind()
+        self.close()
+
+    def close(self):
+        """Return the connection to the connection pool or disconnect from Active Directory."""
+        connection, self._connection = self._connection, None
+        pool, self._pool = self._pool, None
+        self._user = None
+        self._bound_username = None
+        if not connection:
+            return
+
+        if pool:
+            pool.release(connection)
+        else:
+            connection.unbind()
 
     def log(self, category, message, *args, **kwarg):
         """
@@ -47,13 +174,55 @@ class AD(object):
         :param str message: the log message
         :kwarg any **kwarg: any keyword arguments to pass on to the logger
         """
+        # Don't build the log record when the message would be discarded anyway
+        if not log.isEnabledFor(getattr(logging, category.upper())):
+            return
         log_method = getattr(log, category)
-        # Only get the logged-in user info if the connection is bound
-        if self._connection and self._connection.bound:
-            logged_in_user = self.get_loggedin_user(raise_exc=False)
-        else:
-            logged_in_user = None
-        log_method({'message': message, 'user': logged_in_user}, *args, **kwarg)
+        log_method({'message': message, 'user': self._get_log_user()}, *args, **kwarg)
+
+    def _get_log_user(self):
+        """
+        Get the logged in user to include in log messages.
+
+        :return: the logged in user's username or None if the connection isn't bound
+        :rtype: str or None
+        """
+        return self._user
+
+    @staticmethod
+    def _get_bound_user(username):
+        r"""
+        Get the username to log from the username the connection was bound with.
+
+        :param str username: the distinguished name, user principal name, DOMAIN\username, or
+            sAMAccountName the connection was bound with
+        :return: the username without the domain
+        :rtype: str
+        """
+        if 'CN=' in username:
+            return username.split('CN=')[-1].split(',')[0]
+        return username.split('\\')[-1].split('@')[0]
+
+    @staticmethod
+    def _get_bound_user_filter(username):
+        r"""
+        Get the LDAP filter to search for the user the connection was bound with.
+
+        :param str username: the distinguished name, user principal name, DOMAIN\username, or
+            sAMAccountName the connection was bound with
+        :return: the LDAP filter
+        :rtype: str
+        """
+        if 'CN=' in username:
+            return build_search_filter('user', distinguishedName=username)
+        if '@' in username:
+            return build_search_filter('user', userPrincipalName=username)
+        return build_search_filter('user', sAMAccountName=username.split('\\')[-1])
+
+    @property
+    def config(self):
+        """Return the configuration of the Flask application."""
+        return current_app.config
 
     def _get_config(self, config_name, raise_exc=True):
         """
@@ -68,8 +237,8 @@ class AD(object):
         config_error = ConfigurationError(
             'The application has a configuration error. Ask the administrator to check the logs.'
         )
-        if config_name in current_app.config:
-            config = current_app.config[config_name]
+        if config_name in self.config:
+            config = self.config[config_name]
         else:
             self.log('error', 'The configuration option "%s" is not set', config_name)
             if raise_exc:
@@ -83,6 +252,461 @@ class AD(object):
 
         return config
 
+    @property
+    def base_dn(self):
+        """Return the base distinguished name (e.g. DC=adreset,DC=local)."""
+        return 'DC=' + (self._get_config('AD_DOMAIN').replace('.', ',DC='))
+
+    def get_search_base(self, object_type):
+        """
+        Get the distinguished name to search for the objects of a type from.
+
+        :param str object_type: "user" or "group"
+        :return: the configured search base of the object type or the base distinguished name
+        :rtype: str
+        """
+        config_name = {'user': 'AD_USERS_SEARCH_BASE', 'group': 'AD_GROUPS_SEARCH_BASE'}
+        return self._get_config(config_name[object_type], raise_exc=False) or self.base_dn
+
+    def _get_cached_domain_attributes(self, attributes):
+        """
+        Get the domain attributes that are in the process-wide cache.
+
+        :param list attributes: the attributes from the domain to get
+        :return: a tuple of a dictionary of the cached attributes, a list of the attributes that
+            aren't cached, and a list of the attributes to search for
+        :rtype: tuple
+        """
+        ttl = self._get_config('AD_DOMAIN_CACHE_TTL', raise_exc=False)
+        result = {}
+        missing = []
+        for attribute in attributes:
+            value = _missing
+            if ttl and attribute in self.domain_policy_attributes:
+                value = domain_cache.get(attribute, _missing)
+            if value is _missing:
+                missing.append(attribute)
+            else:
+                result[attribute] = value
+
+        to_search = list(missing)
+        if ttl and any(attribute in self.domain_policy_attributes for attribute in missing):
+            # Get all the policy attributes at once so that the next call is served from the cache
+            to_search.extend(set(self.domain_policy_attributes) - set(missing))
+
+        return result, missing, to_search
+
+    def _add_searched_domain_attributes(self, attributes, result, missing, searched):
+        """
+        Cache the searched domain attributes and add them to the cached ones.
+
+        :param list attributes: the attributes from the domain that were requested
+        :param dict result: the cached attributes returned from _get_cached_domain_attributes
+        :param list missing: the attributes that weren't cached
+        :param dict searched: the attributes returned from the search of the domain
+        :return: the dictionary of domain attributes, where the keys are the attribute names and
+            the values are the attribute values
+        :rtype: dict
+        """
+        if not searched:
+            self.log(
+                'error',
+                'The LDAP attribute(s) %s on the domain couldn\'t be found',
+                ', '.join(attributes),
+            )
+            return searched
+
+        ttl = self._get_config('AD_DOMAIN_CACHE_TTL', raise_exc=False)
+        if ttl:
+            for attribute in self.domain_policy_attributes:
+                if attribute in searched:
+                    domain_cache.set(attribute, searched[attribute], ttl)
+
+        result.update({attribute: searched[attribute] for attribute in missing})
+        return result
+
+    def _find_user_profile(self, sam_account_name=None, guid=None):
+        """
+        Find a user profile that was already retrieved in the AD session.
+
+        :kwarg str sam_account_name: the sAMAccountName of the user
+        :kwarg str guid: the GUID of the user
+        :return: the user profile or None
+        :rtype: dict or None
+        """
+        for profile in self._user_profiles.values():
+            if profile['guid'] == guid or (
+                sam_account_name and profile['sam_account_name'].lower() == sam_account_name.lower()
+            ):
+                return profile
+
+    @staticmethod
+    def _get_user_profile_filter(sam_account_name=None, guid=None):
+        """
+        Get the LDAP filter to search for a user profile.
+
+        :kwarg str sam_account_name: the sAMAccountName of the user
+        :kwarg str guid: the GUID of the user to search for instead of the sAMAccountName
+        :return: the LDAP filter
+        :rtype: str
+        """
+        if guid:
+            return build_search_filter('user', objectGUID=guid)
+        return build_search_filter('user', sAMAccountName=sam_account_name)
+
+    def _add_searched_user_profile(self, attributes, sam_account_name=None, guid=None):
+        """
+        Create the user profile from the searched attributes and cache it for the AD session.
+
+        :param dict attributes: the attributes in user_profile_attributes of the user
+        :kwarg str sam_account_name: the sAMAccountName of the user that was searched for
+        :kwarg str guid: the GUID of the user that was searched for
+        :return: a dictionary with the keys guid, sam_account_name, dn, and primary_group_id
+        :rtype: dict
+        :raises ADError: if the user couldn't be found in Active Directory
+        """
+        if not attributes:
+            self.log(
+                'error',
+                'The user "%s" couldn\'t be found in Active Directory',
+                guid or sam_account_name,
+            )
+            raise ADError('The user couldn\'t be found in Active Directory')
+
+        profile = {
+            # ldap3 returns the GUID surrounded by curly braces for whatever reason, so remove that
+            'guid': attributes['objectGUID'].strip('{}'),
+            'sam_account_name': attributes['sAMAccountName'],
+            'dn': attributes['distinguishedName'],
+            'primary_group_id': attributes['primaryGroupID'],
+        }
+        self.add_user_profile(profile)
+        self._cache_identity(profile)
+        return profile
+
+    def add_user_profile(self, profile):
+        """
+        Add a user profile retrieved by another AD session to avoid searching for it again.
+
+        :param dict profile: the user profile returned from get_user_profile
+        """
+        self._user_profiles[profile['guid']] = profile
+
+    def _get_cached_identity(self, sam_account_name=None, guid=None):
+        """
+        Get the identity of a user from the AD session or the process-wide cache.
+
+        :kwarg str sam_account_name: the sAMAccountName of the user
+        :kwarg str guid: the GUID of the user
+        :return: a dictionary with the keys guid, sam_account_name, and dn or None
+        :rtype: dict or None
+        """
+        profile = self._find_user_profile(sam_account_name, guid)
+        if profile:
+            return profile
+
+        if not self._get_config('AD_IDENTITY_CACHE_TTL', raise_exc=False):
+            return None
+        if guid:
+            return identity_cache.get(('guid', guid.lower()))
+        return identity_cache.get(('sam_account_name', sam_account_name.lower()))
+
+    def _cache_identity(self, identity):
+        """
+        Cache the identity of a user that was searched for.
+
+        If the user was renamed, or another user had their sAMAccountName, the stale entries are
+        removed so that the old name no longer resolves to the user.
+
+        :param dict identity: a dictionary with at least the keys guid, sam_account_name, and dn
+        :return: a dictionary with the keys guid, sam_account_name, and dn
+        :rtype: dict
+        """
+        identity = {key: identity[key] for key in ('guid', 'sam_account_name', 'dn')}
+        ttl = self._get_config('AD_IDENTITY_CACHE_TTL', raise_exc=False)
+        if not ttl:
+            return identity
+
+        guid_key = ('guid', identity['guid'].lower())
+        name_key = ('sam_account_name', identity['sam_account_name'].lower())
+        previous = identity_cache.pop(guid_key)
+        if previous and ('sam_account_name', previous['sam_account_name'].lower()) != name_key:
+            self.log(
+                'info',
+                'The user with the GUID %s was renamed from "%s" to "%s"',
+                identity['guid'],
+                previous['sam_account_name'],
+                identity['sam_account_name'],
+            )
+            identity_cache.pop(('sam_account_name', previous['sam_account_name'].lower()))
+        previous = identity_cache.pop(name_key)
+        if previous and ('guid', previous['guid'].lower()) != guid_key:
+            identity_cache.pop(('guid', previous['guid'].lower()))
+
+        identity_cache.set(guid_key, identity, ttl)
+        identity_cache.set(name_key, identity, ttl)
+        return identity
+
+    def _add_searched_identity(self, attributes, sam_account_name=None, guid=None):
+        """
+        Cache the identity of a user from the searched attributes.
+
+        :param dict attributes: the attributes in identity_attributes of the user
+        :kwarg str sam_account_name: the sAMAccountName of the user that was searched for
+        :kwarg str guid: the GUID of the user that was searched for
+        :return: a dictionary with the keys guid, sam_account_name, and dn or None if the user
+            couldn't be found
+        :rtype: dict or None
+        """
+        if not attributes:
+            self.log(
+                'error',
+                'The user "%s" couldn\'t be found in Active Directory',
+                guid or sam_account_name,
+            )
+            return None
+
+        return self._cache_identity(
+            {
+                # ldap3 returns the GUID surrounded by curly braces, so remove that
+                'guid': attributes['objectGUID'].strip('{}'),
+                'sam_account_name': attributes['sAMAccountName'],
+                'dn': attributes['distinguishedName'],
+            }
+        )
+
+    def get_cached_account_status(self, sam_account_name):
+        """
+        Get the account status of a user cached by get_account_status.
+
+        :param str sam_account_name: the sAMAccountName of the user
+        :return: a tuple of a boolean determining if the account status was cached and the account
+            status, which is None if the user wasn't found
+        :rtype: tuple
+        """
+        status = account_status_cache.get(sam_account_name.lower(), _missing)
+        if status is _missing:
+            return False, None
+        # Return a copy so that the cached account status can't be modified by the caller
+        return True, dict(status) if status else None
+
+    def _cache_account_status(self, sam_account_name, status):
+        """
+        Cache the account status of a user.
+
+        :param str sam_account_name: the sAMAccountName of the user
+        :param dict status: the account status or None if the user wasn't found
+        """
+        if status:
+            ttl = self._get_config('ACCOUNT_STATUS_CACHE_TTL', raise_exc=False)
+        else:
+            ttl = self._get_config('ACCOUNT_STATUS_NOT_FOUND_CACHE_TTL', raise_exc=False)
+        if ttl:
+            account_status_cache.set(sam_account_name.lower(), status, ttl)
+
+    @staticmethod
+    def _invalidate_account_status(sam_account_name):
+        """
+        Remove the cached account status of a user after it changed.
+
+        The other application processes keep their cached account status until it expires.
+
+        :param str sam_account_name: the sAMAccountName of the user
+        """
+        account_status_cache.pop(sam_account_name.lower())
+
+    @staticmethod
+    def is_complex_password(password):
+        """
+        Determine if the password contains at least three of the four kinds of characters.
+
+        :param str password: the password to check
+        :rtype: bool
+        :return: if the password is complex
+        """
+        complexity_score = 0
+        # If a capital letter is found in the password
+        if re.search(r'[A-Z]', password):
+            complexity_score += 1
+        # If a lowercase letter is found in the password
+        if re.search(r'[a-z]', password):
+            complexity_score += 1
+        # If a digit is found in the password
+        if re.search(r'\d', password):
+            complexity_score += 1
+        # If a nonletter or number is found in the password (should match any special character)
+        if re.search(r'\W', password):
+            complexity_score += 1
+
+        return complexity_score >= 3
+
+    @staticmethod
+    def validate_new_password(password, min_pwd_length, complexity_required):
+        """
+        Validate that a new password meets the domain's password policy.
+
+        :param str password: the new password
+        :param int min_pwd_length: the domain's minimum password length
+        :param bool complexity_required: if the domain requires complex passwords
+        :raises ValidationError: if the new password doesn't meet the domain standards
+        """
+        if complexity_required and not BaseAD.is_complex_password(password):
+            raise ValidationError(
+                'The password did not match the complexity requirements. Please ensure your '
+                'password contains at least three of the four requirements: lowercase letters, '
+                'uppercase letters, numbers, and special charcters.'
+            )
+        elif len(password) < min_pwd_length:
+            raise ValidationError(f'The password must be at least {min_pwd_length} characters long')
+
+    @staticmethod
+    def is_pwd_never_expires_set(user_account_control):
+        """
+        Determine if the "password never expires" flag is set.
+
+        :param int user_account_control: the userAccountControl LDAP attribute value of the user
+        :return: a boolean determining if the "password never expires" flag is set
+        :rtype: bool
+        """
+        # See https://support.microsoft.com/en-us/help/305144/how-to-use-useraccountcontrol-to-manipulate-user-account-properties # noqa: E501
+        return (user_account_control & 65536) == 65536
+
+    @staticmethod
+    def is_account_disabled(user_account_control):
+        """
+        Determine if the account is disabled.
+
+        :param int user_account_control: the userAccountControl LDAP attribute value of the user
+        :return: a boolean determining if the account is disabled
+        :rtype: bool
+        """
+        # See https://support.microsoft.com/en-us/help/305144/how-to-use-useraccountcontrol-to-manipulate-user-account-properties # noqa: E501
+        return (user_account_control & 2) == 2
+
+    @staticmethod
+    def is_account_locked_out(lockout_time, lockout_duration):
+        """
+        Determine if the account is locked out.
+
+        :param datetime.datetime lockout_time: the datetime representation of the lockoutTime
+            LDAP attribute
+        :param datetime.datetime lockout_duration: the timedelta representation of the
+            lockoutDuration LDAP attribute
+        :return: a boolean determining if the account is locked out
+        :rtype: bool
+        """
+        # If password lockouts are disabled on the domain, this can be falsey
+        if not lockout_time:
+            return False
+
+        return lockout_time + lockout_duration > datetime.now(timezone.utc)
+
+    @staticmethod
+    def get_unlock_date(lockout_time, lockout_duration):
+        """
+        Determine when the account will be unlocked.
+
+        None is returned when the account is not locked out.
+
+        :param datetime.datetime lockout_time: the datetime representation of the lockoutTime
+            LDAP attribute
+        :param datetime.datetime lockout_duration: the timedelta representation of the
+            lockoutDuration LDAP attribute
+        :return: the datetime of when the user's account will be unlocked
+        :rtype: datetime.datetime or None
+        """
+        if BaseAD.is_account_locked_out(lockout_time, lockout_duration):
+            return lockout_time + lockout_duration
+
+    @staticmethod
+    def get_pwd_expiration_date(max_pwd_age, pwd_last_set, user_account_control):
+        """
+        Determine when the user's password expires.
+
+        When None is returned, it can mean a few things. It can mean the pwdLastSet LDAP attribute
+        is not set. This usually means an Active Directory administrator set the password to expire
+        at next logon. It can also mean the domain doesn't expire passwords, or the user has their
+        password set to never expire.
+
+        :param datetime.timedelta max_pwd_age: the timedelta representation of the maxPwdAge
+            LDAP attribute of the domain
+        :param datetime.datetime pwd_last_set: the datetime representation of the pwdLastSet LDAP
+            attribute of the user
+        :param int user_account_control: the userAccountControl LDAP attribute value of the user
+        :return: the datetime of when the user's password expires
+        :rtype: datetime.datetime or None
+        """
+        # TODO: `max_pwd_age == timedelta.max` relies on:
+        # https://github.com/cannatag/ldap3/pull/708
+        if (
+            max_pwd_age == timedelta.max
+            or pwd_last_set == BaseAD.min_filetime
+            or BaseAD.is_pwd_never_expires_set(user_account_control)
+        ):
+            return None
+
+        return pwd_last_set + max_pwd_age
+
+    @staticmethod
+    def get_when_pwd_can_be_set(min_pwd_age, pwd_last_set):
+        """
+        Determine when the user's password can be set next.
+
+        When None is returned, it means the password can be set now.
+
+        :param datetime.timedelta min_pwd_age: the timedelta representation of the minPwdAge
+            LDAP attribute of the domain
+        :param datetime.datetime pwd_last_set: the datetime representation of the pwdLastSet LDAP
+            attribute of the user
+        :return: the datetime of when the user's password can be set next
+        :rtype: datetime.datetime
+        """
+        if min_pwd_age == timedelta(0):
+            return None
+
+        when = pwd_last_set + min_pwd_age
+        if when < datetime.now(timezone.utc):
+            return None
+
+        return when
+
+    @staticmethod
+    def _format_account_status(domain_attributes, user_attributes):
+        """
+        Format the account status from the searched domain and user attributes.
+
+        :param dict domain_attributes: the account_status_domain_attributes of the domain
+        :param dict user_attributes: the account_status_user_attributes of the user
+        :return: a dictionary with general information about the account
+        :rtype: dict
+        """
+        last_set = user_attributes['pwdLastSet']
+        if last_set == BaseAD.min_filetime:
+            last_set = None
+
+        uac = user_attributes['userAccountControl']
+        return {
+            'account_is_disabled': BaseAD.is_account_disabled(uac),
+            'account_is_locked_out': BaseAD.is_account_locked_out(
+                user_attributes['lockoutTime'], domain_attributes['lockoutDuration'],
+            ),
+            'account_is_unlocked_on': BaseAD.get_unlock_date(
+                user_attributes['lockoutTime'], domain_attributes['lockoutDuration'],
+            ),
+            'password_can_be_set_on': BaseAD.get_when_pwd_can_be_set(
+                domain_attributes['minPwdAge'], user_attributes['pwdLastSet'],
+            ),
+            'password_expires_on': BaseAD.get_pwd_expiration_date(
+                domain_attributes['maxPwdAge'], user_attributes['pwdLastSet'], uac,
+            ),
+            'password_last_set_on': last_set,
+            'password_never_expires': BaseAD.is_pwd_never_expires_set(uac),
+        }
+
+
+class AD(BaseAD):
+    """Abstract the Active Directory tasks for the app."""
+
     @property
     def connection(self):
         """
@@ -96,7 +720,8 @@ class AD(object):
 
         ldap_url = self._get_config('AD_LDAP_URI')
         server = ldap3.Server(ldap_url, allowed_referral_hosts=[('*', False)], connect_timeout=3)
-        self._connection = ldap3.Connection(server)
+        # The usage statistics provide the bytes sent and received for the request metrics
+        self._connection = ldap3.Connection(server, collect_usage=True)
 
         if self._get_config('AD_USE_NTLM', raise_exc=False):
             msg = 'Configuring the Active Directory connection to use NTLM authentication'
@@ -110,7 +735,8 @@ class AD(object):
         try:
             msg = f'Connecting to Active Directory with the URL "{ldap_url}"'
             self.log('debug', msg)
-            self._connection.open()
+            with timed_ldap(self._connection, 'open'):
+                self._connection.open()
         except LDAPSocketOpenError:
             msg = f'The connection to Active Directory with the URL "{ldap_url}" failed'
             self.log('error', msg, exc_info=True)
@@ -118,11 +744,6 @@ class AD(object):
 
         return self._connection
 
-    @property
-    def base_dn(self):
-        """Return the base distinguished name (e.g. DC=adreset,DC=local)."""
-        return 'DC=' + (self._get_config('AD_DOMAIN').replace('.', ',DC='))
-
     def login(self, username, password):
         """
         Login to Active Directory.
@@ -130,11 +751,18 @@ class AD(object):
         :param str username: the Active Directory username
         :param str password: the Active Directory password
         """
-        if self.connection.bound:
+        if self._pool:
+            # Never bind other credentials on a pooled connection since it is shared
+            msg = 'The login method was called on a pooled connection. Will open a new connection.'
+            self.log('debug', msg)
+            self.close()
+        elif self.connection.bound:
             msg = 'The login method was called but the connection is already bound. Will reconnect.'
             self.log('debug', msg)
             self.connection.unbind()
             self.connection.open()
+        self._user = None
+        self._bound_username = None
 
         domain = self._get_config('AD_DOMAIN')
         if '@' in username or '\\' in username or 'CN=' in username:
@@ -147,7 +775,9 @@ class AD(object):
         self.connection.password = password
 
         svc_account = self._get_config('AD_SERVICE_USERNAME') == username
-        if not self.connection.bind():
+        with timed_ldap(self.connection, 'bind') as details:
+            details['bound'] = bound = self.connection.bind()
+        if not bound:
             if svc_account:
                 self.log('error', 'The service account failed to login')
                 raise ADError(self.unknown_error_msg)
@@ -155,14 +785,52 @@ class AD(object):
                 self.log('info', 'The user "%s" failed to login', self.connection.user)
                 raise Unauthorized('The username or password is incorrect. Please try again.')
         else:
+            self._user = self._get_bound_user(username)
+            self._bound_username = username
             if svc_account:
                 self.log('info', 'The service account logged in successfully')
             else:
                 self.log('info', 'The user logged in successfully')
 
     def service_account_login(self):
-        """Login using the configured service account."""
-        self.login(self._get_config('AD_SERVICE_USERNAME'), self._get_config('AD_SERVICE_PASSWORD'))
+        """
+        Login using the configured service account.
+
+        When the connection pool is enabled, a connection that is already bound with the service
+        account is checked out of the pool instead of opening and binding a new connection.
+        """
+        pool = current_app.extensions.get('adreset_ad_pool')
+        if not pool:
+            self.login(
+                self._get_config('AD_SERVICE_USERNAME'), self._get_config('AD_SERVICE_PASSWORD')
+            )
+            return
+
+        self.close()
+        self._connection = pool.acquire()
+        self._pool = pool
+        self._bound_username = self._get_config('AD_SERVICE_USERNAME')
+        self._user = self._get_bound_user(self._bound_username)
+        if has_app_context():
+            # Return the connection when the request ends instead of when this object is garbage
+            # collected, which can be delayed by a reference in a traceback
+            g.setdefault('adreset_ad_sessions', []).append(self)
+        self.log('debug', 'Checked out a service account connection from the connection pool')
+
+    @staticmethod
+    def create_service_connection():
+        """
+        Open a new connection to Active Directory that is bound with the service account.
+
+        This is used by the connection pool to create new connections.
+
+        :return: a bound LDAP connection to Active Directory
+        :rtype: ldap3.Connection
+        """
+        ad = AD()
+        ad.login(ad._get_config('AD_SERVICE_USERNAME'), ad._get_config('AD_SERVICE_PASSWORD'))
+        connection, ad._connection = ad._connection, None
+        return connection
 
     def get_loggedin_user(self, raise_exc=True):
         """
@@ -173,7 +841,8 @@ class AD(object):
         :rtype: str
         """
         if self.connection.bound:
-            user = self.connection.extend.standard.who_am_i()
+            with timed_ldap(self.connection, 'who_am_i'):
+                user = self.connection.extend.standard.who_am_i()
             if not self._get_config('TESTING', raise_exc=False):
                 # AD returns the username as DOMAIN\username, so this gets the sAMAccountName
                 return user.split('\\')[-1]
@@ -186,7 +855,36 @@ class AD(object):
             self.log('error', 'You must be logged in to get the logged in user\'s username')
             raise ADError(self.unknown_error_msg)
 
-    def search(self, search_filter, attributes=None, search_scope=ldap3.SUBTREE, raise_exc=True):
+    def get_loggedin_user_profile(self):
+        """
+        Get the profile of the logged in user from the username they logged in with.
+
+        Unlike get_loggedin_user, this doesn't ask Active Directory who the connection is bound as,
+        so the profile search is the only LDAP operation.
+
+        :return: a dictionary with the keys guid, sam_account_name, dn, and primary_group_id
+        :rtype: dict
+        :raises ADError: if the connection isn't bound or the user couldn't be found in Active
+            Directory
+        """
+        if not self._bound_username:
+            self.log('error', 'You must be logged in to get the logged in user\'s profile')
+            raise ADError(self.unknown_error_msg)
+
+        search_filter = self._get_bound_user_filter(self._bound_username)
+        attributes = self._get_attributes(
+            search_filter, self.user_profile_attributes, search_base=self.get_search_base('user')
+        )
+        return self._add_searched_user_profile(attributes, self._bound_username)
+
+    def search(
+        self,
+        search_filter,
+        attributes=None,
+        search_scope=ldap3.SUBTREE,
+        raise_exc=True,
+        search_base=None,
+    ):
         """
         Search Active Directory using an LDAP filter.
 
@@ -194,6 +892,8 @@ class AD(object):
         :kwarg list attributes: a list of LDAP attributes to search for
         :kwarg str search_scope: the LDAP search scope to use
         :kwarg bool raise_exc: raise an exception if the search yields no results
+        :kwarg str search_base: the distinguished name to search from instead of the base
+            distinguished name of the domain
         :return: the ldap3 formatted response from Active Directory
         :rtype: list
         """
@@ -206,9 +906,20 @@ class AD(object):
         self.log('debug', msg)
 
         try:
-            search_succeeded = self.connection.search(
-                self.base_dn, search_filter, search_scope=search_scope, attributes=attributes
-            )
+            with timed_ldap(
+                self.connection,
+                'search',
+                filter=get_filter_shape(search_filter),
+                scope=search_scope,
+                attributes=len(attributes or []),
+            ) as details:
+                search_succeeded = self.connection.search(
+                    search_base or self.base_dn,
+                    search_filter,
+                    search_scope=search_scope,
+                    attributes=attributes,
+                )
+                details['entries'] = len(self.connection.response or []) if search_succeeded else 0
         except ldap3.core.exceptions.LDAPAttributeError:
             msg = (
                 f'An invalid LDAP attribute was requested when searching for "{search_filter}" '
@@ -224,35 +935,186 @@ class AD(object):
         if raise_exc:
             raise ADError(self.failed_search_error)
 
-    def _get_attributes(self, search_filter, attributes):
+    def _search_page(self, search_filter, attributes, search_scope, search_base, size, cookie):
+        """
+        Get a page of the results of a search with the Simple Paged Results control.
+
+        :param str search_filter: the LDAP search filter to use
+        :param list attributes: a list of LDAP attributes to search for
+        :param str search_scope: the LDAP search scope to use
+        :param str search_base: the distinguished name to search from
+        :param int size: the maximum number of entries in the page
+        :param bytes cookie: the cookie returned with the previous page or None for the first page
+        :return: a tuple of the entries in the page and the cookie of the next page, which is
+            None if this is the last page
+        :rtype: tuple
+        """
+        try:
+            with timed_ldap(
+                self.connection,
+                'paged_search',
+                filter=get_filter_shape(search_filter),
+                scope=search_scope,
+                attributes=len(attributes or []),
+            ) as details:
+                self.connection.search(
+                    search_base,
+                    search_filter,
+                    search_scope=search_scope,
+                    attributes=attributes,
+                    paged_size=size,
+                    paged_cookie=cookie,
+                )
+                # Skip the search result references to other domains in the forest
+                entries = [
+                    entry
+                    for entry in self.connection.response or []
+                    if entry.get('type') == 'searchResEntry'
+                ]
+                details['entries'] = len(entries)
+        except ldap3.core.exceptions.LDAPAttributeError:
+            msg = (
+                f'An invalid LDAP attribute was requested when searching for "{search_filter}" '
+                f'with attributes: {", ".join(attributes)}'
+            )
+            self.log('error', msg, exc_info=True)
+            raise ADError(self.failed_search_error)
+
+        if self.connection.result['result'] != RESULT_SUCCESS:
+            self.log(
+                'error',
+                'The paged search for "%s" failed: %s',
+                search_filter,
+                self.connection.result,
+            )
+            raise ADError(self.failed_search_error)
+
+        control = (self.connection.result.get('controls') or {}).get(PAGED_RESULTS_CONTROL)
+        next_cookie = control['value']['cookie'] if control else None
+        return entries, next_cookie or None
+
+    def paged_search(
+        self,
+        search_filter,
+        attributes=None,
+        search_scope=ldap3.SUBTREE,
+        search_base=None,
+        page_size=None,
+        size_limit=0,
+    ):
+        """
+        Search Active Directory page by page and yield the entries as the pages arrive.
+
+        The pages are requested with the Simple Paged Results control, so the results aren't
+        truncated at the domain controller's MaxPageSize and only a page of entries is held in
+        memory at a time.
+
+        :param str search_filter: the LDAP search filter to use
+        :kwarg list attributes: a list of LDAP attributes to search for
+        :kwarg str search_scope: the LDAP search scope to use
+        :kwarg str search_base: the distinguished name to search from instead of the base
+            distinguished name of the domain
+        :kwarg int page_size: the number of entries per page instead of "AD_SEARCH_PAGE_SIZE"
+        :kwarg int size_limit: the maximum number of entries to yield or 0 for no limit
+        :return: a generator of the entries, which are dictionaries with the dn and attributes keys
+        :rtype: generator
+        """
+        if not self.connection.bound:
+            raise ADError('You must be logged into LDAP to search')
+        msg = (
+            f'Searching Active Directory page by page with "{search_filter}" and the following '
+            f'attributes: {", ".join(attributes or [])}'
+        )
+        self.log('debug', msg)
+
+        page_size = page_size or self._get_config('AD_SEARCH_PAGE_SIZE')
+        search_base = search_base or self.base_dn
+        cookie = None
+        returned = 0
+        try:
+            while True:
+                size = min(page_size, size_limit - returned) if size_limit else page_size
+                entries, cookie = self._search_page(
+                    search_filter, attributes, search_scope, search_base, size, cookie
+                )
+                if size_limit:
+                    # Don't rely on the server honoring the reduced size of the last page
+                    entries = entries[: size_limit - returned]
+                for entry in entries:
+                    yield entry
+                    returned += 1
+                if not cookie or (size_limit and returned >= size_limit):
+                    return
+        finally:
+            if cookie:
+                # Release the results the server is holding when the search is stopped early
+                try:
+                    self.connection.search(
+                        search_base,
+                        search_filter,
+                        search_scope=search_scope,
+                        attributes=attributes,
+                        paged_size=0,
+                        paged_cookie=cookie,
+                    )
+                except Exception:
+                    self.log('debug', 'Abandoning the paged search failed', exc_info=True)
+
+    def _get_attributes(
+        self,
+        search_filter,
+        attributes,
+        search_base=None,
+        search_scope=ldap3.SUBTREE,
+        raise_exc=True,
+    ):
         """
         Get the attributes of the first LDAP object returned from the search filter.
 
         :param str search_filter: the LDAP search filter to use
         :param list attributes: the attributes from the domain to search for
+        :kwarg str search_base: the distinguished name to search from instead of the base
+            distinguished name of the domain
+        :kwarg str search_scope: the LDAP search scope to use
+        :kwarg bool raise_exc: raise an exception if the search yields no results instead of
+            returning an empty dictionary
         :rtype: dict
         :return: the dictionary of attributes, where the keys are the attribute names and
             the values are the attribute values
         """
-        results = self.search(search_filter, attributes)
+        results = self.search(
+            search_filter,
+            attributes,
+            search_scope=search_scope,
+            raise_exc=raise_exc,
+            search_base=search_base,
+        )
 
-        if 'attributes' in results[0]:
+        if results and 'attributes' in results[0]:
             return {attribute: results[0]['attributes'][attribute] for attribute in attributes}
 
         return {}
 
-    def get_attributes(self, sam_account_name, attributes):
+    def get_attributes(self, sam_account_name, attributes, object_type='user', raise_exc=True):
         """
         Get an LDAP attribute from the object.
 
         :param str sam_account_name: the sAMAccountName of the LDAP object to search for
         :param list attributes: the list of attributes of the LDAP object to search for
+        :kwarg str object_type: "user" or "group" depending on the LDAP object to search for
+        :kwarg bool raise_exc: raise an exception if the LDAP object doesn't exist instead of
+            returning an empty dictionary
         :rtype: dict
         :return: the dictionary of attributes, where the keys are the attribute names and
             the values are the attribute values
         """
-        search_filter = f'(sAMAccountName={sam_account_name})'
-        result = self._get_attributes(search_filter, attributes)
+        search_filter = build_search_filter(object_type, sAMAccountName=sam_account_name)
+        result = self._get_attributes(
+            search_filter,
+            attributes,
+            search_base=self.get_search_base(object_type),
+            raise_exc=raise_exc,
+        )
         if not result:
             self.log(
                 'error',
@@ -278,21 +1140,57 @@ class AD(object):
         """
         Get LDAP attributes from the domain.
 
+        The domain policy attributes are served from the process-wide cache when possible.
+
         :param list attributes: the attributes from the domain to search for
         :rtype: dict
         :return: the dictionary of domain attributes, where the keys are the attribute names and
             the values are the attribute values
         """
-        search_filter = '(&(objectClass=domainDNS))'
-        result = self._get_attributes(search_filter, attributes)
-        if not result:
-            self.log(
-                'error',
-                'The LDAP attribute(s) %s on the domain couldn\'t be found',
-                ', '.join(attributes),
-            )
+        result, missing, to_search = self._get_cached_domain_attributes(attributes)
+        if not missing:
+            return result
 
-        return result
+        searched = self._get_attributes(
+            '(objectClass=domainDNS)', to_search, search_scope=ldap3.BASE
+        )
+        return self._add_searched_domain_attributes(attributes, result, missing, searched)
+
+    def _get_domain_attributes_concurrently(self, attributes):
+        """
+        Start getting LDAP attributes from the domain on another pooled connection.
+
+        This lets the domain be searched at the same time as this connection is used for another
+        search.
+
+        :param list attributes: the attributes from the domain to search for
+        :return: a future of the dictionary of domain attributes or None if they are cached, the
+            connection pool is disabled, or no pooled connection is available
+        :rtype: concurrent.futures.Future or None
+        """
+        pool = self._pool
+        if not pool or not self._get_cached_domain_attributes(attributes)[1]:
+            return None
+        # Don't wait for a connection since this request already holds one
+        connection = pool.acquire(wait=False)
+        if connection is None:
+            return None
+
+        app = current_app._get_current_object()
+        metrics = get_request_metrics()
+
+        def _get_domain_attributes():
+            # Record the search in the metrics of the request that started it
+            current_metrics.set(metrics)
+            with app.app_context():
+                ad = AD()
+                ad._connection, ad._pool = connection, pool
+                try:
+                    return ad.get_domain_attributes(attributes)
+                finally:
+                    ad.close()
+
+        return pool.executor.submit(contextvars.copy_context().run, _get_domain_attributes)
 
     def get_domain_attribute(self, attribute):
         """
@@ -304,47 +1202,93 @@ class AD(object):
         """
         return self.get_domain_attributes([attribute]).get(attribute)
 
+    def get_identity(self, sam_account_name=None, guid=None, cached=True):
+        """
+        Get a user's GUID, sAMAccountName, and distinguished name with a single search.
+
+        The identity is shared across requests for "AD_IDENTITY_CACHE_TTL" seconds.
+
+        :kwarg str sam_account_name: the sAMAccountName of the user to search for
+        :kwarg str guid: the GUID of the user to search for instead of the sAMAccountName
+        :kwarg bool cached: use the cached identity if there is one. Set this to False before
+            modifying the user since the user may have been moved or renamed.
+        :return: a dictionary with the keys guid, sam_account_name, and dn or None if the user
+            couldn't be found
+        :rtype: dict or None
+        """
+        if cached:
+            identity = self._get_cached_identity(sam_account_name, guid)
+            if identity:
+                return identity
+
+        search_filter = self._get_user_profile_filter(sam_account_name, guid)
+        attributes = self._get_attributes(
+            search_filter, self.identity_attributes, search_base=self.get_search_base('user')
+        )
+        return self._add_searched_identity(attributes, sam_account_name, guid)
+
     def get_guid(self, sam_account_name):
         """
-        Get an object's GUID (unique identifier across the AD Forest).
+        Get a user's GUID (unique identifier across the AD Forest).
 
-        :param str sam_account_name: the sAMAccountName of the LDAP object to search for
-        :return: the object's GUID in string format
+        :param str sam_account_name: the sAMAccountName of the user to search for
+        :return: the user's GUID in string format
         :rtype: str
         """
-        guid = self.get_attribute(sam_account_name, 'objectGUID')
-        if guid:
-            # ldap3 returns the GUID surrounded by curly braces for whatever reason, so remove that
-            return guid.strip('{}')
+        identity = self.get_identity(sam_account_name=sam_account_name)
+        if identity:
+            return identity['guid']
 
-    def get_dn(self, sam_account_name):
+    def get_dn(self, sam_account_name, cached=True):
         """
-        Get an object's distinguished name.
+        Get a user's distinguished name.
 
-        :param str sam_account_name: the sAMAccountName of the LDAP object to search for
-        :return: the objet's distinguished name
+        :param str sam_account_name: the sAMAccountName of the user to search for
+        :kwarg bool cached: use the cached identity if there is one
+        :return: the user's distinguished name
         :rtype: str
         """
-        return self.get_attribute(sam_account_name, 'distinguishedName')
+        identity = self.get_identity(sam_account_name=sam_account_name, cached=cached)
+        if identity:
+            return identity['dn']
 
     def get_sam_account_name(self, guid):
         """
-        Get a user's distinguished name from their GUID.
+        Get a user's sAMAccountName from their GUID.
 
         :param str guid: the GUID of the user to search for
-        :return: the user's sAMAccountNmae
+        :return: the user's sAMAccountName
         :rtype: str
+        :raises ADError: if the user couldn't be found in Active Directory
         """
-        search_filter = f'(&(objectClass=user)(objectGUID={guid}))'
-        results = self.search(search_filter, ['sAMAccountName'])
-
-        if 'attributes' in results[0]:
-            return results[0]['attributes']['sAMAccountName']
-        else:
-            self.log(
-                'error', 'The user with the GUID %s couldn\'t be found in Active Directory', guid,
-            )
+        identity = self.get_identity(guid=guid)
+        if not identity:
             raise ADError('The user couldn\'t be found in Active Directory')
+        return identity['sam_account_name']
+
+    def get_user_profile(self, sam_account_name=None, guid=None):
+        """
+        Get the attributes needed to identify and authorize a user with a single search.
+
+        The profile is cached for the duration of the AD session. The user's tokenGroups are
+        retrieved separately with get_token_group_sids since Active Directory only returns them on
+        base scope searches.
+
+        :kwarg str sam_account_name: the sAMAccountName of the user to search for
+        :kwarg str guid: the GUID of the user to search for instead of the sAMAccountName
+        :return: a dictionary with the keys guid, sam_account_name, dn, and primary_group_id
+        :rtype: dict
+        :raises ADError: if the user couldn't be found in Active Directory
+        """
+        profile = self._find_user_profile(sam_account_name, guid)
+        if profile:
+            return profile
+
+        search_filter = self._get_user_profile_filter(sam_account_name, guid)
+        attributes = self._get_attributes(
+            search_filter, self.user_profile_attributes, search_base=self.get_search_base('user')
+        )
+        return self._add_searched_user_profile(attributes, sam_account_name, guid)
 
     @property
     def min_pwd_length(self):
@@ -354,9 +1298,7 @@ class AD(object):
         :rtype: int
         :return: the minimum length a password must be
         """
-        if self._min_pwd_length is None:
-            self._min_pwd_length = self.get_domain_attribute('minPwdLength')
-        return int(self._min_pwd_length)
+        return int(self.get_domain_attribute('minPwdLength'))
 
     @property
     def pw_complexity_required(self):
@@ -386,211 +1328,205 @@ class AD(object):
         :return: if the password matches the complexity required by the domain
         """
         if self.pw_complexity_required:
-            complexity_score = 0
-            # If a capital letter is found in the password
-            if re.search(r'[A-Z]', password):
-                complexity_score += 1
-            # If a lowercase letter is found in the password
-            if re.search(r'[a-z]', password):
-                complexity_score += 1
-            # If a digit is found in the password
-            if re.search(r'\d', password):
-                complexity_score += 1
-            # If a nonletter or number is found in the password (should match any special character)
-            if re.search(r'\W', password):
-                complexity_score += 1
-
-            return complexity_score >= 3
+            return self.is_complex_password(password)
         else:
             return True
 
-    def reset_password(self, sam_account_name, new_password):
+    def _check_modify_result(self, operation, dn, succeeded):
+        """
+        Raise an exception if a modification of an object failed.
+
+        With the synchronous strategies, ldap3 returns False instead of raising an exception when
+        Active Directory rejects a modification.
+
+        :param str operation: the name of the operation for the log message
+        :param str dn: the distinguished name of the object that was modified
+        :param bool succeeded: the return value of the ldap3 operation
+        :raises ADError: if the modification failed
+        """
+        if succeeded is not True:
+            self.log(
+                'error',
+                'The %s operation on "%s" failed: %s',
+                operation,
+                dn,
+                self.connection.result,
+            )
+            raise ADError(self.unknown_error_msg)
+
+    def reset_password(self, sam_account_name, new_password, dn=None):
         """
         Reset and unlock a user's password.
 
         :param str sam_account_name: the user's sAMAccountName to reset
         :param str new_password: the user's new password
+        :kwarg str dn: the user's distinguished name from an uncached search in the same request.
+            If this isn't set, the user is searched for.
         :raises ValidationError: if the new password doesn't meet the domain standards
+        :raises ADError: if the user couldn't be found or Active Directory rejected the changes
         """
-        if not self.match_pwd_complexity(new_password):
-            raise ValidationError(
-                'The password did not match the complexity requirements. Please ensure your '
-                'password contains at least three of the four requirements: lowercase letters, '
-                'uppercase letters, numbers, and special charcters.'
-            )
-        elif not self.match_min_pwd_length(new_password):
-            raise ValidationError(
-                f'The password must be at least {self.min_pwd_length} characters long'
+        self.validate_new_password(new_password, self.min_pwd_length, self.pw_complexity_required)
+        if dn is None:
+            # Don't write to a cached distinguished name since the user may have been moved or
+            # renamed
+            dn = self.get_dn(sam_account_name, cached=False)
+        if not dn:
+            raise ADError('The user couldn\'t be found in Active Directory')
+        with timed_ldap(self.connection, 'modify_password'):
+            modified = self.connection.extend.microsoft.modify_password(
+                dn, new_password, old_password=None
             )
-        dn = self.get_dn(sam_account_name)
-        self.connection.extend.microsoft.modify_password(dn, new_password, old_password=None)
-        self.connection.extend.microsoft.unlock_account(dn)
+        self._check_modify_result('modify_password', dn, modified)
+        with timed_ldap(self.connection, 'unlock_account'):
+            unlocked = self.connection.extend.microsoft.unlock_account(dn)
+        self._check_modify_result('unlock_account', dn, unlocked)
+        self._invalidate_account_status(sam_account_name)
         self.log('info', 'The password for "%s" was reset', self.connection.user)
 
-    def check_group_membership(self, sam_account_name, group):
-        """
-        Check if the passed-in user is a member of this group (nested search).
-
-        :param str sam_account_name: the user's sAMAccountName to check group membership
-        :param str group: the group's sAMAccountName to check if the user is a member of
-        :return: a boolean determining if the user is a member of this group
-        :rtype: bool
+    def get_group(self, group):
         """
-        group_dn = self.get_dn(group)
-        # Start by seeing if the user is part of a nested group membership
-        search_filter = f'(&(objectClass=user)(memberOf:1.2.840.113556.1.4.1941:={group_dn}))'
-        results = self.search(search_filter, attributes=['sAMAccountName'])
-        members = set(
-            [user['attributes']['sAMAccountName'] for user in results if user.get('attributes')]
-        )
-        if sam_account_name in members:
-            return True
-
-        # If the user isn't part of a nested group membership, check to see if the user's primary
-        # group is the group in question
-        primary_group_id = self.get_attribute(sam_account_name, 'primaryGroupID')
-        domain_sid = self.get_domain_attribute('objectSid')
-        search_filter = f'(&(objectClass=group)(objectSid={domain_sid}-{primary_group_id}))'
-        results = self.search(search_filter, attributes=['distinguishedName'])
-        if 'attributes' in results[0] and results[0]['attributes']['distinguishedName'] == group_dn:
-            return True
+        Get a group's distinguished name and security identifier.
 
-        return False
+        The result is shared across requests for "AD_GROUP_CACHE_TTL" seconds.
 
-    def check_user_group_membership(self, user_guid):
+        :param str group: the group's sAMAccountName
+        :return: a dictionary with the distinguishedName and objectSid keys
+        :rtype: dict
         """
-        Check if the passed-in user is a regular user.
+        attributes = group_cache.get(group)
+        if attributes is None:
+            attributes = self.get_attributes(
+                group, ['distinguishedName', 'objectSid'], object_type='group'
+            )
+            ttl = self._get_config('AD_GROUP_CACHE_TTL', raise_exc=False)
+            if attributes and ttl:
+                group_cache.set(group, attributes, ttl)
+        return attributes
 
-        :param str user_guid: the user's GUID to check group membership
-        :return: a boolean determining if the user is a regular user
-        :rtype: bool
+    def get_group_sid(self, group):
         """
-        user_groups = self._get_config('AD_USER_GROUPS')
-        sam_account_name = self.get_sam_account_name(user_guid)
-        return any(self.check_group_membership(sam_account_name, group) for group in user_groups)
+        Get a group's security identifier.
 
-    def check_admin_group_membership(self, user_guid):
+        :param str group: the group's sAMAccountName
+        :return: the group's SID in string format
+        :rtype: str
         """
-        Check if the passed-in user is an admin.
+        return self.get_group(group).get('objectSid')
 
-        :param str user_guid: the user's GUID to check group membership
-        :return: a boolean determining if the user is an admin
-        :rtype: bool
+    def refresh_group_cache(self):
         """
-        admin_groups = self._get_config('AD_ADMIN_GROUPS')
-        sam_account_name = self.get_sam_account_name(user_guid)
-        return any(self.check_group_membership(sam_account_name, group) for group in admin_groups)
+        Resolve the configured user and admin groups again and store them in the group cache.
 
-    @staticmethod
-    def is_pwd_never_expires_set(user_account_control):
+        :return: a dictionary of the group sAMAccountNames to their distinguishedName and objectSid
+        :rtype: dict
         """
-        Determine if the "password never expires" flag is set.
+        groups = self._get_config('AD_USER_GROUPS') + self._get_config('AD_ADMIN_GROUPS')
+        for group in groups:
+            group_cache.pop(group)
+        if not groups:
+            return {}
+
+        # Resolve all the groups with a single search instead of a search per group
+        search_filter = build_search_filter('group', sAMAccountName=groups)
+        attributes = ['sAMAccountName', 'distinguishedName', 'objectSid']
+        found = {}
+        search_base = self.get_search_base('group')
+        for entry in self.paged_search(search_filter, attributes, search_base=search_base):
+            found[entry['attributes']['sAMAccountName'].lower()] = {
+                'distinguishedName': entry['attributes']['distinguishedName'],
+                'objectSid': entry['attributes']['objectSid'],
+            }
+
+        ttl = self._get_config('AD_GROUP_CACHE_TTL', raise_exc=False)
+        rv = {}
+        for group in groups:
+            rv[group] = found.get(group.lower(), {})
+            if not rv[group]:
+                self.log('error', 'The group "%s" couldn\'t be found in Active Directory', group)
+            elif ttl:
+                group_cache.set(group, rv[group], ttl)
+        return rv
+
+    def get_token_group_sids(self, dn):
+        """
+        Get the SIDs of all the groups an object is a member of.
 
-        :param int user_account_control: the userAccountControl LDAP attribute value of the user
-        :return: a boolean determining if the "password never expires" flag is set
-        :rtype: bool
+        This uses the constructed tokenGroups attribute, which includes nested group memberships
+        and the primary group. Active Directory only returns it on base scope searches.
+
+        :param str dn: the distinguished name of the object
+        :return: the set of group SIDs in string format
+        :rtype: set
         """
-        # See https://support.microsoft.com/en-us/help/305144/how-to-use-useraccountcontrol-to-manipulate-user-account-properties # noqa: E501
-        return (user_account_control & 65536) == 65536
+        if dn not in self._token_group_sids:
+            results = self.search(
+                '(objectClass=*)',
+                attributes=['tokenGroups'],
+                search_scope=ldap3.BASE,
+                search_base=dn,
+            )
+            token_groups = results[0].get('attributes', {}).get('tokenGroups') or []
+            self._token_group_sids[dn] = set(format_sid(sid) for sid in token_groups)
+        return self._token_group_sids[dn]
 
-    @staticmethod
-    def is_account_disabled(user_account_control):
+    def check_groups_membership(self, sam_account_name, groups):
         """
-        Determine if the account is disabled.
+        Check if the passed-in user is a member of any of the groups (nested search).
 
-        :param int user_account_control: the userAccountControl LDAP attribute value of the user
-        :return: a boolean determining if the account is disabled
+        :param str sam_account_name: the user's sAMAccountName to check group membership
+        :param list groups: the groups' sAMAccountNames to check if the user is a member of
+        :return: a boolean determining if the user is a member of any of the groups
         :rtype: bool
         """
-        # See https://support.microsoft.com/en-us/help/305144/how-to-use-useraccountcontrol-to-manipulate-user-account-properties # noqa: E501
-        return (user_account_control & 2) == 2
+        profile = self.get_user_profile(sam_account_name)
+        return self._check_profile_groups_membership(profile, groups)
 
-    @staticmethod
-    def is_account_locked_out(lockout_time, lockout_duration):
+    def _check_profile_groups_membership(self, profile, groups):
         """
-        Determine if the account is locked out.
+        Check if the user of the passed-in profile is a member of any of the groups.
 
-        :param datetime.datetime lockout_time: the datetime representation of the lockoutTime
-            LDAP attribute
-        :param datetime.datetime lockout_duration: the timedelta representation of the
-            lockoutDuration LDAP attribute
-        :return: a boolean determining if the account is locked out
+        :param dict profile: the user profile returned from get_user_profile
+        :param list groups: the groups' sAMAccountNames to check if the user is a member of
+        :return: a boolean determining if the user is a member of any of the groups
         :rtype: bool
         """
-        # If password lockouts are disabled on the domain, this can be falsey
-        if not lockout_time:
-            return False
-
-        return lockout_time + lockout_duration > datetime.now(timezone.utc)
+        token_group_sids = self.get_token_group_sids(profile['dn'])
+        return any(self.get_group_sid(group) in token_group_sids for group in groups)
 
-    @staticmethod
-    def get_unlock_date(lockout_time, lockout_duration):
+    def check_group_membership(self, sam_account_name, group):
         """
-        Determine when the account will be unlocked.
-
-        None is returned when the account is not locked out.
+        Check if the passed-in user is a member of this group (nested search).
 
-        :param datetime.datetime lockout_time: the datetime representation of the lockoutTime
-            LDAP attribute
-        :param datetime.datetime lockout_duration: the timedelta representation of the
-            lockoutDuration LDAP attribute
-        :return: the datetime of when the user's account will be unlocked
-        :rtype: datetime.datetime or None
+        :param str sam_account_name: the user's sAMAccountName to check group membership
+        :param str group: the group's sAMAccountName to check if the user is a member of
+        :return: a boolean determining if the user is a member of this group
+        :rtype: bool
         """
-        if AD.is_account_locked_out(lockout_time, lockout_duration):
-            return lockout_time + lockout_duration
+        return self.check_groups_membership(sam_account_name, [group])
 
-    @staticmethod
-    def get_pwd_expiration_date(max_pwd_age, pwd_last_set, user_account_control):
+    def check_user_group_membership(self, user_guid):
         """
-        Determine when the user's password expires.
-
-        When None is returned, it can mean a few things. It can mean the pwdLastSet LDAP attribute
-        is not set. This usually means an Active Directory administrator set the password to expire
-        at next logon. It can also mean the domain doesn't expire passwords, or the user has their
-        password set to never expire.
+        Check if the passed-in user is a regular user.
 
-        :param datetime.timedelta max_pwd_age: the timedelta representation of the maxPwdAge
-            LDAP attribute of the domain
-        :param datetime.datetime pwd_last_set: the datetime representation of the pwdLastSet LDAP
-            attribute of the user
-        :param int user_account_control: the userAccountControl LDAP attribute value of the user
-        :return: the datetime of when the user's password expires
-        :rtype: datetime.datetime or None
+        :param str user_guid: the user's GUID to check group membership
+        :return: a boolean determining if the user is a regular user
+        :rtype: bool
         """
-        # TODO: `max_pwd_age == timedelta.max` relies on:
-        # https://github.com/cannatag/ldap3/pull/708
-        if (
-            max_pwd_age == timedelta.max
-            or pwd_last_set == AD.min_filetime
-            or AD.is_pwd_never_expires_set(user_account_control)
-        ):
-            return None
-
-        return pwd_last_set + max_pwd_age
+        user_groups = self._get_config('AD_USER_GROUPS')
+        profile = self.get_user_profile(guid=user_guid)
+        return self._check_profile_groups_membership(profile, user_groups)
 
-    @staticmethod
-    def get_when_pwd_can_be_set(min_pwd_age, pwd_last_set):
+    def check_admin_group_membership(self, user_guid):
         """
-        Determine when the user's password can be set next.
-
-        When None is returned, it means the password can be set now.
+        Check if the passed-in user is an admin.
 
-        :param datetime.timedelta min_pwd_age: the timedelta representation of the minPwdAge
-            LDAP attribute of the domain
-        :param datetime.datetime pwd_last_set: the datetime representation of the pwdLastSet LDAP
-            attribute of the user
-        :return: the datetime of when the user's password can be set next
-        :rtype: datetime.datetime
+        :param str user_guid: the user's GUID to check group membership
+        :return: a boolean determining if the user is an admin
+        :rtype: bool
         """
-        if min_pwd_age == timedelta(0):
-            return None
-
-        when = pwd_last_set + min_pwd_age
-        if when < datetime.now(timezone.utc):
-            return None
-
-        return when
+        admin_groups = self._get_config('AD_ADMIN_GROUPS')
+        profile = self.get_user_profile(guid=user_guid)
+        return self._check_profile_groups_membership(profile, admin_groups)
 
     def get_account_status(self, sam_account_name):
         """
@@ -603,34 +1539,18 @@ class AD(object):
         :rtype: dict or None
         """
         self.log('info', 'Getting the account status for %s', sam_account_name)
-        domain_attributes = self.get_domain_attributes(
-            ['lockoutDuration', 'maxPwdAge', 'minPwdAge', 'minPwdLength', 'pwdProperties'],
-        )
+        # The domain and user searches are independent, so search for both at the same time
+        future = self._get_domain_attributes_concurrently(self.account_status_domain_attributes)
+        # A user that doesn't exist is cached like any other account status
         user_attributes = self.get_attributes(
-            sam_account_name, ['lockoutTime', 'pwdLastSet', 'userAccountControl'],
+            sam_account_name, self.account_status_user_attributes, raise_exc=False
         )
-        if not user_attributes:
-            return
-
-        last_set = user_attributes['pwdLastSet']
-        if last_set == AD.min_filetime:
-            last_set = None
-
-        uac = user_attributes['userAccountControl']
-        return {
-            'account_is_disabled': self.is_account_disabled(uac),
-            'account_is_locked_out': self.is_account_locked_out(
-                user_attributes['lockoutTime'], domain_attributes['lockoutDuration'],
-            ),
-            'account_is_unlocked_on': self.get_unlock_date(
-                user_attributes['lockoutTime'], domain_attributes['lockoutDuration'],
-            ),
-            'password_can_be_set_on': self.get_when_pwd_can_be_set(
-                domain_attributes['minPwdAge'], user_attributes['pwdLastSet'],
-            ),
-            'password_expires_on': self.get_pwd_expiration_date(
-                domain_attributes['maxPwdAge'], user_attributes['pwdLastSet'], uac,
-            ),
-            'password_last_set_on': last_set,
-            'password_never_expires': self.is_pwd_never_expires_set(uac),
-        }
+        if future:
+            domain_attributes = future.result()
+        else:
+            domain_attributes = self.get_domain_attributes(self.account_status_domain_attributes)
+        status = None
+        if user_attributes:
+            status = self._format_account_status(domain_attributes, user_attributes)
+        self._cache_account_status(sam_account_name, status)
+        return status
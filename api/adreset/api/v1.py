@@ -5,20 +5,19 @@ from __future__ import unicode_literals
 from datetime import datetime
 import copy
 
-from flask import Blueprint, jsonify, request, current_app
+from flask import Blueprint, jsonify, request, current_app, g
 from werkzeug.exceptions import NotFound, Unauthorized
 from six import string_types
 from flask_jwt_extended import create_access_token, jwt_required, get_raw_jwt, get_jwt_identity
 from sqlalchemy import func
 
 from adreset import version, log
-from adreset.error import ValidationError
+from adreset.error import ADError, ValidationError
 import adreset.ad
 from adreset.models import (
     Answer,
     db,
     BlacklistedToken,
-    FailedAttempt,
     Question,
     User,
 )
@@ -107,8 +106,9 @@ def login():
 
     ad = adreset.ad.AD()
     ad.login(req_json['username'], req_json['password'])
-    username = ad.get_loggedin_user()
-    guid = ad.get_guid(username)
+    profile = ad.get_loggedin_user_profile()
+    username = profile['sam_account_name']
+    guid = profile['guid']
     user = User.query.filter_by(ad_guid=guid).first()
     # If the user doesn't exist in the database, this must be their first time logging in,
     # therefore, an entry for that user must be added to the database
@@ -118,6 +118,8 @@ def login():
         db.session.add(user)
         db.session.commit()
         ad.log('debug', 'The user was successfully created in the database')
+    # Store the profile so that add_jwt_claims doesn't need to search for the user again
+    g.ad_user_profile = profile
     # The token's identity has the user's GUID since that is unique across the AD Forest and won't
     # change if the account gets renamed
     token = create_access_token(identity={'guid': user.ad_guid, 'username': username})
@@ -336,6 +338,20 @@ def add_answers():
             f'{error_prefix} supplied but {current_app.config["REQUIRED_ANSWERS"]} are required'
         )
 
+    # Get all the referenced questions in a single query. Invalid question IDs are reported in the
+    # validation loop below.
+    requested_question_ids = {
+        answer['question_id']
+        for answer in req_json
+        if isinstance(answer, dict) and isinstance(answer.get('question_id'), int)
+    }
+    questions = {}
+    if requested_question_ids:
+        questions = {
+            question.id: question
+            for question in Question.query.filter(Question.id.in_(requested_question_ids))
+        }
+
     question_ids = set()
     answer_strings = set()
     for answer in req_json:
@@ -364,7 +380,7 @@ def add_answers():
             answer['answer'] = answer['answer'].lower()
 
         # Make sure the supplied question_id maps to a real and enabled question in the database
-        question = Question.query.get(answer['question_id'])
+        question = questions.get(answer['question_id'])
         if not question:
             log.info({'message': 'The user supplied an invalid question', 'user': username})
             raise ValidationError('The "question_id" is invalid')
@@ -389,53 +405,67 @@ def add_answers():
         log.info({'message': 'The user supplied duplicate answers', 'user': username})
         raise ValidationError('One or more answers were the same. Please provide unique answers.')
 
-    # Now that the input is validated, add the entries to the database
+    # Now that the input is validated, hash the answers in parallel and add them to the database
+    hashed_answers = current_app.extensions['adreset_hashing'].hash_answers(
+        [answer['answer'] for answer in req_json]
+    )
     answer_objects = []
-    for answer in req_json:
-        hashed_answer = Answer.hash_answer(answer['answer'])
+    for answer, hashed_answer in zip(req_json, hashed_answers):
         answer_obj = Answer(
-            answer=hashed_answer, question_id=answer['question_id'], user_id=user_id
+            answer=hashed_answer, question=questions[answer['question_id']], user_id=user_id
         )
         db.session.add(answer_obj)
         answer_objects.append(answer_obj)
+    # Flush to set the IDs so that the JSON is generated without reloading the rows after the commit
+    db.session.flush()
+    answers_json = [answer.to_json() for answer in answer_objects]
     db.session.commit()
 
-    # This must be run after the session is committed because the ID needs to be set
-    answers_json = [answer.to_json() for answer in answer_objects]
     log.info({'message': 'The user successfully set their secret answers', 'user': username})
     return jsonify(answers_json), 201
 
 
-@api_v1.route('/reset', methods=['POST'])
-def reset_password():
+def _get_reset_input(req_json):
     """
-    Reset a user's password using their secret answers.
+    Validate the input of a password reset.
 
-    :rtype: flask.Response
+    :param dict req_json: the JSON of the request
+    :return: a tuple of the answers, the new password, and the username
+    :rtype: tuple
+    :raises ValidationError: if the input is invalid
     """
-    req_json = request.get_json(force=True)
     _validate_api_input(req_json, 'answers', list)
     _validate_api_input(req_json, 'new_password', string_types)
     _validate_api_input(req_json, 'username', string_types)
-    answers = req_json['answers']
-    new_password = req_json['new_password']
-    username = req_json['username']
+    return req_json['answers'], req_json['new_password'], req_json['username']
+
+
+def _get_answers_to_verify(user_id, answers, username):
+    """
+    Get the user's answers to verify after making sure they can reset their password.
 
+    :param int user_id: the user's ID in the database or None if they don't exist
+    :param list answers: the answers of the request
+    :param str username: the user's sAMAccountName
+    :return: a tuple of a dictionary of the question IDs to the user's Answer objects, the input
+        answers, and their hashed answers in the same order
+    :rtype: tuple
+    :raises ValidationError: if the user isn't set up or the answers are invalid
+    :raises Unauthorized: if the user is locked out
+    """
     not_setup_msg = (
         f'You must have configured at least {current_app.config["REQUIRED_ANSWERS"]} secret '
         'answers before resetting your password'
     )
     # Verify the user exists in the database
-    ad = adreset.ad.AD()
-    ad.service_account_login()
-    user_id = User.get_id_from_ad_username(username, ad)
     if not user_id:
         msg = 'The user attempted a password reset but does not exist in the database'
         log.debug({'message': msg, 'user': username})
         raise ValidationError(not_setup_msg)
 
     # Make sure the user isn't locked out
-    if User.is_user_locked_out(user_id):
+    lockout = current_app.extensions['adreset_lockout']
+    if lockout.is_locked_out(user_id):
         msg = 'The user attempted a password reset but their account is locked in ADReset'
         log.info({'message': msg, 'user': username})
         raise Unauthorized('Your account is locked. Please try again later.')
@@ -445,7 +475,7 @@ def reset_password():
     # the need to continuously loop through these answers looking for specific answers later on.
     q_id_to_answer_db = {}
     for answer in db_answers:
-        q_id_to_answer_db[answer.question_id] = answer.answer
+        q_id_to_answer_db[answer.question_id] = answer
 
     # Make sure the user has all their answers configured
     if len(q_id_to_answer_db.keys()) != current_app.config['REQUIRED_ANSWERS']:
@@ -489,35 +519,106 @@ def reset_password():
 
     # Only check if the answers are correct after knowing the input is valid as to not give away
     # any hints as to which answer is incorrect for an attacker
-    for answer in answers:
-        if current_app.config['CASE_SENSITIVE_ANSWERS'] is True:
-            input_answer = answer['answer']
-        else:
-            input_answer = answer['answer'].lower()
-        is_correct_answer = Answer.verify_answer(
-            input_answer, q_id_to_answer_db[answer['question_id']]
+    if current_app.config['CASE_SENSITIVE_ANSWERS'] is True:
+        input_answers = [answer['answer'] for answer in answers]
+    else:
+        input_answers = [answer['answer'].lower() for answer in answers]
+    hashed_answers = [q_id_to_answer_db[answer['question_id']].answer for answer in answers]
+    return q_id_to_answer_db, input_answers, hashed_answers
+
+
+def _reject_incorrect_answers(user_id, username):
+    """
+    Record the failed password reset attempt and reject it.
+
+    :param int user_id: the user's ID in the database
+    :param str username: the user's sAMAccountName
+    :raises Unauthorized: always
+    """
+    log.info({'message': 'The user entered an incorrect answer', 'user': username})
+    lockout = current_app.extensions['adreset_lockout']
+    lockout.add_failed_attempt(user_id)
+
+    if lockout.is_locked_out(user_id):
+        msg = 'The user failed too many password reset attempts. They are now locked out.'
+        log.info({'message': msg, 'user': username})
+        raise Unauthorized(
+            'You have answered incorrectly too many times. Your account is '
+            'now locked. Please try again later.'
         )
-        if is_correct_answer is not True:
-            log.info({'message': 'The user entered an incorrect answer', 'user': username})
-            failed_attempt = FailedAttempt(user_id=user_id, time=datetime.utcnow())
-            db.session.add(failed_attempt)
-            db.session.commit()
-
-            if User.is_user_locked_out(user_id):
-                msg = 'The user failed too many password reset attempts. They are now locked out.'
-                log.info({'message': msg, 'user': username})
-                raise Unauthorized(
-                    'You have answered incorrectly too many times. Your account is '
-                    'now locked. Please try again later.'
-                )
-            raise Unauthorized('One or more answers were incorrect. Please try again.')
+    raise Unauthorized('One or more answers were incorrect. Please try again.')
+
+
+def _rehash_answers(answers, results, q_id_to_answer_db, username):
+    """
+    Upgrade the answers that were hashed with an outdated hashing policy.
+
+    :param list answers: the answers of the request
+    :param list results: the results of verifying the answers in the same order
+    :param dict q_id_to_answer_db: the question IDs to the user's Answer objects
+    :param str username: the user's sAMAccountName
+    """
+    rehashed = False
+    for answer, (_, new_hash) in zip(answers, results):
+        if new_hash:
+            q_id_to_answer_db[answer['question_id']].answer = new_hash
+            rehashed = True
+    if rehashed:
+        db.session.commit()
+        log.info({'message': 'The user\'s secret answers were rehashed', 'user': username})
+
+
+@api_v1.route('/reset', methods=['POST'])
+def reset_password():
+    """
+    Reset a user's password using their secret answers.
+
+    :rtype: flask.Response
+    """
+    answers, new_password, username = _get_reset_input(request.get_json(force=True))
+    ad = adreset.ad.AD()
+    ad.service_account_login()
+    # Search for the user without the identity cache, and use the same result for the answers and
+    # for the password reset, so that the answers of a renamed user can't reset the password of
+    # the user that took their old sAMAccountName
+    try:
+        identity = ad.get_identity(sam_account_name=username, cached=False)
+    except ADError:
+        identity = None
+    user_id = None
+    if identity:
+        user_id = db.session.query(User.id).filter_by(ad_guid=identity['guid']).scalar()
+    q_id_to_answer_db, input_answers, hashed_answers = _get_answers_to_verify(
+        user_id, answers, username
+    )
+    # All the answers are verified concurrently and before any of them is acted upon
+    results = current_app.extensions['adreset_hashing'].verify_answers(
+        input_answers, hashed_answers
+    )
+    if not all(verified is True for verified, _ in results):
+        _reject_incorrect_answers(user_id, username)
 
     log.debug({'message': 'The user successfully answered their questions', 'user': username})
-    ad.reset_password(username, new_password)
+    ad.reset_password(username, new_password, dn=identity['dn'])
     log.info({'message': 'The user successfully reset their password', 'user': username})
+    _rehash_answers(answers, results, q_id_to_answer_db, username)
     return jsonify({}), 204
 
 
+def _serialize_account_status(status):
+    """
+    Convert all the datetime objects in the account status to ISO 8601 strings.
+
+    :param dict status: the account status returned from AD.get_account_status
+    :return: the account status that can be serialized to JSON
+    :rtype: dict
+    """
+    return {
+        key: value.strftime('%Y-%m-%dT%H:%M:%S%z') if isinstance(value, datetime) else value
+        for key, value in status.items()
+    }
+
+
 @api_v1.route('/account-status/<username>')
 def account_status(username):
     """
@@ -529,13 +630,11 @@ def account_status(username):
         raise NotFound()
 
     ad = adreset.ad.AD()
-    ad.service_account_login()
-    status = ad.get_account_status(username)
+    cached, status = ad.get_cached_account_status(username)
+    if not cached:
+        ad.service_account_login()
+        status = ad.get_account_status(username)
     if not status:
         raise NotFound('The user was not found')
 
-    # Convert all the datetime objects to ISO 8601 strings
-    for key, value in status.items():
-        if isinstance(value, datetime):
-            status[key] = value.strftime('%Y-%m-%dT%H:%M:%S%z')
-    return jsonify(status)
+    return jsonify(_serialize_account_status(status))
@@ -6,13 +6,22 @@ import os
 import platform
 from datetime import datetime
 
-from flask import Flask, current_app, request
+from flask import Flask, current_app, g, request
 from flask_jwt_extended import JWTManager
 from flask_migrate import Migrate
+from ldap3.core.exceptions import LDAPException
 from werkzeug.exceptions import default_exceptions, Unauthorized
 from sqlalchemy import func
 
 from adreset.logger import init_logging
+from adreset.pool import init_pool
+from adreset.cache import caches, init_caches
+from adreset.revocation import init_revocation
+from adreset.lockout import init_lockout
+from adreset.hashing import init_hashing
+from adreset.instrumentation import init_instrumentation
+from adreset.metrics import init_metrics
+from adreset.retention import delete_in_batches, prune as prune_tables, schedule_pruning
 from adreset.error import json_error, ValidationError, ConfigurationError, ADError
 from adreset.api.v1 import api_v1
 from adreset.models import db, BlacklistedToken, Question
@@ -78,6 +87,10 @@ def add_jwt_claims(identity):
     """
     ad = adreset.ad.AD()
     ad.service_account_login()
+    # Reuse the user's profile from the login request so that it isn't searched for again
+    profile = g.pop('ad_user_profile', None)
+    if profile and profile['guid'] == identity['guid']:
+        ad.add_user_profile(profile)
     claims = {}
     if ad.check_admin_group_membership(identity['guid']):
         claims['roles'] = ['admin']
@@ -96,8 +109,7 @@ def add_jwt_claims(identity):
     else:
         raise Unauthorized('You don\'t have access to use this application')
 
-    username = ad.get_sam_account_name(identity['guid'])
-    claims['username'] = username
+    claims['username'] = ad.get_user_profile(guid=identity['guid'])['sam_account_name']
     return claims
 
 
@@ -130,7 +142,18 @@ def create_app(config_obj=None):
             raise RuntimeError(f'You need to set the "{config}" setting')
 
     init_logging(app)
+    init_pool(app, adreset.ad.AD.create_service_connection)
+    # Return the pooled connections at the end of each request, and of the application contexts
+    # without a request such as the ones of the CLI commands
+    app.teardown_request(adreset.ad.close_sessions)
+    app.teardown_appcontext(adreset.ad.close_sessions)
+    init_caches(app)
     db.init_app(app)
+    init_revocation(app)
+    init_lockout(app)
+    init_hashing(app)
+    init_instrumentation(app)
+    init_metrics(app)
     migrations_dir = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'migrations')
     Migrate(app, db, directory=migrations_dir)
     app.cli.command()(create_db)
@@ -147,18 +170,97 @@ def create_app(config_obj=None):
     jwt = JWTManager(app)
     jwt.token_in_blacklist_loader(BlacklistedToken.is_token_revoked)
     jwt.user_claims_loader(add_jwt_claims)
+    app.cli.command()(prune)
     app.cli.command()(prune_blacklisted_tokens)
+    app.cli.command()(ad_pool_stats)
+    app.cli.command()(cache_stats)
+    app.cli.command()(invalidate_domain_cache)
+    app.cli.command()(refresh_groups)
 
     return app
 
 
+def start_worker(app):
+    """
+    Start the background work of a process that serves requests.
+
+    This is called when the process serves its first request or when the ASGI server starts, so it
+    runs in each worker after a preforking server forked it and never in the CLI commands.
+
+    :param flask.Flask app: a Flask application object
+    """
+    preload_groups(app)
+    schedule_pruning(app)
+
+
+def prune():
+    """Delete the expired blacklisted tokens and the failed attempts past their retention."""
+    for table, result in prune_tables().items():
+        rate = result['deleted'] / result['seconds'] if result['seconds'] else 0
+        print(
+            f'Removed {result["deleted"]} rows from {table} in {result["seconds"]:.2f} seconds '
+            f'({rate:.0f} rows/second)'
+        )
+
+
 def prune_blacklisted_tokens():
     """Delete blacklisted tokens that have expired from the database."""
-    expired = BlacklistedToken.query.filter(BlacklistedToken.expires < datetime.now()).all()
-    if expired:
-        print(f'Removing {len(expired)} expired blacklisted tokens')
-        for token in expired:
-            db.session.delete(token)
-        db.session.commit()
+    deleted = delete_in_batches(
+        BlacklistedToken,
+        BlacklistedToken.expires < datetime.now(),
+        current_app.config['PRUNE_BATCH_SIZE'],
+    )
+    if deleted:
+        print(f'Removed {deleted} expired blacklisted tokens')
     else:
         print('No expired blacklisted tokens to remove')
+
+
+def ad_pool_stats():
+    """Print the utilization statistics of the Active Directory connection pool."""
+    pool = current_app.extensions.get('adreset_ad_pool')
+    if not pool:
+        print('The Active Directory connection pool is disabled')
+        return
+
+    for stat, value in sorted(pool.stats().items()):
+        print(f'{stat}: {value}')
+
+
+def cache_stats():
+    """Print the hit and miss statistics of the in-process caches."""
+    for name, cache in sorted(caches.items()):
+        stats = ', '.join(f'{stat}: {value}' for stat, value in sorted(cache.stats().items()))
+        print(f'{name}: {stats}')
+
+
+def invalidate_domain_cache():
+    """Clear the cached domain policy attributes so that they are retrieved from AD again."""
+    adreset.ad.domain_cache.invalidate()
+    print('The cached domain attributes were cleared')
+
+
+def refresh_groups():
+    """Resolve the configured groups in AD and make the application refresh its cached groups."""
+    adreset.ad.group_cache.invalidate()
+    ad = adreset.ad.AD()
+    ad.service_account_login()
+    for group, attributes in sorted(ad.refresh_group_cache().items()):
+        print(f'{group}: {attributes["distinguishedName"]} ({attributes["objectSid"]})')
+
+
+def preload_groups(app):
+    """
+    Resolve the configured groups in AD so that the first logins don't have to.
+
+    A failure is logged instead of raised so that the application can start when AD is unavailable.
+
+    :param flask.Flask app: a Flask application object
+    """
+    with app.app_context():
+        try:
+            ad = adreset.ad.AD()
+            ad.service_account_login()
+            ad.refresh_group_cache()
+        except (ADError, ConfigurationError, LDAPException):
+            log.warning('The configured groups could not be resolved at startup', exc_info=True)
@@ -0,0 +1,7 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from adreset.app import create_app, start_worker
+from adreset.asgi_app import ASGIApp
+
+flask_app = create_app()
+app = ASGIApp(flask_app, on_startup=start_worker)
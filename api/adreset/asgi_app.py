@@ -0,0 +1,420 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import functools
+import io
+import json
+import sys
+import time
+
+from flask import g
+from werkzeug.exceptions import BadRequest, HTTPException, NotFound, RequestEntityTooLarge
+
+from adreset import log
+from adreset.api.v1 import (
+    _get_answers_to_verify,
+    _get_reset_input,
+    _reject_incorrect_answers,
+    _rehash_answers,
+    _serialize_account_status,
+)
+from adreset.async_ad import AsyncAD
+from adreset.error import ADError
+from adreset.instrumentation import current_metrics, RequestMetrics
+from adreset.models import db, User
+
+
+def _prepare_reset(guid, answers, username):
+    """
+    Get the user's ID and the answers to verify from the database.
+
+    :param str guid: the user's GUID or None if they weren't found in Active Directory
+    :param list answers: the answers of the request
+    :param str username: the user's sAMAccountName
+    :return: a tuple of the user's ID and the return value of _get_answers_to_verify
+    :rtype: tuple
+    """
+    user_id = None
+    if guid:
+        user_id = db.session.query(User.id).filter_by(ad_guid=guid).scalar()
+    return (user_id,) + _get_answers_to_verify(user_id, answers, username)
+
+
+def _rehash_detached_answers(answers, results, q_id_to_answer_db, username):
+    """
+    Rehash the answers that were loaded by another database session.
+
+    :param list answers: the answers of the request
+    :param list results: the results of verifying the answers in the same order
+    :param dict q_id_to_answer_db: the question IDs to the user's detached Answer objects
+    :param str username: the user's sAMAccountName
+    """
+    # The answers weren't modified, so they can be attached without loading them again
+    q_id_to_answer_db = {
+        question_id: db.session.merge(answer, load=False)
+        for question_id, answer in q_id_to_answer_db.items()
+    }
+    _rehash_answers(answers, results, q_id_to_answer_db, username)
+
+
+def _encode_headers(headers):
+    """
+    Encode the headers of a response for ASGI.
+
+    :param iterable headers: the (name, value) tuples of the headers
+    :return: a list of the encoded (name, value) tuples
+    :rtype: list
+    """
+    return [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+
+class ASGIApp(object):
+    """
+    Serve the Flask application over ASGI.
+
+    The password reset and account status routes are handled natively on the event loop with
+    AsyncAD, and their database work and answer hashing are dispatched to a thread pool, so a
+    process isn't blocked while it waits on Active Directory. All the other routes are served by
+    the Flask application in the thread pool.
+    """
+
+    def __init__(self, app, max_workers=None, on_startup=None):
+        """
+        Initialize the ASGIApp class.
+
+        :param flask.Flask app: a Flask application object
+        :kwarg int max_workers: the number of threads that run the blocking work instead of
+            "ASGI_EXECUTOR_THREADS"
+        :kwarg callable on_startup: a function that is called with the Flask application in the
+            thread pool when the ASGI server starts
+        """
+        self.app = app
+        self.on_startup = on_startup
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or app.config['ASGI_EXECUTOR_THREADS'],
+            thread_name_prefix='adreset-asgi',
+        )
+        # The Flask endpoints that are handled natively instead of by the Flask application
+        self.views = {
+            'api_v1.account_status': self.account_status,
+            'api_v1.reset_password': self.reset_password,
+        }
+
+    async def __call__(self, scope, receive, send):
+        """
+        Handle an ASGI connection.
+
+        :param dict scope: the ASGI connection scope
+        :param callable receive: the coroutine that receives the ASGI events
+        :param callable send: the coroutine that sends the ASGI events
+        """
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        elif scope['type'] != 'http':
+            raise ValueError(f'The ASGI connection type "{scope["type"]}" is not supported')
+
+        try:
+            body = await self._read_body(scope, receive, self.app.config['MAX_CONTENT_LENGTH'])
+        except RequestEntityTooLarge as error:
+            # Respond with the Flask application's error handler and hooks without the body
+            status, headers, body = await self._run(
+                self._finalize, self._get_environ(scope, b''), None, error, time.perf_counter()
+            )
+        else:
+            status, headers, body = await self._dispatch(self._get_environ(scope, body))
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _lifespan(self, receive, send):
+        """
+        Handle the startup and shutdown events of the ASGI server.
+
+        :param callable receive: the coroutine that receives the ASGI events
+        :param callable send: the coroutine that sends the ASGI events
+        """
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                loop = asyncio.get_event_loop()
+                if self.on_startup:
+                    await loop.run_in_executor(self.executor, self.on_startup, self.app)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    async def _read_body(scope, receive, max_length=None):
+        """
+        Read the whole body of the request.
+
+        :param dict scope: the ASGI connection scope
+        :param callable receive: the coroutine that receives the ASGI events
+        :kwarg int max_length: the maximum number of bytes of the body or None for no limit
+        :return: the body of the request
+        :rtype: bytes
+        :raises RequestEntityTooLarge: if the body is longer than the maximum length
+        """
+        if max_length is not None:
+            for name, value in scope.get('headers', []):
+                # Reject the body before reading it if its announced length is too long
+                if name == b'content-length' and value.isdigit() and int(value) > max_length:
+                    raise RequestEntityTooLarge()
+
+        chunks = []
+        length = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            chunk = message.get('body', b'')
+            length += len(chunk)
+            if max_length is not None and length > max_length:
+                raise RequestEntityTooLarge()
+            chunks.append(chunk)
+            if not message.get('more_body'):
+                break
+        return b''.join(chunks)
+
+    @staticmethod
+    def _get_environ(scope, body):
+        """
+        Convert the ASGI scope of a request to a WSGI environment.
+
+        :param dict scope: the ASGI connection scope
+        :param bytes body: the body of the request
+        :return: the WSGI environment
+        :rtype: dict
+        """
+        server = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        if scope.get('client'):
+            environ['REMOTE_ADDR'] = scope['client'][0]
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                name = f'HTTP_{name}'
+            value = value.decode('latin-1')
+            if name in environ and name != 'CONTENT_LENGTH':
+                value = f'{environ[name]},{value}'
+            environ[name] = value
+        return environ
+
+    async def _run(self, func, *args):
+        """
+        Run a blocking function in the thread pool.
+
+        The context variables, such as the metrics of the request, are available to the function.
+
+        :param callable func: the function to run
+        :param args: the arguments to pass to the function
+        :return: the return value of the function
+        """
+        context = contextvars.copy_context()
+        return await asyncio.get_event_loop().run_in_executor(
+            self.executor, functools.partial(context.run, func, *args)
+        )
+
+    def _call_in_app_context(self, func, *args):
+        """
+        Call the function within an application context.
+
+        :param callable func: the function to call
+        :param args: the arguments to pass to the function
+        :return: the return value of the function
+        """
+        with self.app.app_context():
+            return func(*args)
+
+    async def _run_in_app_context(self, func, *args):
+        """
+        Run a blocking function that needs an application context in the thread pool.
+
+        :param callable func: the function to run
+        :param args: the arguments to pass to the function
+        :return: the return value of the function
+        """
+        return await self._run(self._call_in_app_context, func, *args)
+
+    async def _dispatch(self, environ):
+        """
+        Route the request to a native view or the Flask application.
+
+        :param dict environ: the WSGI environment of the request
+        :return: a tuple of the status code, the encoded headers, and the body of the response
+        :rtype: tuple
+        """
+        view = None
+        # Leave the automatic OPTIONS and HEAD responses to Flask
+        if environ['REQUEST_METHOD'] in ('GET', 'POST'):
+            try:
+                endpoint, view_args = self.app.url_map.bind_to_environ(environ).match()
+                view = self.views.get(endpoint)
+            except HTTPException:
+                pass
+        if view is None:
+            return await self._run(self._call_wsgi, environ)
+
+        start = time.perf_counter()
+        metrics = RequestMetrics() if self.app.config['INSTRUMENTATION_ENABLED'] else None
+        token = current_metrics.set(metrics)
+        try:
+            try:
+                rv, error = await view(environ, **view_args), None
+            except Exception as e:
+                rv, error = None, e
+            return await self._run(self._finalize, environ, rv, error, start)
+        finally:
+            current_metrics.reset(token)
+
+    def _call_wsgi(self, environ):
+        """
+        Handle the request with the Flask application.
+
+        :param dict environ: the WSGI environment of the request
+        :return: a tuple of the status code, the encoded headers, and the body of the response
+        :rtype: tuple
+        """
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = headers
+
+        iterable = self.app(environ, start_response)
+        try:
+            body = b''.join(iterable)
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+        return response['status'], _encode_headers(response['headers']), body
+
+    def _finalize(self, environ, rv, error, start):
+        """
+        Create the response of a native view with the Flask application's error handlers and hooks.
+
+        :param dict environ: the WSGI environment of the request
+        :param rv: the return value of the view or None if it raised an exception
+        :param Exception error: the exception the view raised or None
+        :param float start: the time the request started at
+        :return: a tuple of the status code, the encoded headers, and the body of the response
+        :rtype: tuple
+        """
+        with self.app.request_context(environ):
+            # Let the after request hooks of adreset.metrics and adreset.instrumentation record the
+            # request like the ones handled by Flask
+            g.adreset_request_start = start
+            if current_metrics.get() is not None:
+                g.adreset_metrics = current_metrics.get()
+            response = None
+            if error is not None:
+                try:
+                    try:
+                        # Flask's error handlers expect to be called while handling the exception
+                        raise error
+                    except Exception as e:
+                        rv = self.app.handle_user_exception(e)
+                except Exception as e:
+                    # This returns a finalized response for the unhandled exception
+                    response = self.app.handle_exception(e)
+            if response is None:
+                response = self.app.process_response(self.app.make_response(rv))
+            # The application iterator leaves out the body of 204 and 304 responses like in WSGI
+            body = b''.join(response.get_app_iter(environ))
+            return response.status_code, _encode_headers(response.headers), body
+
+    async def account_status(self, environ, username):
+        """
+        Get general information about the account in the context of the domain.
+
+        :param dict environ: the WSGI environment of the request
+        :param str username: the sAMAccountName of the user
+        :return: the account status
+        :rtype: dict
+        """
+        if self.app.config['ACCOUNT_STATUS_ENABLED'] is False:
+            raise NotFound()
+
+        ad = AsyncAD(self.app.config)
+        cached, status = ad.get_cached_account_status(username)
+        if not cached:
+            try:
+                await ad.service_account_login()
+                status = await ad.get_account_status(username)
+            finally:
+                ad.close()
+        if not status:
+            raise NotFound('The user was not found')
+
+        return _serialize_account_status(status)
+
+    async def reset_password(self, environ):
+        """
+        Reset a user's password using their secret answers.
+
+        :param dict environ: the WSGI environment of the request
+        :return: a tuple of an empty response and the status code
+        :rtype: tuple
+        """
+        try:
+            req_json = json.loads(environ['wsgi.input'].getvalue())
+        except ValueError:
+            raise BadRequest()
+        answers, new_password, username = _get_reset_input(req_json)
+
+        ad = AsyncAD(self.app.config)
+        try:
+            await ad.service_account_login()
+            # Search for the user without the identity cache, and use the same result for the
+            # answers and for the password reset like the Flask route
+            try:
+                identity = await ad.get_identity(sam_account_name=username, cached=False)
+            except ADError:
+                identity = None
+            guid = identity['guid'] if identity else None
+            (
+                user_id,
+                q_id_to_answer_db,
+                input_answers,
+                hashed_answers,
+            ) = await self._run_in_app_context(_prepare_reset, guid, answers, username)
+            # Waiting on the hashing pool blocks, so it's done in the thread pool
+            hashing = self.app.extensions['adreset_hashing']
+            results = await self._run(hashing.verify_answers, input_answers, hashed_answers)
+            if not all(verified is True for verified, _ in results):
+                await self._run_in_app_context(_reject_incorrect_answers, user_id, username)
+
+            msg = 'The user successfully answered their questions'
+            log.debug({'message': msg, 'user': username})
+            await ad.reset_password(username, new_password, dn=identity['dn'])
+            log.info({'message': 'The user successfully reset their password', 'user': username})
+        finally:
+            ad.close()
+
+        if any(new_hash for _, new_hash in results):
+            await self._run_in_app_context(
+                _rehash_detached_answers, answers, results, q_id_to_answer_db, username
+            )
+        return {}, 204
@@ -0,0 +1,633 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+
+import ldap3
+from ldap3 import get_config_parameter
+from ldap3.core.exceptions import LDAPAttributeError, LDAPSocketOpenError
+from ldap3.core.results import RESULT_SUCCESS
+from ldap3.protocol.formatters.formatters import format_sid
+from flask import current_app
+from werkzeug.exceptions import Unauthorized
+
+from adreset.ad import BaseAD, build_search_filter, group_cache
+from adreset.error import ADError
+from adreset.instrumentation import get_filter_shape, timed_ldap
+
+
+# The threads that run the blocking parts of ldap3 for AsyncAD in this process
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor(max_workers):
+    """
+    Get the thread pool that waits on ldap3 and start it if needed.
+
+    It's separate from the thread pool of the ASGI application so that the LDAP operations in
+    flight don't take the threads of the routes served by Flask, and the other way around.
+
+    :param int max_workers: the number of threads to start the thread pool with
+    :return: the thread pool
+    :rtype: concurrent.futures.ThreadPoolExecutor
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=max_workers, thread_name_prefix='adreset-ldap'
+                )
+    return _executor
+
+
+def _reset_executor_after_fork():
+    """Make a forked process start its own threads."""
+    global _executor
+    _executor = None
+
+
+os.register_at_fork(after_in_child=_reset_executor_after_fork)
+
+
+class AsyncAD(BaseAD):
+    """
+    Abstract the Active Directory tasks for the app with asyncio.
+
+    This uses ldap3's asynchronous strategy, which sends a request without waiting for its
+    response, so independent operations on the same connection run concurrently. The methods
+    that communicate with Active Directory are coroutines with the same names and arguments as
+    the methods of the AD class.
+    """
+
+    def __init__(self, config=None):
+        """
+        Initialize the AsyncAD class.
+
+        :kwarg dict config: the Flask configuration to use instead of the one of the current
+            application
+        """
+        super(AsyncAD, self).__init__()
+        # Keep a reference to the configuration since an application context isn't guaranteed to
+        # be active when a coroutine resumes
+        self._config = config if config is not None else current_app.config
+
+    @property
+    def config(self):
+        """Return the configuration of the Flask application."""
+        return self._config
+
+    async def _run_blocking(self, func, *args):
+        """
+        Run a blocking function of ldap3 in the thread pool of AsyncAD.
+
+        :param callable func: the function to run
+        :param args: the arguments to pass to the function
+        :return: the return value of the function
+        """
+        executor = get_executor(self._get_config('AD_ASYNC_THREADS'))
+        return await asyncio.get_event_loop().run_in_executor(executor, func, *args)
+
+    def _create_connection(self):
+        """
+        Create an unopened LDAP connection to Active Directory with the asynchronous strategy.
+
+        :return: an LDAP connection to Active Directory
+        :rtype: ldap3.Connection
+        """
+        ldap_url = self._get_config('AD_LDAP_URI')
+        server = ldap3.Server(ldap_url, allowed_referral_hosts=[('*', False)], connect_timeout=3)
+        return ldap3.Connection(server, client_strategy=ldap3.ASYNC, collect_usage=True)
+
+    async def connect(self):
+        """
+        Return an unauthenticated LDAP connection to Active Directory and open it if needed.
+
+        :return: an LDAP connection to Active Directory
+        :rtype: ldap3.Connection
+        """
+        if self._connection:
+            return self._connection
+
+        connection = self._create_connection()
+        if self._get_config('AD_USE_NTLM', raise_exc=False):
+            msg = 'Configuring the Active Directory connection to use NTLM authentication'
+            self.log('debug', msg)
+            connection.authentication = ldap3.NTLM
+        else:
+            msg = 'Configuring the Active Directory connection to use SIMPLE authentication'
+            self.log('debug', msg)
+            connection.authentication = ldap3.SIMPLE
+
+        ldap_url = self._get_config('AD_LDAP_URI')
+        try:
+            self.log('debug', f'Connecting to Active Directory with the URL "{ldap_url}"')
+            with timed_ldap(connection, 'open'):
+                await self._run_blocking(connection.open)
+        except LDAPSocketOpenError:
+            msg = f'The connection to Active Directory with the URL "{ldap_url}" failed'
+            self.log('error', msg, exc_info=True)
+            raise ADError('The connection to Active Directory failed. Please try again.')
+
+        self._connection = connection
+        return connection
+
+    async def _get_response(self, message_id):
+        """
+        Wait for the response of an operation without blocking the event loop.
+
+        ldap3's public get_response method blocks until the receiver thread of the asynchronous
+        strategy has the complete response, so it waits in the thread pool of AsyncAD while the
+        other operations sent on the connection stay in flight.
+
+        :param int message_id: the message ID of the operation
+        :return: a tuple of the response entries and the result
+        :rtype: tuple
+        :raises ldap3.core.exceptions.LDAPResponseTimeoutError: if the response doesn't arrive in
+            time
+        """
+        timeout = self._connection.receive_timeout or get_config_parameter(
+            'RESPONSE_WAITING_TIMEOUT'
+        )
+        return await self._run_blocking(self._connection.get_response, message_id, timeout)
+
+    async def login(self, username, password):
+        """
+        Login to Active Directory.
+
+        :param str username: the Active Directory username
+        :param str password: the Active Directory password
+        """
+        if self._connection and self._connection.bound:
+            msg = 'The login method was called but the connection is already bound. Will reconnect.'
+            self.log('debug', msg)
+            self.close()
+        connection = await self.connect()
+
+        domain = self._get_config('AD_DOMAIN')
+        if '@' in username or '\\' in username or 'CN=' in username:
+            connection.user = username
+        else:
+            if connection.authentication == ldap3.NTLM:
+                connection.user = f'{domain}\\{username}'
+            else:
+                connection.user = f'{username}@{domain}'
+        connection.password = password
+
+        svc_account = self._get_config('AD_SERVICE_USERNAME') == username
+        # ldap3 waits for the bind response synchronously even with the asynchronous strategy
+        with timed_ldap(connection, 'bind') as details:
+            details['bound'] = bound = await self._run_blocking(connection.bind)
+        if not bound:
+            if svc_account:
+                self.log('error', 'The service account failed to login')
+                raise ADError(self.unknown_error_msg)
+            else:
+                self.log('info', 'The user "%s" failed to login', connection.user)
+                raise Unauthorized('The username or password is incorrect. Please try again.')
+
+        self._user = self._get_bound_user(username)
+        self._bound_username = username
+        if svc_account:
+            self.log('info', 'The service account logged in successfully')
+        else:
+            self.log('info', 'The user logged in successfully')
+
+    async def service_account_login(self):
+        """Login using the configured service account."""
+        await self.login(
+            self._get_config('AD_SERVICE_USERNAME'), self._get_config('AD_SERVICE_PASSWORD')
+        )
+
+    async def search(
+        self,
+        search_filter,
+        attributes=None,
+        search_scope=ldap3.SUBTREE,
+        raise_exc=True,
+        search_base=None,
+    ):
+        """
+        Search Active Directory using an LDAP filter.
+
+        :param str search_filter: the LDAP search filter to use
+        :kwarg list attributes: a list of LDAP attributes to search for
+        :kwarg str search_scope: the LDAP search scope to use
+        :kwarg bool raise_exc: raise an exception if the search yields no results
+        :kwarg str search_base: the distinguished name to search from instead of the base
+            distinguished name of the domain
+        :return: the ldap3 formatted response from Active Directory
+        :rtype: list
+        """
+        if not self._connection or not self._connection.bound:
+            raise ADError('You must be logged into LDAP to search')
+        msg = (
+            f'Searching Active Directory with "{search_filter}" and the following '
+            f'attributes: {", ".join(attributes or [])}'
+        )
+        self.log('debug', msg)
+
+        try:
+            # The bytes of concurrent operations on the connection are included in each other's
+            with timed_ldap(
+                self._connection,
+                'search',
+                filter=get_filter_shape(search_filter),
+                scope=search_scope,
+                attributes=len(attributes or []),
+            ) as details:
+                message_id = self._connection.search(
+                    search_base or self.base_dn,
+                    search_filter,
+                    search_scope=search_scope,
+                    attributes=attributes,
+                )
+                response, _ = await self._get_response(message_id)
+                details['entries'] = len(response or [])
+        except LDAPAttributeError:
+            msg = (
+                f'An invalid LDAP attribute was requested when searching for "{search_filter}" '
+                f'with attributes: {", ".join(attributes)}'
+            )
+            self.log('error', msg, exc_info=True)
+            raise ADError(self.failed_search_error)
+
+        if response:
+            return response
+
+        self.log('error', 'The search for "%s" did not yield any results', search_filter)
+        if raise_exc:
+            raise ADError(self.failed_search_error)
+
+    async def _get_attributes(
+        self,
+        search_filter,
+        attributes,
+        search_base=None,
+        search_scope=ldap3.SUBTREE,
+        raise_exc=True,
+    ):
+        """
+        Get the attributes of the first LDAP object returned from the search filter.
+
+        :param str search_filter: the LDAP search filter to use
+        :param list attributes: the attributes from the domain to search for
+        :kwarg str search_base: the distinguished name to search from instead of the base
+            distinguished name of the domain
+        :kwarg str search_scope: the LDAP search scope to use
+        :kwarg bool raise_exc: raise an exception if the search yields no results instead of
+            returning an empty dictionary
+        :rtype: dict
+        :return: the dictionary of attributes, where the keys are the attribute names and
+            the values are the attribute values
+        """
+        results = await self.search(
+            search_filter,
+            attributes,
+            search_scope=search_scope,
+            raise_exc=raise_exc,
+            search_base=search_base,
+        )
+
+        if results and 'attributes' in results[0]:
+            return {attribute: results[0]['attributes'][attribute] for attribute in attributes}
+
+        return {}
+
+    async def get_attributes(
+        self, sam_account_name, attributes, object_type='user', raise_exc=True
+    ):
+        """
+        Get an LDAP attribute from the object.
+
+        :param str sam_account_name: the sAMAccountName of the LDAP object to search for
+        :param list attributes: the list of attributes of the LDAP object to search for
+        :kwarg str object_type: "user" or "group" depending on the LDAP object to search for
+        :kwarg bool raise_exc: raise an exception if the LDAP object doesn't exist instead of
+            returning an empty dictionary
+        :rtype: dict
+        :return: the dictionary of attributes, where the keys are the attribute names and
+            the values are the attribute values
+        """
+        search_filter = build_search_filter(object_type, sAMAccountName=sam_account_name)
+        result = await self._get_attributes(
+            search_filter,
+            attributes,
+            search_base=self.get_search_base(object_type),
+            raise_exc=raise_exc,
+        )
+        if not result:
+            self.log(
+                'error',
+                'The LDAP attribute(s) %s for "%s" couldn\'t be found',
+                ', '.join(attributes),
+                sam_account_name,
+            )
+
+        return result
+
+    async def get_attribute(self, sam_account_name, attribute):
+        """
+        Get an LDAP attribute from the object.
+
+        :param str sam_account_name: the sAMAccountName of the LDAP object to search for
+        :param str attribute: the attribute of the LDAP object to search for
+        :rtype: any
+        :return: the attribute of the LDAP object
+        """
+        return (await self.get_attributes(sam_account_name, [attribute])).get(attribute)
+
+    async def get_domain_attributes(self, attributes):
+        """
+        Get LDAP attributes from the domain.
+
+        The domain policy attributes are served from the process-wide cache when possible.
+
+        :param list attributes: the attributes from the domain to search for
+        :rtype: dict
+        :return: the dictionary of domain attributes, where the keys are the attribute names and
+            the values are the attribute values
+        """
+        result, missing, to_search = self._get_cached_domain_attributes(attributes)
+        if not missing:
+            return result
+
+        searched = await self._get_attributes(
+            '(objectClass=domainDNS)', to_search, search_scope=ldap3.BASE
+        )
+        return self._add_searched_domain_attributes(attributes, result, missing, searched)
+
+    async def get_domain_attribute(self, attribute):
+        """
+        Get an LDAP attribute from the domain.
+
+        :param str attribute: the attribute from the domain to search for
+        :rtype: any
+        :return: the domain attribute
+        """
+        return (await self.get_domain_attributes([attribute])).get(attribute)
+
+    async def get_identity(self, sam_account_name=None, guid=None, cached=True):
+        """
+        Get a user's GUID, sAMAccountName, and distinguished name with a single search.
+
+        The identity is shared across requests for "AD_IDENTITY_CACHE_TTL" seconds.
+
+        :kwarg str sam_account_name: the sAMAccountName of the user to search for
+        :kwarg str guid: the GUID of the user to search for instead of the sAMAccountName
+        :kwarg bool cached: use the cached identity if there is one. Set this to False before
+            modifying the user since the user may have been moved or renamed.
+        :return: a dictionary with the keys guid, sam_account_name, and dn or None if the user
+            couldn't be found
+        :rtype: dict or None
+        """
+        if cached:
+            identity = self._get_cached_identity(sam_account_name, guid)
+            if identity:
+                return identity
+
+        search_filter = self._get_user_profile_filter(sam_account_name, guid)
+        attributes = await self._get_attributes(
+            search_filter, self.identity_attributes, search_base=self.get_search_base('user')
+        )
+        return self._add_searched_identity(attributes, sam_account_name, guid)
+
+    async def get_guid(self, sam_account_name):
+        """
+        Get a user's GUID (unique identifier across the AD Forest).
+
+        :param str sam_account_name: the sAMAccountName of the user to search for
+        :return: the user's GUID in string format
+        :rtype: str
+        """
+        identity = await self.get_identity(sam_account_name=sam_account_name)
+        if identity:
+            return identity['guid']
+
+    async def get_dn(self, sam_account_name, cached=True):
+        """
+        Get a user's distinguished name.
+
+        :param str sam_account_name: the sAMAccountName of the user to search for
+        :kwarg bool cached: use the cached identity if there is one
+        :return: the user's distinguished name
+        :rtype: str
+        """
+        identity = await self.get_identity(sam_account_name=sam_account_name, cached=cached)
+        if identity:
+            return identity['dn']
+
+    async def get_user_profile(self, sam_account_name=None, guid=None):
+        """
+        Get the attributes needed to identify and authorize a user with a single search.
+
+        :kwarg str sam_account_name: the sAMAccountName of the user to search for
+        :kwarg str guid: the GUID of the user to search for instead of the sAMAccountName
+        :return: a dictionary with the keys guid, sam_account_name, dn, and primary_group_id
+        :rtype: dict
+        :raises ADError: if the user couldn't be found in Active Directory
+        """
+        profile = self._find_user_profile(sam_account_name, guid)
+        if profile:
+            return profile
+
+        search_filter = self._get_user_profile_filter(sam_account_name, guid)
+        attributes = await self._get_attributes(
+            search_filter, self.user_profile_attributes, search_base=self.get_search_base('user')
+        )
+        return self._add_searched_user_profile(attributes, sam_account_name, guid)
+
+    async def _modify(self, operation, dn, changes):
+        """
+        Modify an object in Active Directory and wait for the result.
+
+        :param str operation: the name of the operation for the metrics
+        :param str dn: the distinguished name of the object to modify
+        :param dict changes: the changes in the format of ldap3.Connection.modify
+        :raises ADError: if Active Directory rejected the changes
+        """
+        with timed_ldap(self._connection, operation):
+            message_id = self._connection.modify(dn, changes)
+            _, result = await self._get_response(message_id)
+        if result['result'] != RESULT_SUCCESS:
+            self.log('error', 'The %s operation on "%s" failed: %s', operation, dn, result)
+            raise ADError(self.unknown_error_msg)
+
+    async def reset_password(self, sam_account_name, new_password, dn=None):
+        """
+        Reset and unlock a user's password.
+
+        :param str sam_account_name: the user's sAMAccountName to reset
+        :param str new_password: the user's new password
+        :kwarg str dn: the user's distinguished name from an uncached search in the same request.
+            If this isn't set, the user is searched for.
+        :raises ValidationError: if the new password doesn't meet the domain standards
+        :raises ADError: if the user couldn't be found or Active Directory rejected the changes
+        """
+        if dn is None:
+            # Don't write to a cached distinguished name since the user may have been moved or
+            # renamed
+            domain_attributes, dn = await asyncio.gather(
+                self.get_domain_attributes(['minPwdLength', 'pwdProperties']),
+                self.get_dn(sam_account_name, cached=False),
+            )
+        else:
+            domain_attributes = await self.get_domain_attributes(['minPwdLength', 'pwdProperties'])
+        if not dn:
+            raise ADError('The user couldn\'t be found in Active Directory')
+        self.validate_new_password(
+            new_password,
+            int(domain_attributes['minPwdLength']),
+            bool(domain_attributes['pwdProperties']),
+        )
+        # This is the same request as ldap3's extend.microsoft.modify_password without waiting for
+        # the response synchronously
+        encoded_password = f'"{new_password}"'.encode('utf-16-le')
+        await self._modify(
+            'modify_password', dn, {'unicodePwd': [(ldap3.MODIFY_REPLACE, [encoded_password])]}
+        )
+        await self._modify('unlock_account', dn, {'lockoutTime': [(ldap3.MODIFY_REPLACE, ['0'])]})
+        self._invalidate_account_status(sam_account_name)
+        self.log('info', 'The password for "%s" was reset', self._connection.user)
+
+    async def get_group(self, group):
+        """
+        Get a group's distinguished name and security identifier.
+
+        The result is shared across requests for "AD_GROUP_CACHE_TTL" seconds.
+
+        :param str group: the group's sAMAccountName
+        :return: a dictionary with the distinguishedName and objectSid keys
+        :rtype: dict
+        """
+        attributes = group_cache.get(group)
+        if attributes is None:
+            attributes = await self.get_attributes(
+                group, ['distinguishedName', 'objectSid'], object_type='group'
+            )
+            ttl = self._get_config('AD_GROUP_CACHE_TTL', raise_exc=False)
+            if attributes and ttl:
+                group_cache.set(group, attributes, ttl)
+        return attributes
+
+    async def get_group_sid(self, group):
+        """
+        Get a group's security identifier.
+
+        :param str group: the group's sAMAccountName
+        :return: the group's SID in string format
+        :rtype: str
+        """
+        return (await self.get_group(group)).get('objectSid')
+
+    async def get_token_group_sids(self, dn):
+        """
+        Get the SIDs of all the groups an object is a member of.
+
+        :param str dn: the distinguished name of the object
+        :return: the set of group SIDs in string format
+        :rtype: set
+        """
+        if dn not in self._token_group_sids:
+            results = await self.search(
+                '(objectClass=*)',
+                attributes=['tokenGroups'],
+                search_scope=ldap3.BASE,
+                search_base=dn,
+            )
+            token_groups = results[0].get('attributes', {}).get('tokenGroups') or []
+            self._token_group_sids[dn] = set(format_sid(sid) for sid in token_groups)
+        return self._token_group_sids[dn]
+
+    async def _check_profile_groups_membership(self, profile, groups):
+        """
+        Check if the user of the passed-in profile is a member of any of the groups.
+
+        The user's tokenGroups and the groups' SIDs are retrieved concurrently.
+
+        :param dict profile: the user profile returned from get_user_profile
+        :param list groups: the groups' sAMAccountNames to check if the user is a member of
+        :return: a boolean determining if the user is a member of any of the groups
+        :rtype: bool
+        """
+        token_group_sids, *group_sids = await asyncio.gather(
+            self.get_token_group_sids(profile['dn']),
+            *(self.get_group_sid(group) for group in groups),
+        )
+        return any(group_sid in token_group_sids for group_sid in group_sids)
+
+    async def check_groups_membership(self, sam_account_name, groups):
+        """
+        Check if the passed-in user is a member of any of the groups (nested search).
+
+        :param str sam_account_name: the user's sAMAccountName to check group membership
+        :param list groups: the groups' sAMAccountNames to check if the user is a member of
+        :return: a boolean determining if the user is a member of any of the groups
+        :rtype: bool
+        """
+        profile = await self.get_user_profile(sam_account_name)
+        return await self._check_profile_groups_membership(profile, groups)
+
+    async def check_group_membership(self, sam_account_name, group):
+        """
+        Check if the passed-in user is a member of this group (nested search).
+
+        :param str sam_account_name: the user's sAMAccountName to check group membership
+        :param str group: the group's sAMAccountName to check if the user is a member of
+        :return: a boolean determining if the user is a member of this group
+        :rtype: bool
+        """
+        return await self.check_groups_membership(sam_account_name, [group])
+
+    async def check_user_group_membership(self, user_guid):
+        """
+        Check if the passed-in user is a regular user.
+
+        :param str user_guid: the user's GUID to check group membership
+        :return: a boolean determining if the user is a regular user
+        :rtype: bool
+        """
+        user_groups = self._get_config('AD_USER_GROUPS')
+        profile = await self.get_user_profile(guid=user_guid)
+        return await self._check_profile_groups_membership(profile, user_groups)
+
+    async def check_admin_group_membership(self, user_guid):
+        """
+        Check if the passed-in user is an admin.
+
+        :param str user_guid: the user's GUID to check group membership
+        :return: a boolean determining if the user is an admin
+        :rtype: bool
+        """
+        admin_groups = self._get_config('AD_ADMIN_GROUPS')
+        profile = await self.get_user_profile(guid=user_guid)
+        return await self._check_profile_groups_membership(profile, admin_groups)
+
+    async def get_account_status(self, sam_account_name):
+        """
+        Get general information about the account in the context of the domain.
+
+        The domain and user attributes are searched for concurrently. If the user can't be found
+        in LDAP, None is returned.
+
+        :param str sam_account_name: the sAMAccountName of the LDAP object to search for
+        :return: a dictionary with general information about the account or None
+        :rtype: dict or None
+        """
+        self.log('info', 'Getting the account status for %s', sam_account_name)
+        domain_attributes, user_attributes = await asyncio.gather(
+            self.get_domain_attributes(self.account_status_domain_attributes),
+            self.get_attributes(
+                sam_account_name, self.account_status_user_attributes, raise_exc=False
+            ),
+        )
+        status = None
+        if user_attributes:
+            status = self._format_account_status(domain_attributes, user_attributes)
+        self._cache_account_status(sam_account_name, status)
+        return status
@@ -0,0 +1,165 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+import os
+import threading
+import time
+
+
+# All the caches in the process by name so that they can be inspected and cleared together
+caches = {}
+
+
+class TTLCache(object):
+    """A thread-safe and size-bounded LRU cache where the entries expire after a time to live."""
+
+    def __init__(self, name, maxsize=1024, ttl=60):
+        """
+        Initialize the TTLCache class and register it in the process-wide list of caches.
+
+        :param str name: the name of the cache
+        :kwarg int maxsize: the maximum number of entries before the least recently used entry is
+            evicted
+        :kwarg int ttl: the default number of seconds an entry is valid for
+        """
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # Maps the key to a (value, expires) tuple, ordered from least to most recently used
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # A file whose modification time signals that the cache was invalidated by another process
+        # such as a CLI command
+        self.invalidation_file = None
+        self._cleared_at = time.time()
+        self._next_invalidation_check = 0
+        caches[name] = self
+
+    def __len__(self):
+        """Return the number of entries in the cache, including the expired ones."""
+        return len(self._entries)
+
+    def _check_invalidation_file(self):
+        """
+        Clear the cache if another process invalidated it since it was last cleared.
+
+        The invalidation file is checked at most once a second. This must be called with the lock
+        acquired.
+        """
+        now = time.monotonic()
+        if not self.invalidation_file or now < self._next_invalidation_check:
+            return
+
+        self._next_invalidation_check = now + 1
+        try:
+            invalidated_at = os.path.getmtime(self.invalidation_file)
+        except OSError:
+            return
+
+        if invalidated_at > self._cleared_at:
+            self._entries.clear()
+            self._cleared_at = time.time()
+
+    def get(self, key, default=None):
+        """
+        Get an entry from the cache.
+
+        :param any key: the key of the entry
+        :kwarg any default: the value to return if the entry isn't cached or is expired
+        :return: the cached value or the default
+        :rtype: any
+        """
+        with self._lock:
+            self._check_invalidation_file()
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        """
+        Add or replace an entry in the cache.
+
+        :param any key: the key of the entry
+        :param any value: the value to cache
+        :kwarg int ttl: the number of seconds the entry is valid for instead of the default
+        """
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        """
+        Remove an entry from the cache.
+
+        :param any key: the key of the entry
+        :kwarg any default: the value to return if the entry isn't cached
+        :return: the removed value or the default
+        :rtype: any
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is None:
+            return default
+        return entry[0]
+
+    def clear(self):
+        """Remove all the entries from the cache."""
+        with self._lock:
+            self._entries.clear()
+            self._cleared_at = time.time()
+
+    def invalidate(self):
+        """Clear the cache in this process and in the processes sharing the invalidation file."""
+        self.clear()
+        if self.invalidation_file:
+            os.makedirs(os.path.dirname(self.invalidation_file), exist_ok=True)
+            with open(self.invalidation_file, 'a'):
+                os.utime(self.invalidation_file)
+
+    def stats(self):
+        """
+        Get the statistics of the cache.
+
+        :return: a dictionary of the cache statistics
+        :rtype: dict
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+def init_caches(app):
+    """
+    Configure the in-process caches on the Flask application.
+
+    :param flask.Flask app: a Flask application object
+    """
+    directory = app.config.get('CACHE_INVALIDATION_DIR')
+    for name, cache in caches.items():
+        if directory:
+            cache.invalidation_file = os.path.join(directory, f'{name}.invalidated')
+        else:
+            cache.invalidation_file = None
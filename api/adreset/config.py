@@ -4,6 +4,7 @@ from __future__ import unicode_literals
 
 import os.path
 from datetime import timedelta
+import tempfile
 
 base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir))
 
@@ -25,6 +26,16 @@ class Config(object):
     JWT_IDENTITY_CLAIM = 'sub'
     # Default the access tokens to expire after one hour
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=1)
+    # Where revoked tokens are stored. This can be "sql" for the database, "memory" for a single
+    # process deployment, or "redis" for a server that speaks the Redis protocol, which requires the
+    # "redis" package.
+    JWT_REVOCATION_BACKEND = 'sql'
+    # The "sql" backend keeps the revoked tokens in memory. These are the number of seconds between
+    # loading the tokens revoked by other processes and between reloading all of them.
+    JWT_REVOCATION_REFRESH_SECONDS = 1
+    JWT_REVOCATION_FULL_REFRESH_SECONDS = 300
+    JWT_REVOCATION_REDIS_URL = 'redis://localhost:6379/0'
+    JWT_REVOCATION_REDIS_PREFIX = 'adreset:revoked:'
     CORS_ORIGINS = []
     AD_USE_NTLM = True
     REQUIRED_ANSWERS = 3
@@ -33,7 +44,98 @@ class Config(object):
     ANSWERS_MINIMUM_LENGTH = 2
     LOCKOUT_MINUTES = 15
     ATTEMPTS_BEFORE_LOCKOUT = 3
+    # The failed password reset attempts are tracked in memory. These are the number of seconds
+    # between loading the attempts of other processes and between writing the attempts to the
+    # database, and the number of queued attempts that triggers an early write.
+    LOCKOUT_REFRESH_SECONDS = 1
+    LOCKOUT_FLUSH_SECONDS = 1
+    LOCKOUT_FLUSH_BATCH_SIZE = 100
+    # The number of days to keep failed attempts after they no longer count towards a lockout
+    FAILED_ATTEMPT_RETENTION_DAYS = 30
+    # The maximum number of rows deleted by a single statement when pruning the database
+    PRUNE_BATCH_SIZE = 1000
+    # The number of seconds between pruning the database from the application process. This is
+    # disabled by default so that pruning can be scheduled with the "flask prune" command instead.
+    PRUNE_INTERVAL_SECONDS = 0
     ACCOUNT_STATUS_ENABLED = True
+    # The number of seconds to cache the account status of a user. It is cleared when the user
+    # resets their password. Set this to 0 to disable the cache.
+    ACCOUNT_STATUS_CACHE_TTL = 5
+    # The number of seconds to cache that a user wasn't found when getting their account status.
+    # Set this to 0 to disable the cache.
+    ACCOUNT_STATUS_NOT_FOUND_CACHE_TTL = 30
+    # The passlib CryptContext settings used to hash the secret answers. New answers are hashed with
+    # the first scheme and its settings. Answers hashed with another scheme or different rounds are
+    # rehashed after the user's next successful password reset. For example:
+    # {"schemes": ["bcrypt", "sha512_crypt"], "deprecated": "auto", "bcrypt__rounds": 12}
+    ANSWER_HASHING = {
+        'schemes': ['sha512_crypt'],
+        'deprecated': 'auto',
+        'sha512_crypt__rounds': 656000,
+    }
+    # The number of worker processes that hash and verify secret answers in parallel. Every process
+    # of the application server starts its own pool, so keep this small to not oversubscribe the
+    # CPUs. Set this to 0 to hash them in the request's thread.
+    ANSWER_HASHING_POOL_SIZE = min(os.cpu_count() or 1, 4)
+    # The maximum number of service account connections to keep open to Active Directory. Set this
+    # to 0 to disable the connection pool.
+    AD_POOL_SIZE = 10
+    # The number of seconds after which a pooled connection is closed and replaced
+    AD_POOL_MAX_AGE = 600
+    # The number of seconds to wait for a pooled connection when all of them are in use
+    AD_POOL_TIMEOUT = 5
+    # The number of seconds a pooled connection can sit idle before it is verified on checkout
+    AD_POOL_HEALTH_CHECK_INTERVAL = 60
+    # The number of entries requested per page by searches that can return many entries. This must
+    # not be larger than the MaxPageSize of the domain controllers, which is 1000 by default.
+    AD_SEARCH_PAGE_SIZE = 500
+    # The distinguished names to search for users and groups from, such as
+    # "OU=Employees,DC=example,DC=local". Searching from the organizational unit the objects are in
+    # instead of the whole domain makes the searches cheaper for the domain controllers. These
+    # default to the base distinguished name of the domain when they are None.
+    AD_USERS_SEARCH_BASE = None
+    AD_GROUPS_SEARCH_BASE = None
+    # The number of seconds to cache the domain's password and lockout policies. Set this to 0 to
+    # disable the cache.
+    AD_DOMAIN_CACHE_TTL = 3600
+    # The number of seconds to cache the distinguished names and SIDs of the configured groups. Set
+    # this to 0 to disable the cache.
+    AD_GROUP_CACHE_TTL = 3600
+    # The number of seconds to cache the GUIDs, sAMAccountNames, and distinguished names of users. A
+    # renamed user's old sAMAccountName is dropped from the cache once the user is searched for by
+    # their GUID or new sAMAccountName. Set this to 0 to disable the cache.
+    AD_IDENTITY_CACHE_TTL = 600
+    # The maximum number of threads per process that the ASGI application uses to bind and to wait
+    # for the responses of Active Directory. This limits the LDAP operations in flight and is
+    # separate from ASGI_EXECUTOR_THREADS.
+    AD_ASYNC_THREADS = 64
+    # The directory used by CLI commands to signal the application processes to clear their caches.
+    # It must be writable by the user running the CLI commands and readable by the application.
+    CACHE_INVALIDATION_DIR = os.path.join(tempfile.gettempdir(), 'adreset')
+    # Time the LDAP, SQL, and hashing operations of every request and log them with the request
+    INSTRUMENTATION_ENABLED = True
+    # Add a Server-Timing header with the time spent on LDAP, SQL, and hashing to every response.
+    # This requires INSTRUMENTATION_ENABLED and exposes timing information to the clients.
+    SERVER_TIMING_ENABLED = False
+    # The maximum number of log messages waiting to be written to stdout by the background logging
+    # thread. Set this to 0 to write the messages in the thread that logs them.
+    LOG_QUEUE_SIZE = 10000
+    # What to do with a log message when the queue is full: "drop" it and count it in the
+    # adreset_log_messages_dropped_total metric, or "block" the thread until there is room
+    LOG_QUEUE_FULL_POLICY = 'drop'
+    # The maximum number of log messages written to stdout at once
+    LOG_BATCH_SIZE = 100
+    # Serve the metrics of each application process in the Prometheus text format on /metrics
+    METRICS_ENABLED = False
+    # The IP addresses or networks in CIDR notation that may read /metrics. The address is the one
+    # of the client connected to the application server, so behind a reverse proxy, block /metrics
+    # in the proxy instead. Set this to None to allow every client.
+    METRICS_ALLOWED_NETWORKS = ['127.0.0.1/32', '::1/128']
+    # The maximum number of bytes of a request's body. Longer requests are rejected with a 413.
+    MAX_CONTENT_LENGTH = 1024 * 1024
+    # The number of threads the ASGI application uses for the database, answer hashing, and the
+    # routes that aren't handled on its event loop
+    ASGI_EXECUTOR_THREADS = 32
 
 
 class ProdConfig(Config):
@@ -64,3 +166,20 @@ class TestConfig(Config):
     AD_ADMIN_GROUPS = ['ADReset Admins']
     AD_SERVICE_USERNAME = 'CN=testuser,OU=ADReset,DC=adreset,DC=local'
     AD_SERVICE_PASSWORD = 'P@ssw0rd'
+    # The mock LDAP directory is not reachable through new connections, so don't pool them
+    AD_POOL_SIZE = 0
+    CACHE_INVALIDATION_DIR = None
+    # The database is recreated for every test, so always reload the revoked tokens
+    JWT_REVOCATION_REFRESH_SECONDS = 0
+    JWT_REVOCATION_FULL_REFRESH_SECONDS = 0
+    # Write the failed attempts synchronously and always load the ones added by the tests
+    LOCKOUT_REFRESH_SECONDS = 0
+    LOCKOUT_FLUSH_SECONDS = 0
+    ANSWER_HASHING_POOL_SIZE = 0
+    METRICS_ENABLED = True
+    # Hash with the fewest rounds allowed so that the tests are fast
+    ANSWER_HASHING = {
+        'schemes': ['sha512_crypt'],
+        'deprecated': 'auto',
+        'sha512_crypt__rounds': 1000,
+    }
@@ -0,0 +1,147 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import threading
+
+from passlib.context import CryptContext
+
+from adreset.hashing_worker import hash_answer, verify_and_update_answer
+from adreset.instrumentation import timed
+from adreset import log
+
+
+def _get_mp_context():
+    """
+    Get the multiprocessing context that starts the worker processes without forking this process.
+
+    :return: the multiprocessing context of the fork server or of spawned processes on platforms
+        without a fork server such as Windows
+    :rtype: multiprocessing.context.BaseContext
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+class HashingPool(object):
+    """
+    Run the CPU-bound hashing of secret answers concurrently in worker processes.
+
+    The hashes hold the GIL, so threads wouldn't run them in parallel. The worker processes are
+    only started on first use so that they are created after the application server forks its
+    workers. If a worker process dies, the pool is replaced and the work is retried once.
+
+    The worker processes aren't forked from the application since a fork of a multi-threaded
+    process can deadlock on a lock held by another thread. They are started from a fork server
+    where available or spawned otherwise, and only import the ``adreset.hashing_worker`` module.
+    """
+
+    def __init__(self, context, size=4):
+        """
+        Initialize the HashingPool class.
+
+        :param passlib.context.CryptContext context: the hashing policy of the answers
+        :kwarg int size: the number of worker processes. Set this to 0 to hash in the calling
+            thread.
+        """
+        self.context = context
+        # The worker processes receive the policy as a string and build their own CryptContext
+        self.policy = context.to_string()
+        self.size = size
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        """Return the process pool executor and start it if needed."""
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.size, mp_context=_get_mp_context()
+                    )
+        return self._executor
+
+    def map(self, func, *iterables):
+        """
+        Run the function on every item of the iterables and wait for all the results.
+
+        :param callable func: a function of ``adreset.hashing_worker`` to run in the worker
+            processes
+        :param iterables: the iterables of the arguments to pass to the function
+        :return: the results in the order of the arguments
+        :rtype: list
+        """
+        if not self.size:
+            return list(map(func, *iterables))
+
+        # The iterables may be consumed by the first attempt
+        iterables = [list(iterable) for iterable in iterables]
+        executor = self.executor
+        try:
+            return list(executor.map(func, *iterables))
+        except BrokenProcessPool:
+            log.warning('A hashing worker process died. Restarting the hashing pool.')
+            self._discard_executor(executor)
+            return list(self.executor.map(func, *iterables))
+
+    def _discard_executor(self, executor):
+        """
+        Stop a broken executor so that a new one is started on next use.
+
+        :param concurrent.futures.ProcessPoolExecutor executor: the broken executor
+        """
+        with self._lock:
+            # Another thread may have already replaced it
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    def hash_answers(self, answers):
+        """
+        Hash all the answers concurrently.
+
+        :param list answers: the answers to hash
+        :return: the hashed answers in the same order
+        :rtype: list
+        """
+        with timed('hash', 'hash_answers', answers=len(answers)):
+            return self.map(hash_answer, [self.policy] * len(answers), answers)
+
+    def verify_answers(self, input_answers, hashed_answers):
+        """
+        Verify all the answers concurrently.
+
+        Every answer is verified even if another answer is incorrect so that the response time
+        doesn't reveal which answer was incorrect.
+
+        :param list input_answers: the answers to verify
+        :param list hashed_answers: the hashed answers to verify against in the same order
+        :return: a list of tuples of a boolean determining if each answer matches and the new hash
+            if the answer needs to be rehashed or None
+        :rtype: list
+        """
+        policies = [self.policy] * len(input_answers)
+        with timed('hash', 'verify_answers', answers=len(input_answers)):
+            return self.map(verify_and_update_answer, policies, input_answers, hashed_answers)
+
+    def shutdown(self):
+        """Stop the worker processes."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+def init_hashing(app):
+    """
+    Initialize the pool that hashes secret answers on the Flask application.
+
+    :param flask.Flask app: a Flask application object
+    """
+    context = CryptContext(**app.config['ANSWER_HASHING'])
+    app.extensions['adreset_hashing'] = HashingPool(context, app.config['ANSWER_HASHING_POOL_SIZE'])
@@ -0,0 +1,52 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+# The worker processes of the hashing pool import this module from scratch, so it must only import
+# what the hashing needs and not the Flask application
+
+from __future__ import unicode_literals
+
+from passlib.context import CryptContext
+
+# The CryptContext objects created in this process by their serialized policy
+_contexts = {}
+
+
+def get_context(policy):
+    """
+    Get the CryptContext of a serialized policy and cache it in this process.
+
+    :param str policy: the policy serialized by CryptContext.to_string
+    :return: the CryptContext of the policy
+    :rtype: passlib.context.CryptContext
+    """
+    context = _contexts.get(policy)
+    if context is None:
+        context = CryptContext.from_string(policy)
+        _contexts[policy] = context
+    return context
+
+
+def hash_answer(policy, answer):
+    """
+    Hash an answer with the default scheme of the policy.
+
+    :param str policy: the policy serialized by CryptContext.to_string
+    :param str answer: the answer to hash
+    :return: the hashed answer
+    :rtype: str
+    """
+    return get_context(policy).hash(answer)
+
+
+def verify_and_update_answer(policy, input_answer, hashed_answer):
+    """
+    Verify an answer against its hash and rehash it if the hash doesn't match the policy.
+
+    :param str policy: the policy serialized by CryptContext.to_string
+    :param str input_answer: the answer to verify
+    :param str hashed_answer: the hashed answer to verify against
+    :return: a tuple of a boolean determining if the answers match and the new hash if the answer
+        needs to be rehashed or None
+    :rtype: tuple
+    """
+    return get_context(policy).verify_and_update(input_answer, hashed_answer)
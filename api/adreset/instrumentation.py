@@ -0,0 +1,239 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+from contextlib import contextmanager
+import contextvars
+import re
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from adreset import log
+from adreset.metrics import observe_operation
+
+
+# Matches the values in an LDAP filter so that they can be removed
+_filter_value = re.compile(r'=[^()]*\)')
+# The metrics of the current request when it isn't handled by a Flask view, such as the requests
+# handled natively by the ASGI application
+current_metrics = contextvars.ContextVar('adreset_metrics', default=None)
+
+
+def get_filter_shape(search_filter):
+    """
+    Remove the values from an LDAP filter so that searches can be grouped without logging them.
+
+    :param str search_filter: the LDAP filter
+    :return: the LDAP filter with every value replaced with a question mark
+    :rtype: str
+    """
+    return _filter_value.sub('=?)', search_filter)
+
+
+class RequestMetrics(object):
+    """Collect the timings of the LDAP, SQL, and hashing operations of a request."""
+
+    def __init__(self):
+        """Initialize the RequestMetrics class."""
+        self.start = time.perf_counter()
+        # Maps the category to a dictionary with the number of operations and their duration
+        self.totals = {}
+        self.ldap_operations = []
+        # Operations of the same request can run concurrently in the connection pool's threads
+        self._lock = threading.Lock()
+
+    def add(self, category, operation, duration, details):
+        """
+        Add a completed operation to the metrics.
+
+        :param str category: the category of the operation such as "ldap", "sql", or "hash"
+        :param str operation: the name of the operation
+        :param float duration: the number of seconds the operation took
+        :param dict details: additional information about the operation
+        """
+        with self._lock:
+            totals = self.totals.setdefault(category, {'count': 0, 'duration': 0.0})
+            totals['count'] += 1
+            totals['duration'] += duration
+            if category == 'ldap':
+                self.ldap_operations.append(
+                    dict(details, operation=operation, duration_ms=round(duration * 1000, 3))
+                )
+
+    def summary(self):
+        """
+        Summarize the metrics for the log.
+
+        :return: a dictionary of the metrics
+        :rtype: dict
+        """
+        rv = {'duration_ms': round((time.perf_counter() - self.start) * 1000, 3)}
+        for category, totals in sorted(self.totals.items()):
+            rv[category] = {
+                'count': totals['count'],
+                'duration_ms': round(totals['duration'] * 1000, 3),
+            }
+        if self.ldap_operations:
+            rv['ldap']['operations'] = self.ldap_operations
+        return rv
+
+    def server_timing(self):
+        """
+        Format the metrics as the value of a Server-Timing header.
+
+        :return: the value of the Server-Timing header
+        :rtype: str
+        """
+        metrics = []
+        for category, totals in sorted(self.totals.items()):
+            metrics.append(
+                f'{category};dur={totals["duration"] * 1000:.3f};desc="{totals["count"]} '
+                'operations"'
+            )
+        metrics.append(f'total;dur={(time.perf_counter() - self.start) * 1000:.3f}')
+        return ', '.join(metrics)
+
+
+def get_request_metrics():
+    """
+    Get the metrics of the current request.
+
+    :return: the metrics of the current request or None if there isn't one or it isn't instrumented
+    :rtype: RequestMetrics or None
+    """
+    metrics = current_metrics.get()
+    if metrics is not None:
+        return metrics
+    if not has_request_context():
+        return None
+    return g.get('adreset_metrics')
+
+
+def record(category, operation, duration, **details):
+    """
+    Record a completed operation in the process metrics and the metrics of the current request.
+
+    :param str category: the category of the operation such as "ldap", "sql", or "hash"
+    :param str operation: the name of the operation
+    :param float duration: the number of seconds the operation took
+    :kwarg details: additional information about the operation
+    """
+    observe_operation(category, operation, duration, details)
+    metrics = get_request_metrics()
+    if metrics is not None:
+        metrics.add(category, operation, duration, details)
+
+
+@contextmanager
+def timed(category, operation, **details):
+    """
+    Time the operation and record it in the metrics of the current request.
+
+    :param str category: the category of the operation such as "ldap", "sql", or "hash"
+    :param str operation: the name of the operation
+    :kwarg details: additional information about the operation
+    :return: the details dictionary which can be updated while the operation runs
+    :rtype: dict
+    """
+    start = time.perf_counter()
+    try:
+        yield details
+    except Exception as error:
+        details['error'] = type(error).__name__
+        raise
+    finally:
+        record(category, operation, time.perf_counter() - start, **details)
+
+
+@contextmanager
+def timed_ldap(connection, operation, **details):
+    """
+    Time the LDAP operation and record it with the bytes sent and received on the connection.
+
+    :param ldap3.Connection connection: the connection the operation is run on
+    :param str operation: the name of the operation
+    :kwarg details: additional information about the operation
+    :return: the details dictionary which can be updated while the operation runs
+    :rtype: dict
+    """
+    usage = getattr(connection, 'usage', None)
+    if usage:
+        bytes_sent, bytes_received = usage.bytes_transmitted, usage.bytes_received
+    with timed('ldap', operation, **details) as details:
+        try:
+            yield details
+        finally:
+            if usage:
+                details['bytes_sent'] = usage.bytes_transmitted - bytes_sent
+                details['bytes_received'] = usage.bytes_received - bytes_received
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """Store the time the SQL statement started at on its execution context."""
+    # The context is discarded with the statement, so nothing is left behind if it fails
+    if context is not None:
+        context._adreset_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """Record the SQL statement in the metrics."""
+    start = getattr(context, '_adreset_start', None)
+    if start is not None:
+        record('sql', statement.split(None, 1)[0].upper(), time.perf_counter() - start)
+
+
+def _start_request():
+    """Start collecting the metrics of the request."""
+    g.adreset_metrics = RequestMetrics()
+
+
+def _finish_request(response):
+    """
+    Log the metrics of the request and add the optional Server-Timing header.
+
+    :param flask.Response response: the response of the request
+    :return: the modified response
+    :rtype: flask.Response
+    """
+    metrics = g.pop('adreset_metrics', None)
+    if metrics is None:
+        return response
+
+    if current_app.config['SERVER_TIMING_ENABLED']:
+        response.headers['Server-Timing'] = metrics.server_timing()
+    log.info(
+        dict(
+            metrics.summary(),
+            message='The request was processed',
+            user=None,
+            method=request.method,
+            path=request.path,
+            status=response.status_code,
+        )
+    )
+    return response
+
+
+def init_instrumentation(app):
+    """
+    Initialize the collection of the metrics of every request if "INSTRUMENTATION_ENABLED" is set.
+
+    The SQL statements are also timed if "METRICS_ENABLED" is set.
+
+    :param flask.Flask app: a Flask application object
+    """
+    if not (app.config['INSTRUMENTATION_ENABLED'] or app.config['METRICS_ENABLED']):
+        return
+
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    if not app.config['INSTRUMENTATION_ENABLED']:
+        return
+
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
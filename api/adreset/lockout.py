@@ -0,0 +1,309 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import atexit
+from collections import deque
+from datetime import datetime, timedelta
+import threading
+import time
+
+from sqlalchemy import func
+
+from adreset.metrics import LOCKOUT_EVENTS
+from adreset.models import db, FailedAttempt
+from adreset import log
+
+
+class LockoutTracker(object):
+    """
+    Track the recent failed password reset attempts of each user in memory.
+
+    Each user has a deque of the times of their most recent failed attempts, bounded by
+    "ATTEMPTS_BEFORE_LOCKOUT", so a user is locked out when their deque is full and the oldest
+    attempt in it is within the lockout window.
+
+    The tracker is rebuilt from the failed_attempt table on first use. New failed attempts are
+    written to the table in batches by a background thread, and the attempts written by other
+    processes are loaded incrementally by using the highest row ID that was already loaded as a
+    watermark. Row IDs are allocated before the transactions that use them commit, so a lower ID
+    can become visible after a higher one. Each incremental load therefore re-scans an overlapping
+    range of IDs below the watermark and skips the rows it has already seen.
+    """
+
+    def __init__(
+        self,
+        app,
+        lockout_minutes=15,
+        attempts_before_lockout=3,
+        refresh_interval=1,
+        flush_interval=1,
+        flush_batch_size=100,
+        refresh_overlap=100,
+    ):
+        """
+        Initialize the LockoutTracker class.
+
+        :param flask.Flask app: the Flask application used to write to the database in the
+            background
+        :kwarg int lockout_minutes: the number of minutes a failed attempt counts towards a lockout
+        :kwarg int attempts_before_lockout: the number of failed attempts that lock out a user
+        :kwarg int refresh_interval: the number of seconds between loading the failed attempts of
+            other processes
+        :kwarg int flush_interval: the number of seconds between writing the failed attempts to
+            the database. Set this to 0 to write them synchronously.
+        :kwarg int flush_batch_size: the number of queued failed attempts that triggers a write
+            before the flush interval has passed
+        :kwarg int refresh_overlap: the number of row IDs below the watermark that are re-scanned
+            on each incremental load to find the rows that were committed out of order
+        """
+        self._app = app
+        self.lockout_window = timedelta(minutes=lockout_minutes)
+        self.attempts_before_lockout = attempts_before_lockout
+        self.refresh_interval = refresh_interval
+        self.flush_interval = flush_interval
+        self.flush_batch_size = flush_batch_size
+        self.refresh_overlap = refresh_overlap
+        # Maps the user ID to a deque of the times of their most recent failed attempts
+        self._attempts = {}
+        # The (user_id, time) tuples of the failed attempts that are not in the database yet
+        self._pending = []
+        # The IDs of the rows in the re-scanned range that were already loaded or were written by
+        # this process
+        self._seen_ids = set()
+        self._loaded = False
+        self._watermark = 0
+        self._next_refresh = 0
+        # Protects the in-memory state
+        self._lock = threading.Lock()
+        # Serializes writing to and loading from the database so that the rows written by this
+        # process are always known before they are loaded
+        self._db_lock = threading.Lock()
+        self._flush_event = threading.Event()
+        self._flush_thread = None
+
+    def reset(self):
+        """Forget all the failed attempts so that they are reloaded from the database."""
+        with self._db_lock, self._lock:
+            self._attempts = {}
+            self._pending = []
+            self._seen_ids = set()
+            self._loaded = False
+            self._watermark = 0
+            self._next_refresh = 0
+
+    def _add(self, user_id, attempt_time):
+        """
+        Add a failed attempt to the user's deque while keeping it sorted by time.
+
+        This must be called with the lock acquired.
+
+        :param int user_id: the user's ID in the database
+        :param datetime.datetime attempt_time: when the failed attempt occurred
+        """
+        attempts = self._attempts.get(user_id)
+        if attempts is None:
+            attempts = deque(maxlen=self.attempts_before_lockout)
+            self._attempts[user_id] = attempts
+
+        if not attempts or attempt_time >= attempts[-1]:
+            attempts.append(attempt_time)
+        else:
+            # Attempts from other processes can be loaded out of order
+            sorted_attempts = sorted(list(attempts) + [attempt_time])
+            attempts.clear()
+            attempts.extend(sorted_attempts)
+
+    def _prune(self, window_start):
+        """
+        Remove the users whose most recent failed attempt is outside of the lockout window.
+
+        This must be called with the lock acquired.
+
+        :param datetime.datetime window_start: the time the lockout window starts at
+        """
+        self._attempts = {
+            user_id: attempts
+            for user_id, attempts in self._attempts.items()
+            if attempts[-1] >= window_start
+        }
+
+    def _load(self):
+        """Rebuild the tracker from the failed attempts within the lockout window."""
+        window_start = datetime.utcnow() - self.lockout_window
+        self._watermark = db.session.query(func.max(FailedAttempt.id)).scalar() or 0
+        rows = (
+            db.session.query(FailedAttempt.id, FailedAttempt.user_id, FailedAttempt.time)
+            .filter(FailedAttempt.time >= window_start, FailedAttempt.id <= self._watermark)
+            .order_by(FailedAttempt.time)
+            .all()
+        )
+        # The rows outside of the lockout window are seen too, so they are skipped when re-scanned
+        seen_ids = {
+            row_id
+            for (row_id,) in db.session.query(FailedAttempt.id).filter(
+                FailedAttempt.id > self._watermark - self.refresh_overlap,
+                FailedAttempt.id <= self._watermark,
+            )
+        }
+        with self._lock:
+            self._attempts = {}
+            for _, user_id, attempt_time in rows:
+                self._add(user_id, attempt_time)
+            # The attempts of this process that were already persisted are in the rows above
+            self._seen_ids = seen_ids
+            self._loaded = True
+
+    def _incremental_load(self):
+        """Load the failed attempts written to the database since the last refresh."""
+        window_start = datetime.utcnow() - self.lockout_window
+        rows = (
+            db.session.query(FailedAttempt.id, FailedAttempt.user_id, FailedAttempt.time)
+            .filter(FailedAttempt.id > self._watermark - self.refresh_overlap)
+            .order_by(FailedAttempt.id)
+            .all()
+        )
+        with self._lock:
+            for row_id, user_id, attempt_time in rows:
+                self._watermark = max(self._watermark, row_id)
+                if row_id in self._seen_ids:
+                    continue
+                self._seen_ids.add(row_id)
+                if attempt_time >= window_start:
+                    self._add(user_id, attempt_time)
+            # The rows below the re-scanned range are never queried again
+            rescan_start = self._watermark - self.refresh_overlap
+            self._seen_ids = {row_id for row_id in self._seen_ids if row_id > rescan_start}
+            self._prune(window_start)
+
+    def refresh(self):
+        """Load the failed attempts from the database if the refresh interval has passed."""
+        now = time.monotonic()
+        if self._loaded and now < self._next_refresh:
+            return
+
+        with self._db_lock:
+            if self._loaded and now < self._next_refresh:
+                return
+
+            if self._loaded:
+                self._incremental_load()
+            else:
+                self._load()
+            self._next_refresh = now + self.refresh_interval
+
+    def is_locked_out(self, user_id):
+        """
+        Check if the user is locked out.
+
+        :param int user_id: the user's ID in the database
+        :return: a boolean determining if the user is locked out
+        :rtype: bool
+        """
+        self.refresh()
+        attempts = self._attempts.get(user_id)
+        if not attempts or len(attempts) < self.attempts_before_lockout:
+            return False
+
+        locked_out = attempts[0] >= datetime.utcnow() - self.lockout_window
+        if locked_out:
+            LOCKOUT_EVENTS.inc(event='locked_out')
+        return locked_out
+
+    def add_failed_attempt(self, user_id):
+        """
+        Record a failed password reset attempt and queue it to be written to the database.
+
+        :param int user_id: the user's ID in the database
+        """
+        self.refresh()
+        LOCKOUT_EVENTS.inc(event='failed_attempt')
+        attempt_time = datetime.utcnow()
+        with self._lock:
+            self._add(user_id, attempt_time)
+            self._pending.append((user_id, attempt_time))
+            num_pending = len(self._pending)
+
+        if not self.flush_interval:
+            self.flush()
+            return
+
+        self._start_flush_thread()
+        if num_pending >= self.flush_batch_size:
+            self._flush_event.set()
+
+    def flush(self):
+        """
+        Write the queued failed attempts to the database.
+
+        This must be called within an application context.
+        """
+        with self._db_lock:
+            with self._lock:
+                batch = self._pending
+                self._pending = []
+            if not batch:
+                return
+
+            rows = [
+                FailedAttempt(user_id=user_id, time=attempt_time) for user_id, attempt_time in batch
+            ]
+            try:
+                db.session.add_all(rows)
+                db.session.flush()
+                row_ids = [row.id for row in rows]
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                with self._lock:
+                    self._pending = batch + self._pending
+                raise
+
+            with self._lock:
+                rescan_start = self._watermark - self.refresh_overlap
+                self._seen_ids.update(row_id for row_id in row_ids if row_id > rescan_start)
+
+    def _flush_in_background(self):
+        """Write the queued failed attempts to the database until the process exits."""
+        while True:
+            self._flush_event.wait(self.flush_interval)
+            self._flush_event.clear()
+            self._flush_in_app_context()
+
+    def _flush_in_app_context(self):
+        """Write the queued failed attempts to the database outside of a request."""
+        with self._app.app_context():
+            try:
+                self.flush()
+            except Exception:
+                log.exception('Failed to write the failed password reset attempts to the database')
+
+    def _start_flush_thread(self):
+        """Start the background thread that writes to the database if it isn't running."""
+        if self._flush_thread is not None:
+            return
+
+        with self._lock:
+            if self._flush_thread is not None:
+                return
+            self._flush_thread = threading.Thread(
+                target=self._flush_in_background, name='adreset-lockout-flush', daemon=True
+            )
+            self._flush_thread.start()
+            atexit.register(self._flush_in_app_context)
+
+
+def init_lockout(app):
+    """
+    Initialize the tracker of failed password reset attempts on the Flask application.
+
+    :param flask.Flask app: a Flask application object
+    """
+    app.extensions['adreset_lockout'] = LockoutTracker(
+        app,
+        lockout_minutes=app.config['LOCKOUT_MINUTES'],
+        attempts_before_lockout=app.config['ATTEMPTS_BEFORE_LOCKOUT'],
+        refresh_interval=app.config['LOCKOUT_REFRESH_SECONDS'],
+        flush_interval=app.config['LOCKOUT_FLUSH_SECONDS'],
+        flush_batch_size=app.config['LOCKOUT_FLUSH_BATCH_SIZE'],
+    )
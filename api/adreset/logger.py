@@ -2,24 +2,237 @@
 
 from __future__ import unicode_literals
 
+import atexit
 import logging
+import logging.handlers
+import os
+import queue
 import sys
 
 from pythonjsonlogger import jsonlogger
 
+from adreset.metrics import LOG_MESSAGES_DROPPED
 
-def log_to_stdout(level=logging.INFO):
+
+# The handler and listener installed by log_to_stdout so that they can be replaced
+_handler = None
+_listener = None
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """
+    Put the log records on a bounded queue so that they are formatted and written by a listener.
+
+    When the queue is full, the record is either dropped and counted or the logging thread waits
+    for room in the queue.
+    """
+
+    def __init__(self, log_queue, block=False):
+        """
+        Initialize the BoundedQueueHandler class.
+
+        :param queue.Queue log_queue: the bounded queue of the listener
+        :kwarg bool block: wait for room in the queue instead of dropping the record when it's full
+        """
+        super(BoundedQueueHandler, self).__init__(log_queue)
+        self.block = block
+        self.dropped = 0
+
+    def prepare(self, record):
+        """
+        Prepare the record to be put on the queue.
+
+        The record isn't formatted here since that is the expensive part that the listener does. The
+        messages that are strings are merged with their arguments so that arguments modified after
+        this call don't change the message.
+
+        :param logging.LogRecord record: the log record
+        :return: the record to put on the queue
+        :rtype: logging.LogRecord
+        """
+        # The structured messages are dictionaries that are merged into the JSON by the formatter
+        if record.args and not isinstance(record.msg, dict):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record):
+        """
+        Put the record on the queue, or drop it if the queue is full and blocking is disabled.
+
+        :param logging.LogRecord record: the log record
+        """
+        if self.block:
+            self.queue.put(record)
+            return
+
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            LOG_MESSAGES_DROPPED.inc(level=record.levelname)
+
+
+class BatchStreamHandler(logging.StreamHandler):
+    """A stream handler that can write several records at once."""
+
+    def handle_batch(self, records):
+        """
+        Format the records and write them with a single write and flush.
+
+        :param list records: the log records
+        """
+        lines = []
+        for record in records:
+            if record.levelno < self.level or not self.filter(record):
+                continue
+            try:
+                lines.append(self.format(record) + self.terminator)
+            except Exception:
+                self.handleError(record)
+        if not lines:
+            return
+
+        self.acquire()
+        try:
+            self.stream.write(''.join(lines))
+            self.flush()
+        except Exception:
+            self.handleError(records[0])
+        finally:
+            self.release()
+
+
+class BatchQueueListener(logging.handlers.QueueListener):
+    """A queue listener that passes the records waiting on the queue to its handlers in batches."""
+
+    def __init__(self, log_queue, *handlers, batch_size=100):
+        """
+        Initialize the BatchQueueListener class.
+
+        :param queue.Queue log_queue: the queue the BoundedQueueHandler puts the records on
+        :param handlers: the handlers that write the records
+        :kwarg int batch_size: the maximum number of records passed to the handlers at once
+        """
+        super(BatchQueueListener, self).__init__(log_queue, *handlers, respect_handler_level=True)
+        self.batch_size = batch_size
+
+    def _get_batch(self):
+        """
+        Wait for a record and get the other records that are already waiting after it.
+
+        :return: a tuple of the records and a boolean determining if the listener was stopped
+        :rtype: tuple
+        """
+        records = []
+        item = self.dequeue(True)
+        while True:
+            self.queue.task_done()
+            if item is self._sentinel:
+                return records, True
+            records.append(self.prepare(item))
+            if len(records) >= self.batch_size:
+                return records, False
+            try:
+                item = self.dequeue(False)
+            except queue.Empty:
+                return records, False
+
+    def enqueue_sentinel(self):
+        """Tell the listener to stop after the records that are already on the queue."""
+        # Wait for room instead of failing when the queue is full since the listener is draining it
+        self.queue.put(self._sentinel)
+
+    def handle_batch(self, records):
+        """
+        Pass the records to the handlers.
+
+        :param list records: the log records
+        """
+        for handler in self.handlers:
+            if isinstance(handler, BatchStreamHandler):
+                handler.handle_batch(records)
+                continue
+            for record in records:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    def _monitor(self):
+        """Write the records in batches until the listener is stopped."""
+        stopped = False
+        while not stopped:
+            records, stopped = self._get_batch()
+            if records:
+                self.handle_batch(records)
+
+
+def _stop_listener():
+    """Write the records still on the queue and stop the listener."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _restart_listener_in_child():
+    """
+    Start a new listener in a forked process.
+
+    The forked process doesn't have the listener's thread, so without this its records would fill
+    the queue and be dropped. This happens with servers that load the application before forking
+    the workers, such as gunicorn with --preload.
+    """
+    global _listener
+    if _listener is None:
+        return
+    # Another thread may have held the queue's lock during the fork, so don't reuse the queue
+    log_queue = queue.Queue(maxsize=_listener.queue.maxsize)
+    _listener = BatchQueueListener(log_queue, *_listener.handlers, batch_size=_listener.batch_size)
+    _handler.queue = log_queue
+    _listener.start()
+
+
+def log_to_stdout(level=logging.INFO, queue_size=10000, queue_full_policy='drop', batch_size=100):
     """
     Configure loggers to stream to STDOUT.
 
+    The records are formatted as JSON and written to STDOUT by a background thread, so the threads
+    that log only put them on a queue.
+
     :param int level: the logging level
+    :kwarg int queue_size: the maximum number of records waiting to be written. Set this to 0 to
+        write the records in the logging thread instead.
+    :kwarg str queue_full_policy: "drop" to drop the records when the queue is full or "block" to
+        wait for room in the queue
+    :kwarg int batch_size: the maximum number of records written at once
     """
+    global _handler, _listener
     fmt = '%(asctime)s %(name)s %(levelname)s %(user)s %(message)s'
     datefmt = '%Y-%m-%d %H:%M:%S'
-    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler = BatchStreamHandler(sys.stdout)
     stream_handler.setLevel(level)
     stream_handler.setFormatter(jsonlogger.JsonFormatter(fmt, datefmt=datefmt))
-    logging.getLogger().addHandler(stream_handler)
+
+    if queue_full_policy not in ('drop', 'block'):
+        raise ValueError(f'The queue full policy "{queue_full_policy}" is not supported')
+    # Replace the handler of a previous call instead of writing every record twice
+    if _handler is not None:
+        logging.getLogger().removeHandler(_handler)
+    _stop_listener()
+
+    if queue_size:
+        log_queue = queue.Queue(maxsize=queue_size)
+        _handler = BoundedQueueHandler(log_queue, block=queue_full_policy == 'block')
+        _handler.setLevel(level)
+        _listener = BatchQueueListener(log_queue, stream_handler, batch_size=batch_size)
+        _listener.start()
+    else:
+        _handler = stream_handler
+    logging.getLogger().addHandler(_handler)
+
+
+atexit.register(_stop_listener)
+os.register_at_fork(after_in_child=_restart_listener_in_child)
 
 
 def init_logging(app):
@@ -29,9 +242,14 @@ def init_logging(app):
     :param flask.Flask app: a Flask application object
     """
     log_level = logging.DEBUG if app.debug else logging.INFO
-    log_to_stdout(level=log_level)
+    log_to_stdout(
+        level=log_level,
+        queue_size=app.config['LOG_QUEUE_SIZE'],
+        queue_full_policy=app.config['LOG_QUEUE_FULL_POLICY'],
+        batch_size=app.config['LOG_BATCH_SIZE'],
+    )
     # In general we want to see everything from our own code, but not detailed debug messages
-    # from third-party libraries. Note that the log level on the handler above controls what
-    # will actually appear on stdout.
+    # from third-party libraries. Our own logger uses the handler's level so that the messages that
+    # won't appear on stdout aren't built in the first place.
     logging.getLogger().setLevel(logging.INFO)
-    logging.getLogger('adreset').setLevel(logging.DEBUG)
+    logging.getLogger('adreset').setLevel(log_level)
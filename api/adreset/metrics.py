@@ -0,0 +1,422 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import bisect
+import ipaddress
+import threading
+import time
+
+from flask import abort, current_app, g, request, Response
+
+from adreset.cache import caches
+
+# The upper bounds in seconds of the buckets of the latency histograms
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Hashing secret answers is deliberately slow, so its buckets are larger
+HASH_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_value(value):
+    """
+    Format a sample value in the Prometheus text exposition format.
+
+    :param float value: the value to format
+    :return: the formatted value
+    :rtype: str
+    """
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def _format_labels(labels):
+    """
+    Format the labels of a sample in the Prometheus text exposition format.
+
+    :param list labels: a list of (name, value) tuples
+    :return: the formatted labels or an empty string if there are none
+    :rtype: str
+    """
+    if not labels:
+        return ''
+    formatted = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        formatted.append(f'{name}="{value}"')
+    return '{' + ','.join(formatted) + '}'
+
+
+def format_metric(name, metric_type, help_text, samples):
+    """
+    Format a metric in the Prometheus text exposition format.
+
+    :param str name: the name of the metric
+    :param str metric_type: the type of the metric such as "counter", "gauge", or "histogram"
+    :param str help_text: the description of the metric
+    :param list samples: a list of (suffix, labels, value) tuples where labels is a list of
+        (name, value) tuples
+    :return: the lines of the metric
+    :rtype: list
+    """
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}']
+    for suffix, labels, value in samples:
+        lines.append(f'{name}{suffix}{_format_labels(labels)} {_format_value(value)}')
+    return lines
+
+
+class Counter(object):
+    """A thread-safe counter with optional labels."""
+
+    metric_type = 'counter'
+
+    def __init__(self, name, help_text, label_names=()):
+        """
+        Initialize the Counter class.
+
+        :param str name: the name of the metric
+        :param str help_text: the description of the metric
+        :kwarg tuple label_names: the names of the labels of the metric
+        """
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        """
+        Increment the counter.
+
+        :kwarg float amount: the amount to increment the counter by
+        :kwarg labels: the values of the labels of the metric
+        """
+        key = tuple(labels[label_name] for label_name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        """
+        Get the value of the counter.
+
+        :kwarg labels: the values of the labels of the metric
+        :return: the value of the counter
+        :rtype: float
+        """
+        return self._values.get(tuple(labels[label_name] for label_name in self.label_names), 0)
+
+    def render(self):
+        """
+        Format the counter in the Prometheus text exposition format.
+
+        :return: the lines of the metric
+        :rtype: list
+        """
+        with self._lock:
+            values = sorted(self._values.items())
+        samples = [('', list(zip(self.label_names, key)), value) for key, value in values]
+        return format_metric(self.name, self.metric_type, self.help_text, samples)
+
+
+class Histogram(object):
+    """A thread-safe histogram with optional labels."""
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        """
+        Initialize the Histogram class.
+
+        :param str name: the name of the metric
+        :param str help_text: the description of the metric
+        :kwarg tuple label_names: the names of the labels of the metric
+        :kwarg tuple buckets: the sorted upper bounds of the buckets
+        """
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        # Maps the label values to a list of the bucket counts, the sum, and the count
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        """
+        Add an observation to the histogram.
+
+        :param float value: the observed value
+        :kwarg labels: the values of the labels of the metric
+        """
+        key = tuple(labels[label_name] for label_name in self.label_names)
+        # The counts are stored per bucket and made cumulative when they are rendered
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            values[0][index] += 1
+            values[1] += value
+            values[2] += 1
+
+    def get_count(self, **labels):
+        """
+        Get the number of observations.
+
+        :kwarg labels: the values of the labels of the metric
+        :return: the number of observations
+        :rtype: int
+        """
+        key = tuple(labels[label_name] for label_name in self.label_names)
+        return self._values.get(key, [None, 0.0, 0])[2]
+
+    def render(self):
+        """
+        Format the histogram in the Prometheus text exposition format.
+
+        :return: the lines of the metric
+        :rtype: list
+        """
+        with self._lock:
+            values = sorted(
+                (key, (list(counts), total, count))
+                for key, (counts, total, count) in self._values.items()
+            )
+        samples = []
+        for key, (counts, total, count) in values:
+            labels = list(zip(self.label_names, key))
+            cumulative = 0
+            for upper_bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                samples.append(
+                    ('_bucket', labels + [('le', _format_value(upper_bound))], cumulative)
+                )
+            samples.append(('_sum', labels, total))
+            samples.append(('_count', labels, count))
+        return format_metric(self.name, 'histogram', self.help_text, samples)
+
+
+REQUEST_DURATION = Histogram(
+    'adreset_request_duration_seconds',
+    'The duration of the HTTP requests',
+    ('endpoint', 'method', 'status'),
+)
+LDAP_OPERATION_DURATION = Histogram(
+    'adreset_ldap_operation_duration_seconds',
+    'The duration of the operations on Active Directory',
+    ('operation',),
+)
+LDAP_OPERATION_ERRORS = Counter(
+    'adreset_ldap_operation_errors_total',
+    'The number of operations on Active Directory that raised an exception',
+    ('operation', 'error'),
+)
+HASH_DURATION = Histogram(
+    'adreset_hash_duration_seconds',
+    'The duration of hashing and verifying the secret answers of a request',
+    ('operation',),
+    buckets=HASH_BUCKETS,
+)
+DB_QUERIES = Counter(
+    'adreset_db_queries_total', 'The number of SQL statements run on the database', ('statement',)
+)
+DB_QUERY_SECONDS = Counter(
+    'adreset_db_query_seconds_total',
+    'The time spent running SQL statements on the database',
+    ('statement',),
+)
+LOCKOUT_EVENTS = Counter(
+    'adreset_lockout_events_total',
+    'The number of failed password reset attempts and requests rejected by a lockout',
+    ('event',),
+)
+REVOCATION_CACHE_LOOKUPS = Counter(
+    'adreset_revocation_cache_lookups_total',
+    'The number of revoked token checks answered from memory (hit) or after loading the revoked '
+    'tokens from the database (miss)',
+    ('result',),
+)
+LOG_MESSAGES_DROPPED = Counter(
+    'adreset_log_messages_dropped_total',
+    'The number of log messages dropped because the queue of messages waiting to be written was '
+    'full',
+    ('level',),
+)
+METRICS = (
+    REQUEST_DURATION,
+    LDAP_OPERATION_DURATION,
+    LDAP_OPERATION_ERRORS,
+    HASH_DURATION,
+    DB_QUERIES,
+    DB_QUERY_SECONDS,
+    LOCKOUT_EVENTS,
+    REVOCATION_CACHE_LOOKUPS,
+    LOG_MESSAGES_DROPPED,
+)
+
+
+def observe_operation(category, operation, duration, details):
+    """
+    Add a completed operation timed by adreset.instrumentation to the metrics.
+
+    :param str category: the category of the operation such as "ldap", "sql", or "hash"
+    :param str operation: the name of the operation
+    :param float duration: the number of seconds the operation took
+    :param dict details: additional information about the operation
+    """
+    if category == 'ldap':
+        LDAP_OPERATION_DURATION.observe(duration, operation=operation)
+        if 'error' in details:
+            LDAP_OPERATION_ERRORS.inc(operation=operation, error=details['error'])
+    elif category == 'sql':
+        DB_QUERIES.inc(statement=operation)
+        DB_QUERY_SECONDS.inc(duration, statement=operation)
+    elif category == 'hash':
+        HASH_DURATION.observe(duration, operation=operation)
+
+
+def _render_pool():
+    """
+    Format the utilization of the Active Directory connection pool.
+
+    :return: the lines of the metrics or an empty list if the pool is disabled
+    :rtype: list
+    """
+    pool = current_app.extensions.get('adreset_ad_pool')
+    if not pool:
+        return []
+
+    stats = pool.stats()
+    lines = format_metric(
+        'adreset_ad_pool_max_connections',
+        'gauge',
+        'The maximum number of connections in the Active Directory connection pool',
+        [('', [], stats.pop('size'))],
+    )
+    lines += format_metric(
+        'adreset_ad_pool_connections',
+        'gauge',
+        'The number of connections in the Active Directory connection pool',
+        [('', [('state', state)], stats.pop(state)) for state in ('idle', 'in_use')],
+    )
+    lines += format_metric(
+        'adreset_ad_pool_events_total',
+        'counter',
+        'The number of connection pool events such as created and reused connections',
+        [('', [('event', event)], count) for event, count in sorted(stats.items())],
+    )
+    return lines
+
+
+def _render_caches():
+    """
+    Format the lookups and sizes of the in-process caches.
+
+    :return: the lines of the metrics
+    :rtype: list
+    """
+    stats = {name: cache.stats() for name, cache in sorted(caches.items())}
+    lines = format_metric(
+        'adreset_cache_lookups_total',
+        'counter',
+        'The number of lookups in the in-process caches that were hits or misses',
+        [
+            ('', [('cache', name), ('result', result)], cache_stats[stat])
+            for name, cache_stats in stats.items()
+            for result, stat in (('hit', 'hits'), ('miss', 'misses'))
+        ],
+    )
+    lines += format_metric(
+        'adreset_cache_evictions_total',
+        'counter',
+        'The number of entries evicted from the in-process caches because they were full',
+        [('', [('cache', name)], cache_stats['evictions']) for name, cache_stats in stats.items()],
+    )
+    lines += format_metric(
+        'adreset_cache_entries',
+        'gauge',
+        'The number of entries in the in-process caches, including the expired ones',
+        [('', [('cache', name)], cache_stats['size']) for name, cache_stats in stats.items()],
+    )
+    return lines
+
+
+def render_metrics():
+    """
+    Format all the metrics of this process in the Prometheus text exposition format.
+
+    :return: the metrics
+    :rtype: str
+    """
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    lines += _render_pool()
+    lines += _render_caches()
+    return '\n'.join(lines) + '\n'
+
+
+def _is_allowed(address):
+    """
+    Check if the client's address is allowed to read the metrics by "METRICS_ALLOWED_NETWORKS".
+
+    :param str address: the client's IP address
+    :return: a boolean determining if the client is allowed
+    :rtype: bool
+    """
+    allowed_networks = current_app.config['METRICS_ALLOWED_NETWORKS']
+    if allowed_networks is None:
+        return True
+
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network) for network in allowed_networks)
+
+
+def metrics():
+    """
+    Return the metrics of this process in the Prometheus text exposition format.
+
+    :rtype: flask.Response
+    """
+    if not _is_allowed(request.remote_addr or ''):
+        abort(403)
+    return Response(render_metrics(), content_type=CONTENT_TYPE)
+
+
+def _start_request():
+    """Store the time the request started at."""
+    g.adreset_request_start = time.perf_counter()
+
+
+def _finish_request(response):
+    """
+    Add the duration of the request to the metrics.
+
+    :param flask.Response response: the response of the request
+    :return: the response
+    :rtype: flask.Response
+    """
+    start = g.pop('adreset_request_start', None)
+    if start is not None:
+        REQUEST_DURATION.observe(
+            time.perf_counter() - start,
+            endpoint=request.endpoint or 'unknown',
+            method=request.method,
+            status=response.status_code,
+        )
+    return response
+
+
+def init_metrics(app):
+    """
+    Initialize the /metrics endpoint and the request metrics if "METRICS_ENABLED" is set.
+
+    :param flask.Flask app: a Flask application object
+    """
+    if not app.config['METRICS_ENABLED']:
+        return
+
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.add_url_rule('/metrics', view_func=metrics)
@@ -4,8 +4,7 @@ from __future__ import unicode_literals
 
 from sqlalchemy.orm import validates
 from six import string_types
-from flask import url_for
-import passlib.hash
+from flask import current_app, url_for
 
 from adreset.models import db
 from adreset.error import ValidationError
@@ -67,7 +66,7 @@ class Answer(db.Model):
     @validates('answer')
     def validate_answer(self, key, answer):
         """
-        Ensure the answer is hashed.
+        Ensure the answer is hashed with one of the configured schemes.
 
         :param str key: the key/column being validated
         :param str answer: the answer being validated
@@ -77,20 +76,30 @@ class Answer(db.Model):
         """
         if not isinstance(answer, string_types):
             raise RuntimeError(_must_be_str.format(key))
-        elif not passlib.hash.sha512_crypt.identify(answer):
-            raise RuntimeError('The answer must be stored as a SHA512 hash')
+        elif not Answer.get_crypt_context().identify(answer):
+            raise RuntimeError('The answer must be stored as a hash of a configured scheme')
         return answer
 
+    @staticmethod
+    def get_crypt_context():
+        """
+        Get the hashing policy of the answers configured with "ANSWER_HASHING".
+
+        :return: the hashing policy
+        :rtype: passlib.context.CryptContext
+        """
+        return current_app.extensions['adreset_hashing'].context
+
     @staticmethod
     def hash_answer(answer):
         """
-        Hash the answer using the SHA512 algorithm.
+        Hash the answer using the default scheme of the configured hashing policy.
 
         :param str answer: the answer to hash
-        :return: a SHA512 hash of the string
+        :return: the hashed answer
         :rtype: str
         """
-        return passlib.hash.sha512_crypt.hash(answer)
+        return Answer.get_crypt_context().hash(answer)
 
     @staticmethod
     def verify_answer(input_answer, hashed_answer):
@@ -102,7 +111,23 @@ class Answer(db.Model):
         :return: a boolean determining if the answers match
         :rtype: bool
         """
-        return passlib.hash.sha512_crypt.verify(input_answer, hashed_answer)
+        return Answer.get_crypt_context().verify(input_answer, hashed_answer)
+
+    @staticmethod
+    def verify_and_update_answer(input_answer, hashed_answer):
+        """
+        Verify the input answer and determine if its hash must be upgraded.
+
+        The hash must be upgraded when its scheme is deprecated or its settings such as the
+        rounds don't match the configured hashing policy.
+
+        :param str input_answer: the answer to verify
+        :param str hashed_answer: the hashed answer to verify against
+        :return: a tuple of a boolean determining if the answers match and the new hash if the
+            answer needs to be rehashed or None
+        :rtype: tuple
+        """
+        return Answer.get_crypt_context().verify_and_update(input_answer, hashed_answer)
 
     def to_json(self, include_url=True):
         """Represent the row as a dictionary for JSON output."""
@@ -2,9 +2,9 @@
 
 from __future__ import unicode_literals
 
-from datetime import datetime
+from flask import current_app
 
-from adreset.models import db, User
+from adreset.models import db
 
 
 class BlacklistedToken(db.Model):
@@ -12,34 +12,28 @@ class BlacklistedToken(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer(), db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
-    jti = db.Column(db.String(36), nullable=False)
+    jti = db.Column(db.String(36), nullable=False, unique=True, index=True)
     expires = db.Column(db.DateTime, nullable=False)
 
     @staticmethod
     def add_token(token):
         """
-        Add a new token to the database in the unrevoked state.
+        Revoke the token using the configured revocation backend.
 
         :param dict token: the decoded token to blacklist
         """
-        user = User.query.filter_by(ad_guid=token['sub']['guid']).one()
-        db_token = BlacklistedToken(
-            jti=token['jti'], user_id=user.id, expires=datetime.fromtimestamp(token['exp'])
-        )
-        db.session.add(db_token)
-        db.session.commit()
+        current_app.extensions['adreset_revocation'].add(token)
 
     @staticmethod
     def is_token_revoked(token):
         """
-        Check if the token is revoked and default to True if the token is not present.
+        Check if the token is revoked using the configured revocation backend.
 
         :param dict token: the decoded JSON web token to check
         :rtype: bool
         :return: a boolean representing if the token is revoked
         """
-        jti = token['jti']
-        return bool(BlacklistedToken.query.filter_by(jti=jti).first())
+        return current_app.extensions['adreset_revocation'].is_revoked(token['jti'])
 
     @staticmethod
     def revoke_token(jti):
@@ -71,18 +71,24 @@ class User(db.Model):
         """
         Check if the passed-in user is locked out.
 
+        The query reads at most "ATTEMPTS_BEFORE_LOCKOUT" entries from the index on the user ID
+        and time, so it doesn't slow down as the failed attempts of all the users accumulate.
+
         :param int user_id: the user ID to check
         :return: a boolean determining if the user is locked out
         :rtype: bool
         """
         lockout_mins = current_app.config['LOCKOUT_MINUTES']
+        attempts_before_lockout = current_app.config['ATTEMPTS_BEFORE_LOCKOUT']
         lockout_datetime = datetime.utcnow() - timedelta(minutes=lockout_mins)
-        failed_attempts = (
-            db.session.query(func.count(FailedAttempt.id))
-            .filter(FailedAttempt.time >= lockout_datetime)
-            .scalar()
+        recent_attempts = (
+            db.session.query(FailedAttempt.id)
+            .filter(FailedAttempt.user_id == user_id, FailedAttempt.time >= lockout_datetime)
+            .limit(attempts_before_lockout)
+            .subquery()
         )
-        return failed_attempts >= current_app.config['ATTEMPTS_BEFORE_LOCKOUT']
+        failed_attempts = db.session.query(func.count()).select_from(recent_attempts).scalar()
+        return failed_attempts >= attempts_before_lockout
 
     def is_locked_out(self):
         """
@@ -97,6 +103,8 @@ class User(db.Model):
 class FailedAttempt(db.Model):
     """Represent a failed password reset attempt."""
 
+    __table_args__ = (db.Index('ix_failed_attempt_user_id_time', 'user_id', 'time'),)
+
     id = db.Column(db.Integer(), primary_key=True)
     user_id = db.Column(db.Integer(), db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
     time = db.Column(db.DateTime, nullable=False)
@@ -0,0 +1,307 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+import time
+import weakref
+
+from adreset.error import ADError
+from adreset import log
+
+# The pools in the process so that a forked process can drop the connections it inherited
+_pools = weakref.WeakSet()
+
+
+class ConnectionPool(object):
+    """A bounded and thread-safe pool of LDAP connections bound with the service account."""
+
+    busy_error_msg = 'The application is too busy to process the request. Please try again.'
+
+    def __init__(self, factory, size=5, max_age=600, timeout=5, health_check_interval=60):
+        """
+        Initialize the ConnectionPool class.
+
+        :param callable factory: a callable that returns a new bound ldap3.Connection
+        :kwarg int size: the maximum number of connections the pool will open
+        :kwarg int max_age: the number of seconds after which a connection is recycled
+        :kwarg int timeout: the number of seconds to wait for a connection when the pool is
+            exhausted
+        :kwarg int health_check_interval: the number of seconds a connection can sit idle before
+            it is verified with a "Who Am I" operation when it is checked out
+        """
+        self._factory = factory
+        self.size = size
+        self.max_age = max_age
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        # Idle connections are stored as (connection, created, last_used) tuples
+        self._idle = deque()
+        # Maps the ID of every connection the pool owns to the time it was created
+        self._created = {}
+        # The number of connections currently being created outside of the lock
+        self._pending = 0
+        self._condition = threading.Condition()
+        # The threads that run operations on a second connection concurrently with the request's
+        # connection. They are only started on first use so that they are created after the
+        # application server forks its workers.
+        self._executor = None
+        self._stats = {
+            'created': 0,
+            'reused': 0,
+            'recycled': 0,
+            'rebound': 0,
+            'discarded': 0,
+            'timeouts': 0,
+        }
+        _pools.add(self)
+
+    def _count(self, stat):
+        """
+        Increment one of the pool statistics.
+
+        :param str stat: the name of the statistic to increment
+        """
+        with self._condition:
+            self._stats[stat] += 1
+
+    @property
+    def total(self):
+        """Return the number of connections the pool currently owns or is creating."""
+        return len(self._created) + self._pending
+
+    def _is_expired(self, created):
+        """
+        Determine if a connection is older than the configured maximum age.
+
+        :param float created: the time the connection was created
+        :return: a boolean determining if the connection must be recycled
+        :rtype: bool
+        """
+        return bool(self.max_age) and time.monotonic() - created > self.max_age
+
+    def _is_healthy(self, connection, last_used):
+        """
+        Determine if the connection can still be used.
+
+        :param ldap3.Connection connection: the connection to check
+        :param float last_used: the time the connection was last returned to the pool
+        :return: a boolean determining if the connection is usable
+        :rtype: bool
+        """
+        if connection.closed or not connection.bound:
+            return False
+
+        if time.monotonic() - last_used > self.health_check_interval:
+            try:
+                return bool(connection.extend.standard.who_am_i())
+            except Exception:
+                log.warning('The health check on a pooled LDAP connection failed', exc_info=True)
+                return False
+
+        return True
+
+    def _rebind(self, connection):
+        """
+        Try to reopen and rebind a connection that failed its health check.
+
+        :param ldap3.Connection connection: the connection to rebind
+        :return: a boolean determining if the connection was rebound
+        :rtype: bool
+        """
+        try:
+            if not connection.closed:
+                connection.unbind()
+            connection.open()
+            rebound = connection.bind()
+        except Exception:
+            log.warning('Rebinding a pooled LDAP connection failed', exc_info=True)
+            return False
+
+        if rebound:
+            self._count('rebound')
+        return rebound
+
+    def _discard(self, connection):
+        """
+        Remove the connection from the pool and unbind it.
+
+        :param ldap3.Connection connection: the connection to discard
+        """
+        with self._condition:
+            if self._created.pop(id(connection), None) is not None:
+                self._stats['discarded'] += 1
+            self._condition.notify()
+
+        try:
+            connection.unbind()
+        except Exception:
+            log.debug('Unbinding a discarded LDAP connection failed', exc_info=True)
+
+    def _create(self):
+        """
+        Create a new connection using the factory and register it with the pool.
+
+        The caller must have already reserved a slot in the pool.
+
+        :return: a new bound connection
+        :rtype: ldap3.Connection
+        """
+        try:
+            connection = self._factory()
+        except Exception:
+            with self._condition:
+                self._pending -= 1
+                self._condition.notify()
+            raise
+
+        with self._condition:
+            self._pending -= 1
+            self._created[id(connection)] = time.monotonic()
+            self._stats['created'] += 1
+        return connection
+
+    def acquire(self, wait=True):
+        """
+        Check out a bound connection from the pool.
+
+        :kwarg bool wait: wait for a connection to be released when all of them are in use instead
+            of returning None
+        :return: a bound LDAP connection or None if wait is False and none are available
+        :rtype: ldap3.Connection or None
+        :raises ADError: if no connection became available before the timeout
+        """
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._condition:
+                if self._idle:
+                    connection, created, last_used = self._idle.pop()
+                elif self.total < self.size:
+                    # Reserve the slot while the connection is created outside of the lock, since
+                    # creating the connection requires network round trips
+                    self._pending += 1
+                    connection = None
+                elif not wait:
+                    return None
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        log.error('Timed out waiting for a pooled LDAP connection')
+                        raise ADError(self.busy_error_msg)
+                    self._condition.wait(remaining)
+                    continue
+
+            if connection is None:
+                return self._create()
+
+            if self._is_expired(created):
+                self._count('recycled')
+                self._discard(connection)
+                continue
+
+            if self._is_healthy(connection, last_used) or self._rebind(connection):
+                self._count('reused')
+                return connection
+
+            self._discard(connection)
+
+    def release(self, connection):
+        """
+        Return a connection to the pool.
+
+        Connections that are no longer bound or are past their maximum age are discarded.
+
+        :param ldap3.Connection connection: the connection to return
+        """
+        with self._condition:
+            created = self._created.get(id(connection))
+        if created is None:
+            # The connection was already discarded or never belonged to this pool
+            return
+
+        if connection.closed or not connection.bound or self._is_expired(created):
+            self._discard(connection)
+            return
+
+        with self._condition:
+            self._idle.append((connection, created, time.monotonic()))
+            self._condition.notify()
+
+    @property
+    def executor(self):
+        """Return the thread pool that runs operations on the pooled connections concurrently."""
+        with self._condition:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.size, thread_name_prefix='adreset-ad-pool'
+                )
+            return self._executor
+
+    def clear(self):
+        """Unbind all the idle connections in the pool."""
+        with self._condition:
+            idle = list(self._idle)
+            self._idle.clear()
+        for connection, _, _ in idle:
+            self._discard(connection)
+
+    def _reset_after_fork(self):
+        """
+        Forget the connections and threads inherited from the parent process.
+
+        The sockets of the inherited connections are shared with the parent process, so they are
+        dropped without being unbound, which would end the parent's sessions.
+        """
+        self._condition = threading.Condition()
+        self._idle.clear()
+        self._created.clear()
+        self._pending = 0
+        self._executor = None
+
+    def stats(self):
+        """
+        Get the utilization statistics of the pool.
+
+        :return: a dictionary of the pool statistics
+        :rtype: dict
+        """
+        with self._condition:
+            stats = dict(self._stats)
+            stats['size'] = self.size
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self.total - len(self._idle)
+        return stats
+
+
+def _reset_pools_after_fork():
+    """Make the pools of a forked process open their own connections."""
+    for pool in list(_pools):
+        pool._reset_after_fork()
+
+
+os.register_at_fork(after_in_child=_reset_pools_after_fork)
+
+
+def init_pool(app, factory):
+    """
+    Initialize the pool of service account connections on the Flask application.
+
+    The pool is only created when the "AD_POOL_SIZE" configuration is greater than zero.
+
+    :param flask.Flask app: a Flask application object
+    :param callable factory: a callable that returns a new bound ldap3.Connection
+    """
+    if not app.config.get('AD_POOL_SIZE'):
+        return
+
+    app.extensions['adreset_ad_pool'] = ConnectionPool(
+        factory,
+        size=app.config['AD_POOL_SIZE'],
+        max_age=app.config['AD_POOL_MAX_AGE'],
+        timeout=app.config['AD_POOL_TIMEOUT'],
+        health_check_interval=app.config['AD_POOL_HEALTH_CHECK_INTERVAL'],
+    )
@@ -0,0 +1,121 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+from datetime import datetime, timedelta
+import threading
+import time
+
+from flask import current_app
+
+from adreset.models import db, BlacklistedToken, FailedAttempt
+from adreset import log
+
+
+def delete_in_batches(model, condition, batch_size=1000):
+    """
+    Delete the rows matching the condition with bounded DELETE statements.
+
+    The table is walked in primary key order so that each batch resumes where the last one
+    stopped instead of rescanning the rows that were kept. Each batch is committed separately so
+    that locks are held briefly.
+
+    :param flask_sqlalchemy.Model model: the model of the table to delete from
+    :param sqlalchemy.sql.expression.ColumnElement condition: the condition of the rows to delete
+    :kwarg int batch_size: the maximum number of rows deleted by a single statement
+    :return: the number of deleted rows
+    :rtype: int
+    """
+    deleted = 0
+    last_id = 0
+    while True:
+        ids = [
+            row_id
+            for (row_id,) in db.session.query(model.id)
+            .filter(model.id > last_id, condition)
+            .order_by(model.id)
+            .limit(batch_size)
+        ]
+        if not ids:
+            break
+
+        db.session.query(model).filter(model.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        deleted += len(ids)
+        last_id = ids[-1]
+        if len(ids) < batch_size:
+            break
+
+    return deleted
+
+
+def prune():
+    """
+    Delete the expired blacklisted tokens and the failed attempts past their retention.
+
+    Failed attempts are kept for "LOCKOUT_MINUTES" plus "FAILED_ATTEMPT_RETENTION_DAYS" so that
+    they remain available for auditing after they no longer count towards a lockout.
+
+    :return: a dictionary of the table name to a dictionary with the number of deleted rows and
+        the number of seconds it took
+    :rtype: dict
+    """
+    batch_size = current_app.config['PRUNE_BATCH_SIZE']
+    failed_attempt_cutoff = datetime.utcnow() - timedelta(
+        minutes=current_app.config['LOCKOUT_MINUTES'],
+        days=current_app.config['FAILED_ATTEMPT_RETENTION_DAYS'],
+    )
+    # Blacklisted tokens store their expiration in local time
+    conditions = (
+        (BlacklistedToken, BlacklistedToken.expires < datetime.now()),
+        (FailedAttempt, FailedAttempt.time < failed_attempt_cutoff),
+    )
+    results = {}
+    for model, condition in conditions:
+        start = time.monotonic()
+        deleted = delete_in_batches(model, condition, batch_size)
+        results[model.__tablename__] = {'deleted': deleted, 'seconds': time.monotonic() - start}
+
+    return results
+
+
+def _prune_on_schedule(app, interval):
+    """
+    Prune the database forever at the interval.
+
+    :param flask.Flask app: a Flask application object
+    :param int interval: the number of seconds between pruning the database
+    """
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            try:
+                for table, result in prune().items():
+                    log.info(
+                        'Pruned %d rows from the %s table in %.2f seconds',
+                        result['deleted'],
+                        table,
+                        result['seconds'],
+                    )
+            except Exception:
+                db.session.rollback()
+                log.exception('Failed to prune the database')
+
+
+def schedule_pruning(app):
+    """
+    Start a background thread that prunes the database if "PRUNE_INTERVAL_SECONDS" is set.
+
+    :param flask.Flask app: a Flask application object
+    :return: the started thread or None
+    :rtype: threading.Thread or None
+    """
+    interval = app.config.get('PRUNE_INTERVAL_SECONDS')
+    if not interval:
+        return None
+
+    thread = threading.Thread(
+        target=_prune_on_schedule, args=(app, interval), name='adreset-prune', daemon=True
+    )
+    thread.start()
+    return thread
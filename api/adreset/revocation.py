@@ -0,0 +1,277 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+from datetime import datetime
+import threading
+import time
+
+from sqlalchemy import func
+
+from adreset.error import ConfigurationError
+from adreset.metrics import REVOCATION_CACHE_LOOKUPS
+from adreset.models import db, BlacklistedToken, User
+
+try:
+    import redis
+except ImportError:  # pragma: no cover
+    redis = None
+
+
+class RevocationBackend(object):
+    """The interface of the stores of revoked JSON web tokens."""
+
+    def add(self, token):
+        """
+        Revoke the token.
+
+        :param dict token: the decoded JSON web token to revoke
+        """
+        raise NotImplementedError()
+
+    def is_revoked(self, jti):
+        """
+        Check if the token is revoked.
+
+        :param str jti: the GUID that identifies the token
+        :return: a boolean representing if the token is revoked
+        :rtype: bool
+        """
+        raise NotImplementedError()
+
+    def reset(self):
+        """Forget the revoked tokens kept in the memory of this process."""
+        pass
+
+
+class SQLRevocationBackend(RevocationBackend):
+    """
+    Store the revoked tokens in the database and keep the unexpired JTIs in memory.
+
+    New rows in the blacklisted_token table are loaded incrementally by using the highest row ID
+    that was already loaded as a watermark. Row IDs are allocated before the transactions that use
+    them commit, so a lower ID can become visible after a higher one. Each incremental refresh
+    therefore re-scans an overlapping range of IDs below the watermark, which is safe since loading
+    a JTI twice has no effect. The whole table is periodically reloaded to drop the expired tokens
+    and to pick up rows that were inserted with a reused ID.
+    """
+
+    def __init__(self, refresh_interval=1, full_refresh_interval=300, refresh_overlap=100):
+        """
+        Initialize the SQLRevocationBackend class.
+
+        :kwarg int refresh_interval: the number of seconds between loading new revoked tokens
+        :kwarg int full_refresh_interval: the number of seconds between reloading all the revoked
+            tokens
+        :kwarg int refresh_overlap: the number of row IDs below the watermark that are re-scanned
+            on each incremental refresh to find the rows that were committed out of order
+        """
+        self.refresh_interval = refresh_interval
+        self.full_refresh_interval = full_refresh_interval
+        self.refresh_overlap = refresh_overlap
+        # Maps the JTI to when the token expires
+        self._revoked = {}
+        self._watermark = 0
+        self._next_refresh = 0
+        self._next_full_refresh = 0
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """Forget all the revoked tokens so that they are reloaded from the database."""
+        with self._lock:
+            self._revoked = {}
+            self._watermark = 0
+            self._next_refresh = 0
+            self._next_full_refresh = 0
+
+    def _full_refresh(self):
+        """Reload all the unexpired revoked tokens from the database."""
+        now = datetime.now()
+        self._watermark = db.session.query(func.max(BlacklistedToken.id)).scalar() or 0
+        rows = (
+            db.session.query(BlacklistedToken.jti, BlacklistedToken.expires)
+            .filter(BlacklistedToken.expires > now, BlacklistedToken.id <= self._watermark)
+            .all()
+        )
+        self._revoked = {jti: expires for jti, expires in rows}
+
+    def _incremental_refresh(self):
+        """Load the tokens revoked since the last refresh, including by other processes."""
+        rows = (
+            db.session.query(BlacklistedToken.id, BlacklistedToken.jti, BlacklistedToken.expires)
+            .filter(
+                BlacklistedToken.id > self._watermark - self.refresh_overlap,
+                BlacklistedToken.expires > datetime.now(),
+            )
+            .order_by(BlacklistedToken.id)
+            .all()
+        )
+        for row_id, jti, expires in rows:
+            self._revoked[jti] = expires
+            self._watermark = max(self._watermark, row_id)
+
+    def refresh(self):
+        """Load the revoked tokens from the database if the refresh interval has passed."""
+        now = time.monotonic()
+        if now < self._next_refresh:
+            REVOCATION_CACHE_LOOKUPS.inc(result='hit')
+            return
+
+        with self._lock:
+            if now < self._next_refresh:
+                REVOCATION_CACHE_LOOKUPS.inc(result='hit')
+                return
+
+            REVOCATION_CACHE_LOOKUPS.inc(result='miss')
+
+            if now >= self._next_full_refresh:
+                self._full_refresh()
+                self._next_full_refresh = now + self.full_refresh_interval
+            else:
+                self._incremental_refresh()
+            self._next_refresh = now + self.refresh_interval
+
+    def add(self, token):
+        """
+        Store the revoked token in the database and in the memory of this process.
+
+        :param dict token: the decoded JSON web token to revoke
+        """
+        user = User.query.filter_by(ad_guid=token['sub']['guid']).one()
+        db_token = BlacklistedToken(
+            jti=token['jti'], user_id=user.id, expires=datetime.fromtimestamp(token['exp'])
+        )
+        db.session.add(db_token)
+        db.session.commit()
+        with self._lock:
+            self._revoked[db_token.jti] = db_token.expires
+
+    def is_revoked(self, jti):
+        """
+        Check if the token is revoked.
+
+        :param str jti: the GUID that identifies the token
+        :return: a boolean representing if the token is revoked
+        :rtype: bool
+        """
+        self.refresh()
+        return jti in self._revoked
+
+
+class MemoryRevocationBackend(RevocationBackend):
+    """
+    Store the revoked tokens in the memory of this process until they expire.
+
+    This is only suitable for tests and deployments with a single process.
+    """
+
+    def __init__(self, purge_interval=60):
+        """
+        Initialize the MemoryRevocationBackend class.
+
+        :kwarg int purge_interval: the number of seconds between removing the expired tokens
+        """
+        self.purge_interval = purge_interval
+        # Maps the JTI to the UNIX timestamp of when the token expires
+        self._revoked = {}
+        self._next_purge = 0
+        self._lock = threading.Lock()
+
+    def add(self, token):
+        """
+        Revoke the token until it expires.
+
+        :param dict token: the decoded JSON web token to revoke
+        """
+        now = time.time()
+        with self._lock:
+            self._revoked[token['jti']] = token['exp']
+            if now >= self._next_purge:
+                self._revoked = {
+                    jti: expires for jti, expires in self._revoked.items() if expires > now
+                }
+                self._next_purge = now + self.purge_interval
+
+    def is_revoked(self, jti):
+        """
+        Check if the token is revoked.
+
+        :param str jti: the GUID that identifies the token
+        :return: a boolean representing if the token is revoked
+        :rtype: bool
+        """
+        expires = self._revoked.get(jti)
+        return expires is not None and expires > time.time()
+
+    def reset(self):
+        """Forget all the revoked tokens."""
+        with self._lock:
+            self._revoked = {}
+
+
+class RedisRevocationBackend(RevocationBackend):
+    """
+    Store the revoked tokens in a server that speaks the Redis protocol.
+
+    Each revoked token is a key that the server expires when the token expires, so the revoked
+    tokens are shared by all the application processes and never need to be pruned.
+    """
+
+    def __init__(self, client, prefix='adreset:revoked:'):
+        """
+        Initialize the RedisRevocationBackend class.
+
+        :param redis.Redis client: the Redis client to use
+        :kwarg str prefix: the prefix of the keys of the revoked tokens
+        """
+        self.client = client
+        self.prefix = prefix
+
+    def add(self, token):
+        """
+        Revoke the token until it expires.
+
+        :param dict token: the decoded JSON web token to revoke
+        """
+        ttl = int(token['exp'] - time.time())
+        if ttl > 0:
+            self.client.set(self.prefix + token['jti'], 1, ex=ttl)
+
+    def is_revoked(self, jti):
+        """
+        Check if the token is revoked.
+
+        :param str jti: the GUID that identifies the token
+        :return: a boolean representing if the token is revoked
+        :rtype: bool
+        """
+        return bool(self.client.exists(self.prefix + jti))
+
+
+def init_revocation(app):
+    """
+    Initialize the configured store of revoked tokens on the Flask application.
+
+    :param flask.Flask app: a Flask application object
+    :raises ConfigurationError: if the configured backend is invalid or can't be used
+    """
+    backend_name = app.config['JWT_REVOCATION_BACKEND']
+    if backend_name == 'sql':
+        backend = SQLRevocationBackend(
+            refresh_interval=app.config['JWT_REVOCATION_REFRESH_SECONDS'],
+            full_refresh_interval=app.config['JWT_REVOCATION_FULL_REFRESH_SECONDS'],
+        )
+    elif backend_name == 'memory':
+        backend = MemoryRevocationBackend()
+    elif backend_name == 'redis':
+        if redis is None:
+            raise ConfigurationError('The "redis" package must be installed to use Redis')
+        client = redis.Redis.from_url(app.config['JWT_REVOCATION_REDIS_URL'])
+        backend = RedisRevocationBackend(client, app.config['JWT_REVOCATION_REDIS_PREFIX'])
+    else:
+        raise ConfigurationError(
+            f'The "JWT_REVOCATION_BACKEND" setting of "{backend_name}" is invalid. It must be '
+            '"sql", "memory", or "redis".'
+        )
+
+    app.extensions['adreset_revocation'] = backend
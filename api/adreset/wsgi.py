@@ -1,5 +1,10 @@
 # SPDX-License-Identifier: GPL-3.0+
 
-from adreset.app import create_app
+import functools
+
+from adreset.app import create_app, start_worker
 
 app = create_app()
+# Start the background work in the worker that serves the requests instead of when this is imported
+# by a preforking server or a CLI command
+app.before_first_request(functools.partial(start_worker, app))
@@ -16,4 +16,6 @@ setup(
     packages=find_packages(exclude=['tests']),
     include_package_data=True,
     install_requires=requirements,
+    # The request metrics use contextvars, which was added in Python 3.7
+    python_requires='>=3.7',
 )
@@ -3,6 +3,8 @@
 from __future__ import unicode_literals
 
 from datetime import datetime, timedelta, timezone
+from os import path
+import threading
 
 import mock
 from mock import PropertyMock
@@ -10,6 +12,8 @@ import pytest
 import ldap3
 
 import adreset.ad
+from adreset.error import ADError
+from adreset.pool import ConnectionPool
 
 
 # Note that we can't login to LDAP using AD syntax, we must use the whole distinguished name
@@ -66,6 +70,34 @@ def test_get_domain_attributes(mock_ad):
     }
 
 
+def test_get_domain_attributes_cached(mock_ad):
+    """Test that the domain policy attributes are retrieved from AD once and then cached."""
+    mock_ad.login('CN=testuser,OU=ADReset,DC=adreset,DC=local', 'P@ssW0rd')
+    with mock.patch.object(mock_ad, 'search', wraps=mock_ad.search) as mock_search:
+        assert mock_ad.min_pwd_length == 7
+        assert mock_ad.pw_complexity_required is True
+        rv = mock_ad.get_domain_attributes(['lockoutDuration', 'maxPwdAge', 'minPwdAge'])
+        assert set(rv.keys()) == set(['lockoutDuration', 'maxPwdAge', 'minPwdAge'])
+        assert mock_search.call_count == 1
+        # Attributes that aren't part of the policy are always retrieved from AD
+        mock_ad.get_domain_attribute('distinguishedName')
+        assert mock_search.call_count == 2
+        adreset.ad.domain_cache.invalidate()
+        assert mock_ad.min_pwd_length == 7
+        assert mock_search.call_count == 3
+    assert adreset.ad.domain_cache.stats()['hits'] == 4
+
+
+def test_get_domain_attributes_cache_disabled(app, mock_ad):
+    """Test that the domain attributes are always retrieved from AD when the cache is disabled."""
+    mock_ad.login('CN=testuser,OU=ADReset,DC=adreset,DC=local', 'P@ssW0rd')
+    with mock.patch.dict(app.config, {'AD_DOMAIN_CACHE_TTL': 0}):
+        with mock.patch.object(mock_ad, 'search', wraps=mock_ad.search) as mock_search:
+            assert mock_ad.min_pwd_length == 7
+            assert mock_ad.min_pwd_length == 7
+            assert mock_search.call_count == 2
+
+
 def test_get_min_pwd_length(mock_ad):
     """Test that AD.min_pwd_length returns the correct result."""
     mock_ad.login('CN=testuser,OU=ADReset,DC=adreset,DC=local', 'P@ssW0rd')
@@ -127,12 +159,96 @@ def test_get_sam_account_name(mock_ad):
     assert mock_ad.get_sam_account_name('5609c5ec-c0df-4480-a94b-b6eb0fc4c066') == 'testuser'
 
 
+def test_get_user_profile(mock_ad):
+    """Test that AD.get_user_profile returns the user's profile and caches it."""
+    mock_ad.login('CN=testuser,OU=ADReset,DC=adreset,DC=local', 'P@ssW0rd')
+    expected = {
+        'dn': 'CN=testuser2,OU=ADReset,DC=adreset,DC=local',
+        'guid': '10385a23-6def-4990-84a8-32444e36e496',
+        'primary_group_id': 1607,
+        'sam_account_name': 'testuser2',
+    }
+    assert mock_ad.get_user_profile('testuser2') == expected
+    with mock.patch.object(mock_ad, 'search') as mock_search:
+        assert mock_ad.get_user_profile('TestUser2') == expected
+        assert mock_ad.get_user_profile(guid='10385a23-6def-4990-84a8-32444e36e496') == expected
+    mock_search.assert_not_called()
+
+
+def test_get_user_profile_by_guid(mock_ad):
+    """Test that AD.get_user_profile can search for the user by GUID."""
+    mock_ad.login('CN=testuser,OU=ADReset,DC=adreset,DC=local', 'P@ssW0rd')
+    profile = mock_ad.get_user_profile(guid='5609c5ec-c0df-4480-a94b-b6eb0fc4c066')
+    assert profile['sam_account_name'] == 'testuser'
+
+
 def test_get_loggedin_user(mock_ad):
     """Test that the AD.get_loggedin_user returns the logged in user."""
     mock_ad.login('CN=testuser,OU=ADReset,DC=adreset,DC=local', 'P@ssW0rd')
     assert mock_ad.get_loggedin_user() == 'testuser'
 
 
+@pytest.mark.parametrize(
+    'username',
+    (
+        'CN=testuser2,OU=ADReset,DC=adreset,DC=local',
+        'testuser2@adreset.local',
+        'ADRESET\\testuser2',
+        'testuser2',
+    ),
+)
+def test_get_loggedin_user_profile(mock_ad, username):
+    """Test that the logged in user's profile is found from the username they logged in with."""
+    connection = mock_ad.connection
+    dn = 'CN=testuser2,OU=ADReset,DC=adreset,DC=local'
+    bind = connection.bind
+
+    def _bind_with_dn():
+        # The mock LDAP server only supports binding with a distinguished name
+        connection.user = dn
+        return bind()
+
+    with mock.patch.object(connection, 'bind', side_effect=_bind_with_dn):
+        mock_ad.login(username, 'P@ssW0rd')
+    with mock.patch.object(connection, 'extended', wraps=connection.extended) as mock_extended:
+        profile = mock_ad.get_loggedin_user_profile()
+    assert profile['guid'] == '10385a23-6def-4990-84a8-32444e36e496'
+    assert profile['sam_account_name'] == 'testuser2'
+    assert profile['dn'] == dn
+    assert mock_extended.call_count == 0
+
+
+def test_get_loggedin_user_profile_not_logged_in(mock_ad):
+    """Test that getting the logged in user's profile fails when the connection isn't bound."""
+    with pytest.raises(ADError):
+        mock_ad.get_loggedin_user_profile()
+
+
+def test_log_makes_no_ldap_operations(mock_ad):
+    """Test that logging includes the user the connection was bound as without asking AD."""
+    mock_ad.login('CN=testuser,OU=ADReset,DC=adreset,DC=local', 'P@ssW0rd')
+    standard = mock_ad.connection.extend.standard
+    with mock.patch.object(standard, 'who_am_i') as mock_who_am_i:
+        with mock.patch.object(adreset.ad.log, 'info') as mock_info:
+            mock_ad.log('info', 'Getting the account status for %s', 'lockeduser')
+        mock_ad.get_account_status('lockeduser')
+    mock_info.assert_called_once_with(
+        {'message': 'Getting the account status for %s', 'user': 'testuser'}, 'lockeduser'
+    )
+    mock_who_am_i.assert_not_called()
+
+
+def test_log_disabled_level(mock_ad):
+    """Test that a log message is not built when its level is disabled."""
+    mock_ad.login('CN=testuser,OU=ADReset,DC=adreset,DC=local', 'P@ssW0rd')
+    with mock.patch.object(adreset.ad.log, 'isEnabledFor', return_value=False):
+        with mock.patch.object(mock_ad, '_get_log_user') as mock_get_log_user:
+            with mock.patch.object(adreset.ad.log, 'debug') as mock_debug:
+                mock_ad.log('debug', 'Searching Active Directory')
+    mock_get_log_user.assert_not_called()
+    mock_debug.assert_not_called()
+
+
 def test_reset_password(mock_ad):
     """Test the AD.reset_password method."""
     mock_ad.login('CN=testuser,OU=ADReset,DC=adreset,DC=local', 'P@ssW0rd')
@@ -143,6 +259,32 @@ def test_reset_password(mock_ad):
     assert str(mock_ad.get_attribute('lockedUser', 'lockoutTime')) == '1601-01-01 00:00:00+00:00'
 
 
+def test_reset_password_stale_identity(mock_ad):
+    """Test that the password is reset on the user's current DN instead of the cached one."""
+    mock_ad.login('CN=testuser,OU=ADReset,DC=adreset,DC=local', 'P@ssW0rd')
+    # The user was cached before they were moved to another organizational unit
+    mock_ad._cache_identity(
+        {
+            'guid': '8ee45029-a2bc-4dd8-8b7c-b4a672af3396',
+            'sam_account_name': 'testuser3',
+            'dn': 'CN=testuser3,OU=Old,DC=adreset,DC=local',
+        }
+    )
+    mock_ad.reset_password('testuser3', 'NewP@ssw0rd')
+    entry = mock_ad.connection.server.dit['CN=testuser3,OU=ADReset,DC=adreset,DC=local']
+    assert entry['unicodePwd'] == ['"NewP@ssw0rd"'.encode('utf-16-le')]
+
+
+def test_reset_password_rejected(mock_ad):
+    """Test that an error is raised when Active Directory rejects the new password."""
+    mock_ad.login('CN=testuser,OU=ADReset,DC=adreset,DC=local', 'P@ssW0rd')
+    with mock.patch.object(
+        mock_ad.connection.extend.microsoft, 'modify_password', return_value=False
+    ):
+        with pytest.raises(ADError):
+            mock_ad.reset_password('testuser3', 'NewP@ssw0rd')
+
+
 def test_is_pwd_never_expires_set():
     """Test the AD.is_pwd_never_expires_set method."""
     assert adreset.ad.AD.is_pwd_never_expires_set(65537) is True
@@ -203,68 +345,244 @@ def test_get_account_status(mock_ad):
     assert mock_ad.get_account_status('lockeduser') == expected
 
 
-class MockLDAPConnection(object):
-    """Mock ldap3.Connection."""
+@pytest.mark.parametrize('pool_size,threads', [(2, 2), (1, 1)])
+def test_get_account_status_pooled(app, pool_size, threads):
+    """Test that the domain is searched on a second pooled connection when one is available."""
+    mock_server = ldap3.Server(app.config['AD_LDAP_URI'], get_info=ldap3.OFFLINE_AD_2012_R2)
+    loader = ldap3.Connection(mock_server, client_strategy=ldap3.MOCK_SYNC)
+    loader.strategy.entries_from_json(path.join(path.dirname(__file__), 'directory.json'))
+    search_threads = set()
+
+    def _create_connection():
+        connection = ldap3.Connection(
+            mock_server,
+            'CN=testuser,OU=ADReset,DC=adreset,DC=local',
+            'P@ssW0rd',
+            client_strategy=ldap3.MOCK_SYNC,
+        )
+        connection.bind()
+        search = connection.search
+
+        def _search(*args, **kwargs):
+            search_threads.add(threading.current_thread().name)
+            return search(*args, **kwargs)
+
+        connection.search = _search
+        return connection
+
+    pool = ConnectionPool(_create_connection, size=pool_size)
+    with mock.patch.dict(app.extensions, {'adreset_ad_pool': pool}):
+        ad = adreset.ad.AD()
+        ad.service_account_login()
+        status = ad.get_account_status('lockeduser')
+        ad.close()
+    pool.executor.shutdown(wait=True)
+
+    assert status['account_is_locked_out'] is True
+    assert status['password_never_expires'] is True
+    assert len(search_threads) == threads
+    assert pool.stats()['created'] == pool_size
+    assert pool.stats()['in_use'] == 0
+    loader.unbind()
 
-    def __init__(self, search_side_effect):
-        """Initialize the mock ldap3 Connection."""
-        self.search_side_effect = search_side_effect
-        self.bound = True
-        self.authentication = ldap3.NTLM
-        self.username = None
-        self.password = None
-        self.response = None
 
-    def open(self):
-        """Open the connection."""
-        pass
+@pytest.mark.parametrize(
+    'sam_account_name,group,expected',
+    [
+        ('testuser', 'ADReset Admins', True),
+        ('testuser', 'ADReset Users', False),
+        ('testuser2', 'ADReset Admins', False),
+        # This is testuser2's primary group, which is also included in tokenGroups
+        ('testuser2', 'ADReset Users', True),
+        ('testuser3', 'ADReset Users', True),
+        ('testuser3', 'Domain Users', True),
+    ],
+)
+def test_check_group_membership(sam_account_name, group, expected, mock_ad):
+    """Test the AD.check_group_membership method."""
+    mock_ad.login('CN=testuser,OU=ADReset,DC=adreset,DC=local', 'P@ssW0rd')
+    assert mock_ad.check_group_membership(sam_account_name, group) is expected
 
-    def unbind(self):
-        """Unbind the connection."""
-        self.bound = False
 
-    def search(self, *args, **kwargs):
-        """Search LDAP and set self.response."""
-        self.response = self.search_side_effect.pop(0)
-        return True
+def test_check_groups_membership_single_token_groups_search(mock_ad):
+    """Test that the tokenGroups of a user are only searched for once per AD session."""
+    mock_ad.login('CN=testuser,OU=ADReset,DC=adreset,DC=local', 'P@ssW0rd')
+    with mock.patch.object(mock_ad, 'search', wraps=mock_ad.search) as mock_search:
+        assert mock_ad.check_groups_membership('testuser3', ['ADReset Admins', 'ADReset Users'])
+        assert mock_ad.check_group_membership('testuser3', 'Domain Users') is True
+    token_groups_searches = [
+        call for call in mock_search.call_args_list if call[1].get('search_scope') == ldap3.BASE
+    ]
+    assert len(token_groups_searches) == 1
+    user_dn = 'CN=testuser3,OU=ADReset,DC=adreset,DC=local'
+    assert token_groups_searches[0][1]['search_base'] == user_dn
 
 
-def test_check_group_membership_nested():
-    """Test the AD.check_group_membership method."""
-    search_side_effect = [
-        [{'attributes': {'distinguishedName': 'CN=ADReset Users,OU=Groups,DC=adreset,DC=local'}}],
-        [
-            {'attributes': {'sAMAccountName': 'testuser'}},
-            {'attributes': {'sAMAccountName': 'tbrady'}},
-        ],
-    ]
-    mock_conn_rv = MockLDAPConnection(search_side_effect)
-    with mock.patch('ldap3.Server'):
-        with mock.patch('ldap3.Connection', return_value=mock_conn_rv):
-            # AD.log will make calls to AD to get the display name, so just mock that
-            with mock.patch('adreset.ad.AD.log'):
-                ad = adreset.ad.AD()
-                assert ad.check_group_membership('testuser', 'ADReset Users') is True
-
-
-@pytest.mark.parametrize('primary_group,expected', [('ADReset Users', True), ('Some Group', False)])
-def test_check_group_membership_primary_group(primary_group, expected):
-    """Test the AD.check_group_membership method when the group is the primary group."""
-    group_dn_base = 'CN={0},OU=Groups,DC=adreset,DC=local'
-    search_side_effect = [
-        [{'attributes': {'distinguishedName': group_dn_base.format('ADReset Users')}}],
-        [
-            {'attributes': {'sAMAccountName': 'thanks'}},
-            {'attributes': {'sAMAccountName': 'tbrady'}},
-        ],
-        [{'attributes': {'primaryGroupID': 1607}}],
-        [{'attributes': {'objectSid': 'S-1-5-21-1270288957-3800934213-3019856503'}}],
-        [{'attributes': {'distinguishedName': group_dn_base.format(primary_group)}}],
+def test_check_user_group_membership(mock_ad):
+    """Test the AD.check_user_group_membership and AD.check_admin_group_membership methods."""
+    mock_ad.login('CN=testuser,OU=ADReset,DC=adreset,DC=local', 'P@ssW0rd')
+    # This is the GUID of testuser2
+    guid = '10385a23-6def-4990-84a8-32444e36e496'
+    assert mock_ad.check_user_group_membership(guid) is True
+    assert mock_ad.check_admin_group_membership(guid) is False
+
+
+def test_group_cache_shared_across_sessions(mock_ad):
+    """Test that the configured groups are only resolved once across AD sessions."""
+    mock_ad.login('CN=testuser,OU=ADReset,DC=adreset,DC=local', 'P@ssW0rd')
+    assert mock_ad.check_group_membership('testuser2', 'ADReset Users') is True
+    ad = adreset.ad.AD()
+    ad.service_account_login()
+    with mock.patch.object(ad, 'search', wraps=ad.search) as mock_search:
+        assert ad.check_group_membership('testuser3', 'ADReset Users') is True
+    search_filters = [call[0][0] for call in mock_search.call_args_list]
+    assert search_filters == [
+        '(&(sAMAccountType=805306368)(sAMAccountName=testuser3))',
+        '(objectClass=*)',
     ]
-    mock_conn_rv = MockLDAPConnection(search_side_effect)
-    with mock.patch('ldap3.Server'):
-        with mock.patch('ldap3.Connection', return_value=mock_conn_rv):
-            # AD.log will make calls to AD to get the display name, so just mock that
-            with mock.patch('adreset.ad.AD.log'):
-                ad = adreset.ad.AD()
-                assert ad.check_group_membership('testuser', 'ADReset Users') is expected
+
+
+def test_refresh_group_cache(mock_ad):
+    """Test that AD.refresh_group_cache resolves all the configured groups."""
+    mock_ad.login('CN=testuser,OU=ADReset,DC=adreset,DC=local', 'P@ssW0rd')
+    adreset.ad.group_cache.set('ADReset Users', {'objectSid': 'S-1-5-21-stale'})
+    assert mock_ad.refresh_group_cache() == {
+        'ADReset Admins': {
+            'distinguishedName': 'CN=ADReset Admins,OU=Groups,DC=adreset,DC=local',
+            'objectSid': 'S-1-5-21-1270288957-3800934213-3019856503-1606',
+        },
+        'ADReset Users': {
+            'distinguishedName': 'CN=ADReset Users,OU=Groups,DC=adreset,DC=local',
+            'objectSid': 'S-1-5-21-1270288957-3800934213-3019856503-1607',
+        },
+    }
+    assert adreset.ad.group_cache.get('ADReset Users')['objectSid'].endswith('-1607')
+
+
+def test_refresh_group_cache_single_search(mock_ad):
+    """Test that AD.refresh_group_cache resolves all the configured groups with one search."""
+    mock_ad.login('CN=testuser,OU=ADReset,DC=adreset,DC=local', 'P@ssW0rd')
+    with mock.patch.object(mock_ad, '_search_page', wraps=mock_ad._search_page) as mock_search:
+        mock_ad.refresh_group_cache()
+    assert mock_search.call_count == 1
+    assert mock_search.call_args[0][0] == (
+        '(&(|(sAMAccountType=268435456)(sAMAccountType=536870912))'
+        '(|(sAMAccountName=ADReset Users)(sAMAccountName=ADReset Admins)))'
+    )
+
+
+def test_paged_search(mock_ad):
+    """Test that AD.paged_search yields the entries of every page."""
+    mock_ad.login('CN=testuser,OU=ADReset,DC=adreset,DC=local', 'P@ssW0rd')
+    with mock.patch.object(mock_ad, '_search_page', wraps=mock_ad._search_page) as mock_search:
+        entries = list(mock_ad.paged_search('(objectClass=user)', ['sAMAccountName'], page_size=2))
+    names = {entry['attributes']['sAMAccountName'] for entry in entries}
+    assert {'testuser', 'testuser2', 'testuser3'} <= names
+    assert len(entries) == len(names)
+    assert mock_search.call_count == len(entries) // 2 + 1
+
+
+def test_paged_search_size_limit(mock_ad):
+    """Test that AD.paged_search stops requesting pages at the size limit."""
+    mock_ad.login('CN=testuser,OU=ADReset,DC=adreset,DC=local', 'P@ssW0rd')
+    with mock.patch.object(mock_ad, '_search_page', wraps=mock_ad._search_page) as mock_search:
+        entries = list(mock_ad.paged_search('(objectClass=*)', ['cn'], page_size=2, size_limit=3))
+    assert len(entries) == 3
+    assert mock_search.call_count == 2
+    # The second page is only requested for the one remaining entry
+    assert mock_search.call_args[0][4] == 1
+
+
+def test_paged_search_not_logged_in(mock_ad):
+    """Test that AD.paged_search requires a bound connection."""
+    with pytest.raises(ADError):
+        next(mock_ad.paged_search('(objectClass=*)'))
+
+
+@pytest.mark.parametrize(
+    'object_type,attributes,expected',
+    [
+        (None, {'sAMAccountName': 'testuser'}, '(sAMAccountName=testuser)'),
+        (
+            'user',
+            {'sAMAccountName': 'test*'},
+            '(&(sAMAccountType=805306368)(sAMAccountName=test\\2a))',
+        ),
+        (
+            'group',
+            {'sAMAccountName': ['Admins', 'Users (All)']},
+            '(&(|(sAMAccountType=268435456)(sAMAccountType=536870912))'
+            '(|(sAMAccountName=Admins)(sAMAccountName=Users \\28All\\29)))',
+        ),
+    ],
+)
+def test_build_search_filter(object_type, attributes, expected):
+    """Test that the filters match the object type and escape the values."""
+    assert adreset.ad.build_search_filter(object_type, **attributes) == expected
+
+
+def test_build_search_filter_unsupported_type():
+    """Test that an unsupported object type is rejected."""
+    with pytest.raises(ValueError):
+        adreset.ad.build_search_filter('computer', sAMAccountName='server$')
+
+
+def test_search_bases(app, mock_ad):
+    """Test that the users and groups are searched for from the configured search bases."""
+    search_bases = {
+        'AD_USERS_SEARCH_BASE': 'OU=ADReset,DC=adreset,DC=local',
+        'AD_GROUPS_SEARCH_BASE': 'OU=Groups,DC=adreset,DC=local',
+    }
+    mock_ad.login('CN=testuser,OU=ADReset,DC=adreset,DC=local', 'P@ssW0rd')
+    with mock.patch.dict(app.config, search_bases):
+        with mock.patch.object(mock_ad, 'search', wraps=mock_ad.search) as mock_search:
+            assert mock_ad.get_dn('testuser2') == 'CN=testuser2,OU=ADReset,DC=adreset,DC=local'
+            assert mock_ad.get_group_sid('ADReset Users').endswith('-1607')
+    search_bases = [call[1]['search_base'] for call in mock_search.call_args_list]
+    assert search_bases == ['OU=ADReset,DC=adreset,DC=local', 'OU=Groups,DC=adreset,DC=local']
+
+
+def test_search_filter_escaped(mock_ad):
+    """Test that a wildcard in a sAMAccountName doesn't match other users."""
+    mock_ad.login('CN=testuser,OU=ADReset,DC=adreset,DC=local', 'P@ssW0rd')
+    with pytest.raises(ADError):
+        mock_ad.get_dn('testuser*')
+
+
+def test_identity_cache(mock_ad):
+    """Test that the GUID, sAMAccountName, and DN of a user are resolved with a single search."""
+    mock_ad.login('CN=testuser,OU=ADReset,DC=adreset,DC=local', 'P@ssW0rd')
+    guid = '10385a23-6def-4990-84a8-32444e36e496'
+    with mock.patch.object(mock_ad, 'search', wraps=mock_ad.search) as mock_search:
+        assert mock_ad.get_guid('TestUser2') == guid
+        assert mock_ad.get_dn('testuser2') == 'CN=testuser2,OU=ADReset,DC=adreset,DC=local'
+        # Another AD session is served from the process-wide cache
+        ad = adreset.ad.AD()
+        ad.service_account_login()
+        assert ad.get_sam_account_name(guid) == 'testuser2'
+    assert mock_search.call_count == 1
+    assert adreset.ad.identity_cache.stats()['hits'] == 2
+
+
+def test_identity_cache_disabled(app, mock_ad):
+    """Test that the identities are searched for every time when the cache is disabled."""
+    mock_ad.login('CN=testuser,OU=ADReset,DC=adreset,DC=local', 'P@ssW0rd')
+    with mock.patch.dict(app.config, {'AD_IDENTITY_CACHE_TTL': 0}):
+        with mock.patch.object(mock_ad, 'search', wraps=mock_ad.search) as mock_search:
+            mock_ad.get_guid('testuser2')
+            mock_ad.get_dn('testuser2')
+    assert mock_search.call_count == 2
+    assert len(adreset.ad.identity_cache) == 0
+
+
+def test_identity_cache_rename(mock_ad):
+    """Test that the old sAMAccountName of a renamed user is removed from the cache."""
+    mock_ad.login('CN=testuser,OU=ADReset,DC=adreset,DC=local', 'P@ssW0rd')
+    guid = '10385a23-6def-4990-84a8-32444e36e496'
+    # The user was cached before they were renamed from "olduser" to "testuser2"
+    mock_ad._cache_identity(
+        {'guid': guid, 'sam_account_name': 'olduser', 'dn': 'CN=olduser,DC=adreset,DC=local'}
+    )
+    assert mock_ad.get_guid('testuser2') == guid
+    assert adreset.ad.identity_cache.get(('sam_account_name', 'olduser')) is None
+    assert adreset.ad.identity_cache.get(('guid', guid))['sam_account_name'] == 'testuser2'
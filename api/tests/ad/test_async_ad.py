@@ -0,0 +1,154 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import asyncio
+from os import path
+import threading
+
+import ldap3
+import mock
+import pytest
+from werkzeug.exceptions import Unauthorized
+
+from adreset.async_ad import AsyncAD
+from adreset.error import ADError, ValidationError
+
+
+_service_dn = 'CN=testuser,OU=ADReset,DC=adreset,DC=local'
+
+
+def _run(coroutine):
+    """Run the coroutine in a new event loop and return its result."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+@pytest.fixture(scope='function')
+def mock_connection(app):
+    """Pytest fixture that creates an asynchronous mock LDAP connection."""
+    mock_server = ldap3.Server(app.config['AD_LDAP_URI'], get_info=ldap3.OFFLINE_AD_2012_R2)
+    connection = ldap3.Connection(mock_server, client_strategy=ldap3.MOCK_ASYNC)
+    ldap_entries_path = path.join(path.abspath(path.dirname(__file__)), 'directory.json')
+    connection.strategy.entries_from_json(ldap_entries_path)
+    yield connection
+    connection.unbind()
+
+
+@pytest.fixture(scope='function')
+def mock_async_ad(mock_connection):
+    """Pytest fixture that creates an AsyncAD object that uses the mock LDAP connection."""
+    with mock.patch.object(AsyncAD, '_create_connection', return_value=mock_connection):
+        yield AsyncAD()
+
+
+def test_login(mock_async_ad):
+    """Test that AsyncAD.login binds the connection and remembers the user."""
+    _run(mock_async_ad.login(_service_dn, 'P@ssW0rd'))
+    assert mock_async_ad._connection.bound is True
+    assert mock_async_ad._get_log_user() == 'testuser'
+
+
+def test_login_failed(mock_async_ad):
+    """Test that AsyncAD.login raises an exception when the credentials are invalid."""
+    with pytest.raises(Unauthorized):
+        _run(mock_async_ad.login('CN=testuser2,OU=ADReset,DC=adreset,DC=local', 'wrong'))
+
+
+def test_search_not_logged_in(mock_async_ad):
+    """Test that AsyncAD.search requires a bound connection."""
+    with pytest.raises(ADError, match='You must be logged into LDAP to search'):
+        _run(mock_async_ad.search('(sAMAccountName=testuser2)'))
+
+
+def test_get_attributes(mock_async_ad):
+    """Test that AsyncAD.get_attributes returns the same result as the synchronous client."""
+
+    async def _get_attributes():
+        await mock_async_ad.service_account_login()
+        return await mock_async_ad.get_attributes(
+            'testuser2', ['primaryGroupID', 'userPrincipalName']
+        )
+
+    assert _run(_get_attributes()) == {
+        'primaryGroupID': 1607,
+        'userPrincipalName': 'testuser2@adreset.local',
+    }
+
+
+def test_get_account_status(mock_async_ad, mock_connection, mock_ad):
+    """Test that the domain and user attributes are searched for concurrently."""
+    events = []
+    threads = []
+    both_sent = threading.Event()
+    search = mock_connection.search
+    get_response = mock_connection.get_response
+
+    def _search(*args, **kwargs):
+        events.append('search')
+        if events.count('search') == 2:
+            both_sent.set()
+        return search(*args, **kwargs)
+
+    def _get_response(*args, **kwargs):
+        # The mock responses are instant, so wait like for a response from a server. This times
+        # out if the second search is only sent after the first response.
+        both_sent.wait(1)
+        events.append('response')
+        threads.append(threading.current_thread().name)
+        return get_response(*args, **kwargs)
+
+    async def _get_account_status():
+        await mock_async_ad.service_account_login()
+        with mock.patch.object(mock_connection, 'search', _search):
+            with mock.patch.object(mock_connection, 'get_response', _get_response):
+                return await mock_async_ad.get_account_status('lockeduser')
+
+    mock_ad.service_account_login()
+    assert _run(_get_account_status()) == mock_ad.get_account_status('lockeduser')
+    # Both searches were sent before the first response was received
+    assert events[:3] == ['search', 'search', 'response']
+    # The responses are waited on by the threads of AsyncAD instead of the ASGI thread pool
+    assert all(thread.startswith('adreset-ldap') for thread in threads)
+
+
+def test_check_user_group_membership(mock_async_ad):
+    """Test that the nested group membership of a user is checked."""
+
+    async def _check():
+        await mock_async_ad.service_account_login()
+        return (
+            await mock_async_ad.check_user_group_membership('10385a23-6def-4990-84a8-32444e36e496'),
+            await mock_async_ad.check_admin_group_membership(
+                '10385a23-6def-4990-84a8-32444e36e496'
+            ),
+        )
+
+    assert _run(_check()) == (True, False)
+
+
+def test_reset_password(mock_async_ad, mock_connection):
+    """Test that AsyncAD.reset_password sets the password and unlocks the account."""
+
+    async def _reset_password():
+        await mock_async_ad.service_account_login()
+        await mock_async_ad.reset_password('lockeduser', 'RedSoxWorldSeriesCh@mps')
+
+    _run(_reset_password())
+    entry = mock_connection.server.dit['CN=lockeduser,OU=ADReset,DC=adreset,DC=local']
+    assert entry['lockoutTime'] == [b'0']
+    assert entry['unicodePwd'] == ['"RedSoxWorldSeriesCh@mps"'.encode('utf-16-le')]
+
+
+def test_reset_password_invalid(mock_async_ad):
+    """Test that AsyncAD.reset_password validates the password against the domain's policy."""
+
+    async def _reset_password():
+        await mock_async_ad.service_account_login()
+        await mock_async_ad.reset_password('lockeduser', 'password')
+
+    with pytest.raises(ValidationError, match='complexity requirements'):
+        _run(_reset_password())
@@ -0,0 +1,178 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import os
+
+import mock
+import pytest
+
+import adreset.ad
+from adreset.error import ADError
+from adreset.pool import ConnectionPool
+
+
+class MockPooledConnection(object):
+    """Mock a bound ldap3.Connection."""
+
+    def __init__(self):
+        """Initialize the mock ldap3 Connection."""
+        self.bound = True
+        self.closed = False
+        self.bind_succeeds = True
+        self.extend = mock.Mock()
+        self.extend.standard.who_am_i.return_value = 'CN=testuser,OU=ADReset,DC=adreset,DC=local'
+
+    def open(self):
+        """Open the connection."""
+        self.closed = False
+
+    def bind(self):
+        """Bind the connection."""
+        self.bound = self.bind_succeeds
+        return self.bound
+
+    def unbind(self):
+        """Unbind the connection."""
+        self.bound = False
+        self.closed = True
+
+
+def test_pool_reuses_connections():
+    """Test that a released connection is reused on the next checkout."""
+    pool = ConnectionPool(MockPooledConnection, size=2)
+    connection = pool.acquire()
+    pool.release(connection)
+    assert pool.acquire() is connection
+    stats = pool.stats()
+    assert stats['created'] == 1
+    assert stats['reused'] == 1
+    assert stats['in_use'] == 1
+    assert stats['idle'] == 0
+
+
+def test_pool_reset_after_fork():
+    """Test that a forked process opens its own connections instead of the inherited ones."""
+    pool = ConnectionPool(MockPooledConnection, size=1, timeout=0)
+    inherited = pool.acquire()
+    pool.release(inherited)
+    pid = os.fork()
+    if pid == 0:
+        succeeded = False
+        try:
+            connection = pool.acquire()
+            succeeded = connection is not inherited and not inherited.closed
+        finally:
+            os._exit(0 if succeeded else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(status) == 0
+    # The parent process keeps its connection
+    assert pool.acquire() is inherited
+
+
+def test_pool_is_bounded():
+    """Test that checking out more connections than the pool size times out."""
+    pool = ConnectionPool(MockPooledConnection, size=2, timeout=0)
+    pool.acquire()
+    pool.acquire()
+    with pytest.raises(ADError, match='too busy'):
+        pool.acquire()
+    assert pool.stats()['timeouts'] == 1
+    assert pool.total == 2
+
+
+def test_pool_acquire_without_waiting():
+    """Test that a checkout without waiting returns None when all the connections are in use."""
+    pool = ConnectionPool(MockPooledConnection, size=1)
+    connection = pool.acquire(wait=False)
+    assert connection is not None
+    assert pool.acquire(wait=False) is None
+    assert pool.stats()['timeouts'] == 0
+    pool.release(connection)
+    assert pool.acquire(wait=False) is connection
+
+
+def test_pool_factory_failure_frees_slot():
+    """Test that a failure to create a connection doesn't leak a slot in the pool."""
+    pool = ConnectionPool(mock.Mock(side_effect=ADError('failed')), size=1, timeout=0)
+    with pytest.raises(ADError, match='failed'):
+        pool.acquire()
+    assert pool.total == 0
+
+
+def test_pool_recycles_old_connections():
+    """Test that connections past the maximum age are replaced."""
+    pool = ConnectionPool(MockPooledConnection, size=1, max_age=60)
+    connection = pool.acquire()
+    pool.release(connection)
+    with mock.patch('adreset.pool.time.monotonic', return_value=10 ** 9):
+        new_connection = pool.acquire()
+    assert new_connection is not connection
+    assert connection.bound is False
+    stats = pool.stats()
+    assert stats['recycled'] == 1
+    assert stats['created'] == 2
+
+
+def test_pool_rebinds_unhealthy_connections():
+    """Test that a connection that is no longer bound is rebound on checkout."""
+    pool = ConnectionPool(MockPooledConnection, size=1)
+    connection = pool.acquire()
+    pool.release(connection)
+    connection.bound = False
+    assert pool.acquire() is connection
+    assert connection.bound is True
+    assert pool.stats()['rebound'] == 1
+
+
+def test_pool_discards_connections_that_fail_to_rebind():
+    """Test that a connection that can't be rebound is replaced."""
+    pool = ConnectionPool(MockPooledConnection, size=1)
+    connection = pool.acquire()
+    pool.release(connection)
+    connection.bound = False
+    connection.bind_succeeds = False
+    assert pool.acquire() is not connection
+    assert pool.stats()['discarded'] == 1
+
+
+def test_pool_health_check_on_idle_connections():
+    """Test that connections idle past the health check interval are verified."""
+    pool = ConnectionPool(MockPooledConnection, size=1, health_check_interval=0)
+    connection = pool.acquire()
+    pool.release(connection)
+    connection.extend.standard.who_am_i.reset_mock()
+    assert pool.acquire() is connection
+    connection.extend.standard.who_am_i.assert_called_once_with()
+
+
+def test_pool_release_discards_unbound_connections():
+    """Test that a connection released in an unbound state is not returned to the pool."""
+    pool = ConnectionPool(MockPooledConnection, size=1)
+    connection = pool.acquire()
+    connection.unbind()
+    pool.release(connection)
+    assert pool.stats()['idle'] == 0
+    assert pool.total == 0
+
+
+def test_service_account_login_uses_pool(app):
+    """Test that AD.service_account_login checks out a connection from the pool."""
+    pool = ConnectionPool(MockPooledConnection, size=1)
+    with mock.patch.dict(app.extensions, {'adreset_ad_pool': pool}):
+        ad = adreset.ad.AD()
+        ad.service_account_login()
+        assert pool.stats()['in_use'] == 1
+        ad.close()
+    stats = pool.stats()
+    assert stats['in_use'] == 0
+    assert stats['idle'] == 1
+
+
+def test_login_releases_pooled_connection(app, mock_ad):
+    """Test that logging in as a user never binds on a pooled connection."""
+    pool = ConnectionPool(MockPooledConnection, size=1)
+    with mock.patch.dict(app.extensions, {'adreset_ad_pool': pool}):
+        mock_ad.service_account_login()
+        mock_ad.login('CN=testuser,OU=ADReset,DC=adreset,DC=local', 'P@ssW0rd')
+    assert pool.stats()['idle'] == 1
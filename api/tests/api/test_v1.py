@@ -6,10 +6,14 @@ import json
 from datetime import datetime
 
 import flask_jwt_extended
+import ldap3
 import pytest
 import mock
+import sqlalchemy
+from passlib.context import CryptContext
 
 from adreset import version
+import adreset.ad
 from adreset.models import User, Question, Answer, FailedAttempt, db
 
 
@@ -105,6 +109,36 @@ def test_admin_login(client, mock_admin_ad):
     assert decoded_token['user_claims']['roles'] == ['admin']
 
 
+def test_login_ldap_operations(client, mock_ad):
+    """Test the number of LDAP operations a login performs once the groups are cached."""
+    mock_ad.service_account_login()
+    mock_ad.refresh_group_cache()
+    connection = mock_ad.connection
+    with mock.patch.object(
+        connection, 'bind', wraps=connection.bind
+    ) as mock_bind, mock.patch.object(
+        connection, 'search', wraps=connection.search
+    ) as mock_search, mock.patch.object(
+        connection, 'extended', wraps=connection.extended
+    ) as mock_extended:
+        rv = client.post(
+            '/api/v1/login',
+            data=json.dumps(
+                {'username': 'CN=testuser2,OU=ADReset,DC=adreset,DC=local', 'password': 'P@ssW0rd'}
+            ),
+        )
+    assert rv.status_code == 200
+    decoded_token = flask_jwt_extended.decode_token(json.loads(rv.data.decode('utf-8'))['token'])
+    assert decoded_token['user_claims'] == {'roles': ['user'], 'username': 'testuser2'}
+    # The user's bind and the service account's bind
+    assert mock_bind.call_count == 2
+    # The user's profile and the user's tokenGroups
+    assert mock_search.call_count == 2
+    assert mock_search.call_args_list[1][1]['search_scope'] == ldap3.BASE
+    # The user is identified by the username they logged in with instead of a "Who am I?"
+    assert mock_extended.call_count == 0
+
+
 def test_logout(client, logged_in_headers):
     """Test that logouts are successfull."""
     rv = client.post('/api/v1/logout', headers=logged_in_headers)
@@ -291,6 +325,39 @@ def test_add_answers(client, logged_in_headers, admin_logged_in_headers):
     }
 
 
+def test_add_answers_queries(client, logged_in_headers):
+    """Test that the questions are queried once and the answers are hashed together."""
+    data = json.dumps(
+        [
+            {'question_id': 3, 'answer': 'Buzz Lightyear'},
+            {'question_id': 1, 'answer': 'strawberry'},
+            {'question_id': 2, 'answer': 'bright pink'},
+        ]
+    )
+    statements = []
+
+    def _record_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    hashing = client.application.extensions['adreset_hashing']
+    sqlalchemy.event.listen(db.engine, 'before_cursor_execute', _record_statement)
+    try:
+        with mock.patch.object(hashing, 'hash_answers', wraps=hashing.hash_answers) as mock_hash:
+            rv = client.post('/api/v1/answers', headers=logged_in_headers, data=data)
+    finally:
+        sqlalchemy.event.remove(db.engine, 'before_cursor_execute', _record_statement)
+    assert rv.status_code == 201
+    mock_hash.assert_called_once_with(['buzz lightyear', 'strawberry', 'bright pink'])
+    question_selects = [
+        statement
+        for statement in statements
+        if statement.startswith('SELECT') and 'FROM question' in statement
+    ]
+    assert len(question_selects) == 1
+    assert ' IN ' in question_selects[0]
+    assert Answer.verify_answer('strawberry', Answer.query.filter_by(question_id=1).one().answer)
+
+
 def test_add_answers_duplicate_question(client, logged_in_headers):
     """Test that the answers POST route errors when a duplicate question is provided."""
     data = json.dumps(
@@ -678,6 +745,50 @@ def test_reset(client, mock_ad):
     assert rv.data.decode('utf-8') == ''
 
 
+def test_reset_renamed_user(client, mock_ad):
+    """Test that a cached identity of a renamed user isn't used to reset another user."""
+    _configure_user()
+    # testuser2 was named testuser3 when they were cached, and another user now has that name
+    mock_ad._cache_identity(
+        {
+            'guid': '10385a23-6def-4990-84a8-32444e36e496',
+            'sam_account_name': 'testuser3',
+            'dn': 'CN=testuser2,OU=ADReset,DC=adreset,DC=local',
+        }
+    )
+    reset_data = json.loads(_reset_data)
+    reset_data['username'] = 'testuser3'
+    rv = client.post(
+        '/api/v1/reset', headers={'Content-Type': 'application/json'}, data=json.dumps(reset_data),
+    )
+    # The answers of testuser2 aren't checked since testuser3 doesn't have any
+    assert rv.status_code == 400
+    for dn in (
+        'CN=testuser2,OU=ADReset,DC=adreset,DC=local',
+        'CN=testuser3,OU=ADReset,DC=adreset,DC=local',
+    ):
+        assert 'unicodePwd' not in mock_ad.connection.server.dit[dn]
+
+
+def test_reset_rehashes_outdated_answers(client, mock_ad):
+    """Test that a successful reset upgrades the answers hashed with an outdated policy."""
+    _configure_user()
+    old_hashes = {answer.id: answer.answer for answer in Answer.query.all()}
+    context = CryptContext(schemes=['sha512_crypt'], deprecated='auto', sha512_crypt__rounds=2000)
+    with mock.patch.object(client.application.extensions['adreset_hashing'], 'context', context):
+        with mock.patch.object(
+            client.application.extensions['adreset_hashing'], 'policy', context.to_string()
+        ):
+            rv = client.post(
+                '/api/v1/reset', headers={'Content-Type': 'application/json'}, data=_reset_data
+            )
+    assert rv.status_code == 204
+    for answer in Answer.query.all():
+        assert answer.answer != old_hashes[answer.id]
+        assert answer.answer.startswith('$6$rounds=2000$')
+    assert Answer.verify_answer('strawberry', Answer.query.get(1).answer) is True
+
+
 def test_reset_no_user_in_ad(client, mock_ad):
     """Test the reset route on a user that does not exist in Active Directory."""
     headers = {'Content-Type': 'application/json'}
@@ -722,6 +833,21 @@ def test_reset_locked_out(client, mock_ad):
     }
 
 
+def test_reset_other_user_locked_out(client, mock_ad):
+    """Test that the failed attempts of another user don't lock out the user resetting."""
+    _configure_user()
+    other_user = User(ad_guid='5609c5ec-c0df-4480-a94b-b6eb0fc4c066')
+    db.session.add(other_user)
+    db.session.commit()
+    for _ in range(3):
+        db.session.add(FailedAttempt(user_id=other_user.id, time=datetime.utcnow()))
+    db.session.commit()
+    headers = {'Content-Type': 'application/json'}
+    rv = client.post('/api/v1/reset', headers=headers, data=_reset_data)
+    assert rv.status_code == 204
+    assert User.is_user_locked_out(other_user.id) is True
+
+
 def test_reset_gets_locked_out(client, mock_ad):
     """Test the reset route when a user gets locked out."""
     _configure_user()
@@ -856,3 +982,98 @@ def test_account_status_disabled(app, client, mock_ad):
     with mock.patch.dict(app.config, {'ACCOUNT_STATUS_ENABLED': False}):
         rv = client.get('/api/v1/account-status/lockeduser')
     assert rv.status_code == 404
+
+
+def test_account_status_cached(client, mock_ad):
+    """Test that the account status is cached until the user resets their password."""
+    _configure_user()
+    with mock.patch.object(
+        mock_ad, 'get_account_status', wraps=mock_ad.get_account_status
+    ) as mock_get_account_status:
+        with mock.patch('adreset.ad.AD', return_value=mock_ad):
+            assert client.get('/api/v1/account-status/testuser2').status_code == 200
+            # The sAMAccountName is case-insensitive
+            assert client.get('/api/v1/account-status/TestUser2').status_code == 200
+            assert mock_get_account_status.call_count == 1
+
+            rv = client.post(
+                '/api/v1/reset', headers={'Content-Type': 'application/json'}, data=_reset_data
+            )
+            assert rv.status_code == 204
+            assert client.get('/api/v1/account-status/testuser2').status_code == 200
+            assert mock_get_account_status.call_count == 2
+
+
+def test_account_status_not_found_cached(app, client, mock_ad):
+    """Test that a user that wasn't found is cached with its own time to live."""
+    with mock.patch.object(mock_ad, 'get_attributes', return_value={}) as mock_get_attributes:
+        with mock.patch('adreset.ad.AD', return_value=mock_ad):
+            for _ in range(2):
+                rv = client.get('/api/v1/account-status/nobody')
+                assert rv.status_code == 404
+                assert json.loads(rv.data.decode('utf-8'))['message'] == 'The user was not found'
+            assert mock_get_attributes.call_count == 1
+
+            with mock.patch.dict(app.config, {'ACCOUNT_STATUS_NOT_FOUND_CACHE_TTL': 0}):
+                client.get('/api/v1/account-status/nobody2')
+                client.get('/api/v1/account-status/nobody2')
+            assert mock_get_attributes.call_count == 3
+
+
+def test_account_status_not_found_directory(client, mock_ad):
+    """Test that a user that isn't in the directory is a 404 that is only searched for once."""
+    with mock.patch('adreset.ad.AD', return_value=mock_ad):
+        with mock.patch.object(mock_ad, 'search', wraps=mock_ad.search) as mock_search:
+            for _ in range(2):
+                rv = client.get('/api/v1/account-status/nobodyatall')
+                assert rv.status_code == 404
+                assert json.loads(rv.data.decode('utf-8'))['message'] == 'The user was not found'
+    search_filters = [call[0][0] for call in mock_search.call_args_list]
+    assert search_filters.count('(&(sAMAccountType=805306368)(sAMAccountName=nobodyatall))') == 1
+
+
+@pytest.mark.parametrize(
+    'method, url, data, expected_status',
+    (
+        ('GET', '/api/v1/account-status/lockeduser', None, 200),
+        ('GET', '/api/v1/account-status/nobody', None, 404),
+        ('POST', '/api/v1/reset', _reset_data, 204),
+        ('POST', '/api/v1/reset', json.dumps(dict(json.loads(_reset_data), answers=[])), 400),
+        (
+            'POST',
+            '/api/v1/reset',
+            json.dumps(
+                dict(
+                    json.loads(_reset_data),
+                    answers=[
+                        {'question_id': 1, 'answer': 'wrong'},
+                        {'question_id': 2, 'answer': 'green'},
+                        {'question_id': 3, 'answer': 'buzz lightyear'},
+                    ],
+                )
+            ),
+            401,
+        ),
+    ),
+)
+def test_pooled_connections_returned(app, mock_ad_pool, method, url, data, expected_status):
+    """Test that the pooled connections are returned after every request, even on errors."""
+    _configure_user()
+    # Don't use the client fixture since it keeps the last request context until the next request
+    client = app.test_client()
+    for _ in range(3):
+        rv = client.open(
+            url, method=method, data=data, headers={'Content-Type': 'application/json'}
+        )
+        assert rv.status_code == expected_status, rv.data
+        assert mock_ad_pool.stats()['in_use'] == 0
+
+
+def test_pooled_connection_returned_at_teardown(app, mock_ad_pool):
+    """Test that a pooled connection is returned when the request ends, even if it's referenced."""
+    with app.test_request_context():
+        ad = adreset.ad.AD()
+        ad.service_account_login()
+        assert mock_ad_pool.stats()['in_use'] == 1
+    assert mock_ad_pool.stats()['in_use'] == 0
+    assert ad._connection is None
@@ -0,0 +1,98 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import os
+from os import path
+import struct
+import uuid
+
+import ldap3
+from ldap3.utils.ciDict import CaseInsensitiveDict
+from mock import patch, PropertyMock
+import pytest
+
+import adreset.ad
+
+
+# The size of the synthetic directory can be changed with these environment variables
+NUM_USERS = int(os.environ.get('ADRESET_BENCHMARK_USERS', 20000))
+NUM_GROUPS = int(os.environ.get('ADRESET_BENCHMARK_GROUPS', 2000))
+_base_dn = 'DC=adreset,DC=local'
+_user_template_dn = f'CN=testuser3,OU=ADReset,{_base_dn}'
+_group_template_dn = f'CN=ADReset Users,OU=Groups,{_base_dn}'
+# The lines of the benchmark report that is shown after the tests
+report_lines = []
+
+
+def pytest_terminal_summary(terminalreporter):
+    """Show the results of the benchmarks that were run."""
+    if report_lines:
+        terminalreporter.section('benchmark results')
+        for line in report_lines:
+            terminalreporter.write_line(line)
+
+
+def _clone_entry(dit, template_dn, dn, name, rid, removed_attributes=()):
+    """
+    Add a copy of an entry in the mock directory with a new name, GUID, and SID.
+
+    :param dict dit: the mock directory information tree
+    :param str template_dn: the distinguished name of the entry to copy
+    :param str dn: the distinguished name of the new entry
+    :param str name: the name and sAMAccountName of the new entry
+    :param int rid: the relative identifier of the SID of the new entry
+    :kwarg tuple removed_attributes: the attributes not to copy
+    """
+    template = dit[template_dn]
+    entry = CaseInsensitiveDict()
+    for attribute, values in template.items():
+        if attribute not in removed_attributes:
+            entry[attribute] = list(values)
+    for attribute in ('cn', 'name', 'sAMAccountName', 'displayName'):
+        if attribute in entry:
+            entry[attribute] = [name.encode('utf-8')]
+    entry['distinguishedName'] = [dn.encode('utf-8')]
+    entry['entryDN'] = [dn.encode('utf-8')]
+    entry['objectGUID'] = [uuid.uuid4().bytes_le]
+    # Replace the RID at the end of the template's SID
+    entry['objectSid'] = [template['objectSid'][0][:-4] + struct.pack('<I', rid)]
+    if 'userPrincipalName' in entry:
+        entry['userPrincipalName'] = [f'{name}@adreset.local'.encode('utf-8')]
+    dit[dn] = entry
+
+
+@pytest.fixture(scope='session')
+def scaled_connection(app):
+    """Pytest fixture that creates a mock LDAP directory with many synthetic users and groups."""
+    mock_server = ldap3.Server(app.config['AD_LDAP_URI'], get_info=ldap3.OFFLINE_AD_2012_R2)
+    connection = ldap3.Connection(
+        mock_server, client_strategy=ldap3.MOCK_SYNC, authentication=ldap3.SIMPLE
+    )
+    ldap_entries_path = path.join(path.dirname(path.dirname(__file__)), 'ad', 'directory.json')
+    connection.strategy.entries_from_json(ldap_entries_path)
+    dit = mock_server.dit
+    for i in range(NUM_USERS):
+        name = f'benchuser{i}'
+        _clone_entry(dit, _user_template_dn, f'CN={name},OU=ADReset,{_base_dn}', name, 10000 + i)
+    for i in range(NUM_GROUPS):
+        name = f'Bench Group {i}'
+        _clone_entry(
+            dit,
+            _group_template_dn,
+            f'CN={name},OU=Groups,{_base_dn}',
+            name,
+            100000 + i,
+            removed_attributes=('member',),
+        )
+
+    yield connection
+    connection.unbind()
+
+
+@pytest.fixture(scope='function')
+def scaled_ad(scaled_connection):
+    """Pytest fixture that makes the AD class use the scaled mock LDAP directory."""
+    with patch('adreset.ad.AD.connection', new_callable=PropertyMock) as mock_ad_connection:
+        mock_ad_connection.return_value = scaled_connection
+        yield adreset.ad.AD()
@@ -0,0 +1,230 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+from contextlib import contextmanager
+from collections import Counter
+import json
+import math
+import os
+from os import path
+import time
+import warnings
+
+from flask_jwt_extended import create_access_token
+import mock
+import pytest
+import sqlalchemy
+
+from adreset.models import db, Answer, User
+from tests.benchmarks.conftest import NUM_GROUPS, NUM_USERS, report_lines
+
+
+pytestmark = pytest.mark.benchmark
+
+ITERATIONS = int(os.environ.get('ADRESET_BENCHMARK_ITERATIONS', 100))
+# How much slower than the baseline the 95th percentile latency can be before a warning is shown
+LATENCY_TOLERANCE = float(os.environ.get('ADRESET_BENCHMARK_TOLERANCE', 1.5))
+BASELINES_PATH = path.join(path.dirname(__file__), 'baselines.json')
+_json_headers = {'Content-Type': 'application/json'}
+
+
+@contextmanager
+def _count_operations(connection):
+    """
+    Count the LDAP operations on the connection and the SQL statements on the database.
+
+    :param ldap3.Connection connection: the mock LDAP connection to count the operations of
+    :return: a Counter of the operation names to the number of times they were run
+    :rtype: collections.Counter
+    """
+    counts = Counter()
+
+    def _count_sql(*args, **kwargs):
+        counts['sql'] += 1
+
+    def _wrap(operation):
+        method = getattr(connection, operation)
+
+        def _counted(*args, **kwargs):
+            counts[f'ldap_{operation}'] += 1
+            return method(*args, **kwargs)
+
+        return mock.patch.object(connection, operation, side_effect=_counted)
+
+    sqlalchemy.event.listen(db.engine, 'before_cursor_execute', _count_sql)
+    try:
+        with _wrap('bind'), _wrap('search'), _wrap('modify'):
+            yield counts
+    finally:
+        sqlalchemy.event.remove(db.engine, 'before_cursor_execute', _count_sql)
+
+
+def _percentile(sorted_values, percent):
+    """Get the percentile of the sorted values using the nearest-rank method."""
+    rank = max(int(math.ceil(percent / 100 * len(sorted_values))), 1)
+    return sorted_values[rank - 1]
+
+
+def _load_baselines():
+    """Load the stored baselines or return an empty dictionary if there are none."""
+    if not path.exists(BASELINES_PATH):
+        return {}
+    with open(BASELINES_PATH) as baselines_file:
+        return json.load(baselines_file)
+
+
+def _benchmark(request, connection, endpoint, send_request):
+    """
+    Send the requests, report the results, and compare them against the stored baseline.
+
+    :param _pytest.fixtures.FixtureRequest request: the pytest request of the test
+    :param ldap3.Connection connection: the mock LDAP connection used by the application
+    :param str endpoint: the name of the endpoint being benchmarked
+    :param callable send_request: a callable that receives the iteration number and sends a request
+    """
+    # Send an unmeasured request first so that the application's caches are warm. It uses the
+    # iteration number after the last measured one.
+    rv = send_request(ITERATIONS)
+    assert rv.status_code < 400, rv.data
+    timings = []
+    with _count_operations(connection) as counts:
+        start = time.perf_counter()
+        for i in range(ITERATIONS):
+            request_start = time.perf_counter()
+            rv = send_request(i)
+            timings.append(time.perf_counter() - request_start)
+            assert rv.status_code < 400, rv.data
+        total = time.perf_counter() - start
+
+    timings.sort()
+    result = {
+        'p50_ms': round(_percentile(timings, 50) * 1000, 3),
+        'p95_ms': round(_percentile(timings, 95) * 1000, 3),
+        'p99_ms': round(_percentile(timings, 99) * 1000, 3),
+        'requests_per_second': round(ITERATIONS / total, 1),
+        # The operations are deterministic, so they are stored per request
+        'operations': {
+            operation: round(count / ITERATIONS, 2) for operation, count in sorted(counts.items())
+        },
+    }
+    operations = ', '.join(f'{name}: {count}' for name, count in result['operations'].items())
+    report_lines.append(
+        f'{endpoint}: p50 {result["p50_ms"]}ms, p95 {result["p95_ms"]}ms, '
+        f'p99 {result["p99_ms"]}ms, {result["requests_per_second"]} requests/second, '
+        f'{operations} per request'
+    )
+
+    baselines = _load_baselines()
+    if request.config.getoption('--update-benchmark-baselines'):
+        baselines.setdefault('endpoints', {})[endpoint] = result
+        baselines['directory'] = {'users': NUM_USERS, 'groups': NUM_GROUPS}
+        baselines['iterations'] = ITERATIONS
+        with open(BASELINES_PATH, 'w') as baselines_file:
+            json.dump(baselines, baselines_file, indent=4, sort_keys=True)
+            baselines_file.write('\n')
+        return
+
+    baseline = baselines.get('endpoints', {}).get(endpoint)
+    if not baseline:
+        return
+
+    # More LDAP or SQL operations per request is always a regression
+    for operation, count in result['operations'].items():
+        assert count <= baseline['operations'].get(operation, 0), (
+            f'{endpoint} made {count} {operation} operations per request but the baseline is '
+            f'{baseline["operations"].get(operation, 0)}'
+        )
+    # Latency depends on the machine, so only warn about it
+    if result['p95_ms'] > baseline['p95_ms'] * LATENCY_TOLERANCE:
+        warnings.warn(
+            f'The p95 latency of {endpoint} is {result["p95_ms"]}ms but the baseline is '
+            f'{baseline["p95_ms"]}ms'
+        )
+
+
+def _user_dn(i):
+    """Get the distinguished name of a synthetic user."""
+    return f'CN=benchuser{i},OU=ADReset,DC=adreset,DC=local'
+
+
+def _user_headers(scaled_ad, i):
+    """Create the user in the database and get the headers with a valid token for them."""
+    guid = scaled_ad.get_user_profile(f'benchuser{i}')['guid']
+    db.session.add(User(ad_guid=guid))
+    db.session.commit()
+    token = create_access_token(identity={'guid': guid, 'username': f'benchuser{i}'})
+    return dict(_json_headers, Authorization=f'Bearer {token}')
+
+
+def test_benchmark_questions(request, client, scaled_ad, scaled_connection):
+    """Benchmark listing the questions."""
+    _benchmark(request, scaled_connection, 'questions', lambda i: client.get('/api/v1/questions'))
+
+
+def test_benchmark_login(request, client, scaled_ad, scaled_connection):
+    """Benchmark the first login of different users."""
+
+    def _login(i):
+        data = json.dumps({'username': _user_dn(i), 'password': 'P@ssW0rd'})
+        return client.post('/api/v1/login', data=data)
+
+    _benchmark(request, scaled_connection, 'login', _login)
+
+
+def test_benchmark_answers(request, client, scaled_ad, scaled_connection):
+    """Benchmark setting the secret answers of different users."""
+    headers = [_user_headers(scaled_ad, i) for i in range(ITERATIONS + 1)]
+    data = json.dumps(
+        [
+            {'question_id': 1, 'answer': 'strawberry'},
+            {'question_id': 2, 'answer': 'green'},
+            {'question_id': 3, 'answer': 'buzz lightyear'},
+        ]
+    )
+    _benchmark(
+        request,
+        scaled_connection,
+        'answers',
+        lambda i: client.post('/api/v1/answers', headers=headers[i], data=data),
+    )
+
+
+def test_benchmark_reset(request, client, scaled_ad, scaled_connection):
+    """Benchmark resetting the passwords of different users with their secret answers."""
+    for i in range(ITERATIONS + 1):
+        guid = scaled_ad.get_user_profile(f'benchuser{i}')['guid']
+        user = User(ad_guid=guid)
+        db.session.add(user)
+        db.session.flush()
+        for question_id, answer in enumerate(('strawberry', 'green', 'buzz lightyear'), 1):
+            db.session.add(
+                Answer(answer=Answer.hash_answer(answer), user_id=user.id, question_id=question_id)
+            )
+    db.session.commit()
+
+    def _reset(i):
+        data = json.dumps(
+            {
+                'answers': [
+                    {'question_id': 1, 'answer': 'strawberry'},
+                    {'question_id': 2, 'answer': 'green'},
+                    {'question_id': 3, 'answer': 'buzz lightyear'},
+                ],
+                'new_password': 'RedSoxWorldSeriesCh@mps',
+                'username': f'benchuser{i}',
+            }
+        )
+        return client.post('/api/v1/reset', headers=_json_headers, data=data)
+
+    _benchmark(request, scaled_connection, 'reset', _reset)
+
+
+def test_benchmark_account_status(request, client, scaled_ad, scaled_connection):
+    """Benchmark getting the account status of different users."""
+    _benchmark(
+        request,
+        scaled_connection,
+        'account-status',
+        lambda i: client.get(f'/api/v1/account-status/benchuser{i}'),
+    )
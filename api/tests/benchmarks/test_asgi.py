@@ -0,0 +1,200 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import os
+from os import path
+import threading
+import time
+
+import ldap3
+from mock import patch, PropertyMock
+import pytest
+
+import adreset.ad
+from adreset.asgi_app import ASGIApp
+from adreset.async_ad import AsyncAD
+from tests.api.test_v1 import _configure_user, _reset_data
+from tests.benchmarks.conftest import report_lines
+from tests.test_asgi import send_request
+
+
+pytestmark = pytest.mark.benchmark
+
+REQUESTS = int(os.environ.get('ADRESET_BENCHMARK_CONCURRENT_REQUESTS', 200))
+CONCURRENCY = int(os.environ.get('ADRESET_BENCHMARK_CONCURRENCY', 64))
+# The request threads of the WSGI server and of the ASGI application, which are fewer than the
+# concurrent requests like in a deployment under load
+THREADS = int(os.environ.get('ADRESET_BENCHMARK_THREADS', 4))
+# The simulated round trip to Active Directory of each LDAP operation. The mock directory evaluates
+# the search filters in this process, which takes a few milliseconds of CPU per request, so the
+# latency has to be larger than that for waiting on Active Directory to be the bottleneck.
+LDAP_LATENCY = float(os.environ.get('ADRESET_BENCHMARK_LDAP_LATENCY_MS', 50)) / 1000
+_json_headers = {'Content-Type': 'application/json'}
+# Every request waits on Active Directory instead of being served from the caches
+_uncached_config = {
+    'ACCOUNT_STATUS_CACHE_TTL': 0,
+    'ACCOUNT_STATUS_NOT_FOUND_CACHE_TTL': 0,
+    'AD_IDENTITY_CACHE_TTL': 0,
+    'ASGI_EXECUTOR_THREADS': THREADS,
+}
+
+
+def _delay(method):
+    """Wrap a method of an LDAP connection so that it waits for the simulated latency first."""
+
+    def _delayed(*args, **kwargs):
+        time.sleep(LDAP_LATENCY)
+        return method(*args, **kwargs)
+
+    return _delayed
+
+
+@pytest.fixture(scope='function')
+def mock_server(app):
+    """Pytest fixture that creates a mock LDAP server with the test directory."""
+    mock_server = ldap3.Server(app.config['AD_LDAP_URI'], get_info=ldap3.OFFLINE_AD_2012_R2)
+    connection = ldap3.Connection(mock_server, client_strategy=ldap3.MOCK_SYNC)
+    ldap_entries_path = path.join(path.dirname(path.dirname(__file__)), 'ad', 'directory.json')
+    connection.strategy.entries_from_json(ldap_entries_path)
+    yield mock_server
+    connection.unbind()
+
+
+@pytest.fixture(scope='function')
+def slow_ad(mock_server):
+    """Pytest fixture that makes the AD class wait for the simulated latency on each operation."""
+    # The mock connections aren't thread-safe, so each thread gets its own
+    local = threading.local()
+
+    def _get_connection():
+        if not hasattr(local, 'connection'):
+            connection = ldap3.Connection(
+                mock_server, client_strategy=ldap3.MOCK_SYNC, authentication=ldap3.SIMPLE
+            )
+            for operation in ('bind', 'search', 'modify'):
+                setattr(connection, operation, _delay(getattr(connection, operation)))
+            local.connection = connection
+        return local.connection
+
+    with patch('adreset.ad.AD.connection', new_callable=PropertyMock) as mock_ad_connection:
+        mock_ad_connection.side_effect = _get_connection
+        yield adreset.ad.AD()
+
+
+@pytest.fixture(scope='function')
+def slow_async_ad(mock_server):
+    """Pytest fixture that makes the AsyncAD class wait for the simulated latency."""
+
+    def _create_connection(self):
+        connection = ldap3.Connection(mock_server, client_strategy=ldap3.MOCK_ASYNC)
+        connection.bind = _delay(connection.bind)
+        # The responses of the asynchronous operations arrive after the simulated latency
+        connection.get_response = _delay(connection.get_response)
+        return connection
+
+    with patch.object(AsyncAD, '_create_connection', _create_connection):
+        yield
+
+
+def _report(endpoint, server, concurrency, total):
+    """Add the throughput of the requests to the benchmark report."""
+    report_lines.append(
+        f'{endpoint} ({server}): {round(REQUESTS / total, 1)} requests/second with '
+        f'{concurrency} concurrent requests, {THREADS} request threads, and '
+        f'{LDAP_LATENCY * 1000}ms of LDAP latency'
+    )
+
+
+def _benchmark_wsgi(app, endpoint, method, url, data=None):
+    """
+    Send the requests to the WSGI application from the server's request threads.
+
+    :param flask.Flask app: the Flask application
+    :param str endpoint: the name of the endpoint being benchmarked
+    :param str method: the HTTP method of the requests
+    :param str url: the URL of the requests
+    :kwarg str data: the body of the requests
+    :return: the requests per second
+    :rtype: float
+    """
+
+    def _send(_):
+        rv = app.test_client().open(url, method=method, data=data, headers=_json_headers)
+        assert rv.status_code < 400, rv.data
+
+    _send(None)
+    # A WSGI server only serves as many requests at once as it has threads, and the rest wait
+    with ThreadPoolExecutor(max_workers=THREADS) as executor:
+        start = time.perf_counter()
+        list(executor.map(_send, range(REQUESTS)))
+        total = time.perf_counter() - start
+    _report(endpoint, 'WSGI', CONCURRENCY, total)
+    return REQUESTS / total
+
+
+def _benchmark_asgi(app, endpoint, method, url, data=None):
+    """
+    Send the requests concurrently to the ASGI application on a single event loop.
+
+    :param flask.Flask app: the Flask application
+    :param str endpoint: the name of the endpoint being benchmarked
+    :param str method: the HTTP method of the requests
+    :param str url: the URL of the requests
+    :kwarg str data: the body of the requests
+    :return: the requests per second
+    :rtype: float
+    """
+    asgi_app = ASGIApp(app)
+    body = data.encode('utf-8') if data else b''
+
+    async def _send(semaphore):
+        async with semaphore:
+            status, _, rv_body = await send_request(
+                asgi_app, method, url, body=body, headers=_json_headers
+            )
+        assert status < 400, rv_body
+
+    async def _send_all():
+        semaphore = asyncio.Semaphore(CONCURRENCY)
+        await _send(semaphore)
+        start = time.perf_counter()
+        await asyncio.gather(*(_send(semaphore) for _ in range(REQUESTS)))
+        return time.perf_counter() - start
+
+    loop = asyncio.new_event_loop()
+    try:
+        total = loop.run_until_complete(_send_all())
+    finally:
+        loop.close()
+        asgi_app.executor.shutdown(wait=True)
+    _report(endpoint, 'ASGI', CONCURRENCY, total)
+    return REQUESTS / total
+
+
+def _assert_speedup(wsgi_throughput, asgi_throughput):
+    """Assert that ASGI serves more requests than threads while waiting on Active Directory."""
+    speedup = asgi_throughput / wsgi_throughput
+    report_lines.append(f'ASGI speedup: {speedup:.1f}x')
+    if CONCURRENCY >= 2 * THREADS:
+        assert speedup >= 2
+
+
+def test_benchmark_asgi_account_status(app, slow_ad, slow_async_ad):
+    """Benchmark the concurrent uncached account status requests served over WSGI and ASGI."""
+    url = '/api/v1/account-status/lockeduser'
+    with patch.dict(app.config, _uncached_config):
+        wsgi_throughput = _benchmark_wsgi(app, 'account-status', 'GET', url)
+        asgi_throughput = _benchmark_asgi(app, 'account-status', 'GET', url)
+    _assert_speedup(wsgi_throughput, asgi_throughput)
+
+
+def test_benchmark_asgi_reset(app, slow_ad, slow_async_ad):
+    """Benchmark the concurrent password resets served over WSGI and ASGI."""
+    _configure_user()
+    with patch.dict(app.config, _uncached_config):
+        wsgi_throughput = _benchmark_wsgi(app, 'reset', 'POST', '/api/v1/reset', _reset_data)
+        asgi_throughput = _benchmark_asgi(app, 'reset', 'POST', '/api/v1/reset', _reset_data)
+    _assert_speedup(wsgi_throughput, asgi_throughput)
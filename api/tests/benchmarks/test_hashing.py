@@ -0,0 +1,51 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import os
+import time
+
+from passlib.context import CryptContext
+import pytest
+
+from adreset.config import Config
+from adreset.hashing import HashingPool
+
+
+pytestmark = pytest.mark.benchmark
+
+
+def _time_verify_answers(pool, input_answers, hashed_answers, iterations=3):
+    """Time HashingPool.verify_answers and return the fastest run in seconds."""
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        assert all(verified for verified, _ in pool.verify_answers(input_answers, hashed_answers))
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def test_pooled_verification_latency(app):
+    """Compare verifying the required answers sequentially and in worker processes."""
+    num_answers = app.config['REQUIRED_ANSWERS']
+    input_answers = [f'answer {i}' for i in range(num_answers)]
+    # Use the production hashing policy rather than the fast one of the tests
+    context = CryptContext(**Config.ANSWER_HASHING)
+    hashed_answers = [context.hash(answer) for answer in input_answers]
+
+    sequential = _time_verify_answers(HashingPool(context, 0), input_answers, hashed_answers)
+    pool = HashingPool(context, num_answers)
+    try:
+        # Start the worker processes before timing
+        pool.verify_answers(input_answers, hashed_answers)
+        pooled = _time_verify_answers(pool, input_answers, hashed_answers)
+    finally:
+        pool.shutdown()
+
+    print(
+        f'\nVerifying {num_answers} answers: {sequential * 1000:.0f}ms sequentially, '
+        f'{pooled * 1000:.0f}ms with {num_answers} worker processes on {os.cpu_count()} CPUs'
+    )
+    if (os.cpu_count() or 1) >= num_answers:
+        # The answers are verified in parallel, so the latency is close to a single verification
+        assert pooled < sequential / 2
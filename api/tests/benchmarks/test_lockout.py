@@ -0,0 +1,74 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+from datetime import datetime, timedelta
+import statistics
+import time
+
+import pytest
+
+from adreset.models import db, FailedAttempt, User
+
+
+pytestmark = pytest.mark.benchmark
+
+
+def _add_failed_attempts(num_users, attempts_per_user):
+    """Bulk insert old failed attempts for new users, bypassing the ORM for speed."""
+    first_user_id = (db.session.query(db.func.max(User.id)).scalar() or 0) + 1
+    db.session.execute(
+        User.__table__.insert(),
+        [
+            {'ad_guid': f'00000000-0000-0000-0000-{user_id:012d}'}
+            for user_id in range(first_user_id, first_user_id + num_users)
+        ],
+    )
+    a_day_ago = datetime.utcnow() - timedelta(days=1)
+    for user_id in range(first_user_id, first_user_id + num_users):
+        db.session.execute(
+            FailedAttempt.__table__.insert(),
+            [
+                {'user_id': user_id, 'time': a_day_ago - timedelta(seconds=i)}
+                for i in range(attempts_per_user)
+            ],
+        )
+    db.session.commit()
+    return first_user_id
+
+
+def _median_lockout_check(user_id, iterations=500):
+    """Time User.is_user_locked_out and return the median in seconds."""
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        User.is_user_locked_out(user_id)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def test_lockout_check_with_a_million_failed_attempts(app):
+    """Test that checking a lockout doesn't slow down as the failed attempts accumulate."""
+    user_id = _add_failed_attempts(10, 100)
+    small_table = _median_lockout_check(user_id)
+
+    # Bring the table to a million rows that belong to other users
+    _add_failed_attempts(9990, 100)
+    assert db.session.query(db.func.count(FailedAttempt.id)).scalar() == 1000000
+    large_table = _median_lockout_check(user_id)
+    # A user that was never locked out and a user with a full lockout window
+    _median_lockout_check(user_id + 5000)
+    for _ in range(app.config['ATTEMPTS_BEFORE_LOCKOUT']):
+        db.session.add(FailedAttempt(user_id=user_id, time=datetime.utcnow()))
+    db.session.commit()
+    assert User.is_user_locked_out(user_id) is True
+    locked_out = _median_lockout_check(user_id)
+
+    print(
+        f'\nis_user_locked_out median: {small_table * 1000:.3f}ms with 1,000 rows, '
+        f'{large_table * 1000:.3f}ms with 1,000,000 rows, {locked_out * 1000:.3f}ms when '
+        'locked out'
+    )
+    # The check reads the same handful of index entries regardless of the size of the table
+    assert large_table < small_table * 3
+    assert locked_out < small_table * 3
@@ -0,0 +1,83 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import logging
+import os
+import queue
+import statistics
+import tempfile
+import time
+
+import pytest
+from pythonjsonlogger import jsonlogger
+
+from adreset.logger import BatchQueueListener, BatchStreamHandler, BoundedQueueHandler
+from tests.benchmarks.conftest import report_lines
+
+
+pytestmark = pytest.mark.benchmark
+
+REQUESTS = int(os.environ.get('ADRESET_BENCHMARK_LOGGED_REQUESTS', 20000))
+# The messages logged by a successful password reset
+_messages = (
+    ('info', 'The service account logged in successfully'),
+    ('info', 'Getting the account status for %s'),
+    ('debug', 'The user successfully answered their questions'),
+    ('info', 'The password for "%s" was reset'),
+    ('info', 'The user successfully reset their password'),
+    ('info', 'The request was processed'),
+)
+
+
+def _time_requests(handler):
+    """
+    Log the messages of many requests to the handler.
+
+    :param logging.Handler handler: the handler to log to
+    :return: the median number of seconds the messages of a request took to log
+    :rtype: float
+    """
+    logger = logging.getLogger('adreset.benchmarks.logging')
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    timings = []
+    for i in range(REQUESTS):
+        start = time.perf_counter()
+        for level, message in _messages:
+            getattr(logger, level)({'message': message, 'user': f'benchuser{i}'}, 'benchuser')
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def test_benchmark_logging_overhead():
+    """Compare the time a request spends logging with a stream handler and a queue handler."""
+    formatter = jsonlogger.JsonFormatter('%(asctime)s %(name)s %(levelname)s %(user)s %(message)s')
+    with tempfile.TemporaryFile('w') as log_file:
+        stream_handler = BatchStreamHandler(log_file)
+        stream_handler.setFormatter(formatter)
+        synchronous = _time_requests(stream_handler)
+
+        queued = {}
+        dropped = {}
+        for policy in ('drop', 'block'):
+            log_queue = queue.Queue(maxsize=10000)
+            listener = BatchQueueListener(log_queue, stream_handler)
+            listener.start()
+            queued_handler = BoundedQueueHandler(log_queue, block=policy == 'block')
+            try:
+                queued[policy] = _time_requests(queued_handler)
+            finally:
+                listener.stop()
+            dropped[policy] = queued_handler.dropped
+
+    report_lines.append(
+        f'logging per request: {synchronous * 1e6:.1f}µs with a stream handler, '
+        f'{queued["drop"] * 1e6:.1f}µs with a queue handler that drops messages when full '
+        f'({dropped["drop"]} of {REQUESTS * len(_messages)} dropped), '
+        f'{queued["block"] * 1e6:.1f}µs with a queue handler that blocks when full'
+    )
+    assert dropped['block'] == 0
+    # Formatting the JSON and writing it is moved off the request's thread
+    assert queued['drop'] < synchronous
@@ -0,0 +1,66 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import time
+
+from mock import patch
+import pytest
+
+from tests.benchmarks.conftest import NUM_GROUPS, NUM_USERS, report_lines
+
+
+pytestmark = pytest.mark.benchmark
+
+
+def _time_lookup(lookup, iterations=3):
+    """Run the lookup several times and return the fastest run in seconds."""
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        lookup()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def test_benchmark_search_filters(app, scaled_ad):
+    """Compare the lookups with objectClass filters on the whole domain and the indexed filters."""
+    scaled_ad.login('CN=testuser,OU=ADReset,DC=adreset,DC=local', 'P@ssW0rd')
+    user = f'benchuser{NUM_USERS - 1}'
+    group = f'Bench Group {NUM_GROUPS - 1}'
+    attributes = ['distinguishedName', 'objectSid']
+    # The filters that were used before, which all search the domain's subtree
+    lookups = {
+        'user': (
+            lambda: scaled_ad.search(f'(&(objectClass=user)(sAMAccountName={user}))', attributes),
+            lambda: scaled_ad.get_attributes(user, attributes),
+        ),
+        'group': (
+            lambda: scaled_ad.search(f'(sAMAccountName={group})', attributes),
+            lambda: scaled_ad.get_attributes(group, attributes, object_type='group'),
+        ),
+        'domain': (
+            lambda: scaled_ad.search('(&(objectClass=domainDNS))', ['minPwdLength']),
+            lambda: scaled_ad.get_domain_attributes(['minPwdLength']),
+        ),
+    }
+
+    config = {
+        'AD_USERS_SEARCH_BASE': 'OU=ADReset,DC=adreset,DC=local',
+        'AD_GROUPS_SEARCH_BASE': 'OU=Groups,DC=adreset,DC=local',
+        # Always search instead of serving the domain policy from the cache
+        'AD_DOMAIN_CACHE_TTL': 0,
+    }
+    totals = [0, 0]
+    for name, (subtree_lookup, indexed_lookup) in lookups.items():
+        subtree = _time_lookup(subtree_lookup)
+        with patch.dict(app.config, config):
+            indexed = _time_lookup(indexed_lookup)
+        totals[0] += subtree
+        totals[1] += indexed
+        report_lines.append(
+            f'{name} lookup: {subtree * 1000:.1f}ms from the domain root, '
+            f'{indexed * 1000:.1f}ms with the indexed filter and search base '
+            f'({NUM_USERS} users and {NUM_GROUPS} groups)'
+        )
+    assert totals[1] < totals[0]
@@ -11,9 +11,40 @@ from flask_jwt_extended import create_access_token
 
 from adreset.app import create_app
 from adreset.models import db, User, Question
+from adreset.cache import caches
+from adreset.pool import ConnectionPool
 import adreset.ad
 
 
+def pytest_addoption(parser):
+    """Add the command-line option to run the benchmarks."""
+    parser.addoption(
+        '--run-benchmarks', action='store_true', default=False, help='run the slow benchmarks'
+    )
+    parser.addoption(
+        '--update-benchmark-baselines',
+        action='store_true',
+        default=False,
+        help='store the results of the API benchmarks as the new baselines',
+    )
+
+
+def pytest_configure(config):
+    """Register the custom markers."""
+    config.addinivalue_line('markers', 'benchmark: a slow benchmark only run with --run-benchmarks')
+
+
+def pytest_collection_modifyitems(config, items):
+    """Skip the benchmarks unless they were requested."""
+    if config.getoption('--run-benchmarks'):
+        return
+
+    skip_benchmark = pytest.mark.skip(reason='the benchmarks only run with --run-benchmarks')
+    for item in items:
+        if 'benchmark' in item.keywords:
+            item.add_marker(skip_benchmark)
+
+
 @pytest.fixture(scope='session')
 def app():
     """Pytest fixture that creates a Flask app object with an established context."""
@@ -30,6 +61,8 @@ def setup_db(app):
     db.session.remove()
     db.drop_all()
     db.create_all()
+    app.extensions['adreset_revocation'].reset()
+    app.extensions['adreset_lockout'].reset()
     question = Question(question='What is your favorite flavor of ice cream?')
     question2 = Question(question='What is your favorite color?')
     question3 = Question(question='What is your favorite toy?')
@@ -39,6 +72,13 @@ def setup_db(app):
     db.session.commit()
 
 
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """Clear the in-process caches before each test."""
+    for cache in caches.values():
+        cache.clear()
+
+
 @pytest.fixture(scope='session')
 def client(app):
     """Pytest fixture that creates a Flask test client object for the pytest session."""
@@ -66,8 +106,37 @@ def mock_ad(app):
     mock_connection.unbind()
 
 
-# ldap3 testing doesn't support the AD specific searches such as nested group memberships,
-# so we must mock those ahead of time.
+@pytest.fixture(scope='function')
+def mock_ad_pool(app):
+    """Pytest fixture that checks out the service account connections from a pool of mock ones."""
+    mock_server = ldap3.Server(app.config['AD_LDAP_URI'], get_info=ldap3.OFFLINE_AD_2012_R2)
+    directory = ldap3.Connection(mock_server, client_strategy=ldap3.MOCK_SYNC)
+    ldap_entries_path = path.join(path.abspath(path.dirname(__file__)), 'ad', 'directory.json')
+    directory.strategy.entries_from_json(ldap_entries_path)
+
+    def _create_connection():
+        # The connections share the mock directory of the server
+        connection = ldap3.Connection(
+            mock_server,
+            user=app.config['AD_SERVICE_USERNAME'],
+            password='P@ssW0rd',
+            client_strategy=ldap3.MOCK_SYNC,
+        )
+        connection.bind()
+        return connection
+
+    # Fail right away instead of waiting for a connection if one wasn't returned to the pool
+    pool = ConnectionPool(_create_connection, size=2, timeout=0)
+    with patch.dict(app.extensions, {'adreset_ad_pool': pool}):
+        yield pool
+    pool.clear()
+    if pool._executor:
+        pool._executor.shutdown()
+    directory.unbind()
+
+
+# The group memberships are mocked ahead of time so that the role of the logged in user doesn't
+# depend on the tokenGroups stored in the mock LDAP directory.
 @pytest.fixture(scope='function')
 def mock_admin_ad(mock_ad):
     """Pytest fixture that mocks an LDAP directory for user logins."""
@@ -0,0 +1,64 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import importlib
+import sys
+
+import mock
+
+from adreset.app import create_app, preload_groups, start_worker
+from adreset.error import ADError
+import adreset.ad
+
+
+def test_refresh_groups_command(app, mock_ad):
+    """Test that the refresh-groups command resolves the configured groups."""
+    rv = app.test_cli_runner().invoke(args=['refresh-groups'])
+    assert rv.exit_code == 0
+    assert rv.output == (
+        'ADReset Admins: CN=ADReset Admins,OU=Groups,DC=adreset,DC=local '
+        '(S-1-5-21-1270288957-3800934213-3019856503-1606)\n'
+        'ADReset Users: CN=ADReset Users,OU=Groups,DC=adreset,DC=local '
+        '(S-1-5-21-1270288957-3800934213-3019856503-1607)\n'
+    )
+    assert adreset.ad.group_cache.get('ADReset Admins')
+
+
+def test_preload_groups(app, mock_ad):
+    """Test that the configured groups are resolved at startup."""
+    preload_groups(app)
+    assert adreset.ad.group_cache.get('ADReset Admins')
+    assert adreset.ad.group_cache.get('ADReset Users')
+
+
+def test_preload_groups_ad_unavailable(app):
+    """Test that the application still starts when the groups can't be resolved."""
+    with mock.patch('adreset.ad.AD.service_account_login', side_effect=ADError('Failed')):
+        with mock.patch('adreset.app.log') as mock_log:
+            preload_groups(app)
+    mock_log.warning.assert_called_once()
+    assert adreset.ad.group_cache.get('ADReset Users') is None
+
+
+def test_start_worker(app):
+    """Test that the background work of a worker process is started."""
+    with mock.patch('adreset.app.schedule_pruning') as mock_schedule_pruning:
+        with mock.patch('adreset.app.preload_groups') as mock_preload_groups:
+            start_worker(app)
+    mock_schedule_pruning.assert_called_once_with(app)
+    mock_preload_groups.assert_called_once_with(app)
+
+
+def test_wsgi_starts_worker_on_first_request():
+    """Test that the WSGI application starts the worker when it serves a request, not on import."""
+    wsgi_app = create_app('adreset.config.TestConfig')
+    with mock.patch('adreset.app.create_app', return_value=wsgi_app):
+        with mock.patch('adreset.app.start_worker') as mock_start_worker:
+            with mock.patch.dict(sys.modules):
+                sys.modules.pop('adreset.wsgi', None)
+                importlib.import_module('adreset.wsgi')
+            mock_start_worker.assert_not_called()
+            wsgi_app.test_client().get('/api/v1/about')
+            wsgi_app.test_client().get('/api/v1/about')
+    mock_start_worker.assert_called_once_with(wsgi_app)
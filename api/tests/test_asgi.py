@@ -0,0 +1,229 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import asyncio
+import json
+
+import ldap3
+import mock
+import pytest
+
+from adreset.asgi_app import ASGIApp
+from adreset.async_ad import AsyncAD
+from adreset.models import FailedAttempt
+from tests.api.test_v1 import _configure_user, _reset_data
+
+
+async def send_request(asgi_app, method, path, body=b'', headers=None, chunk_size=None):
+    """
+    Send a request to the ASGI application.
+
+    :param ASGIApp asgi_app: the ASGI application
+    :param str method: the HTTP method of the request
+    :param str path: the path of the request
+    :kwarg bytes body: the body of the request
+    :kwarg dict headers: the headers of the request
+    :kwarg int chunk_size: the number of bytes of the body in each ASGI event or None to send the
+        body in a single event
+    :return: a tuple of the status code, the headers, and the body of the response
+    :rtype: tuple
+    """
+    scope = {
+        'type': 'http',
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': path,
+        'query_string': b'',
+        'root_path': '',
+        'headers': [
+            (name.lower().encode('latin-1'), value.encode('latin-1'))
+            for name, value in (headers or {}).items()
+        ],
+        'client': ('127.0.0.1', 50000),
+        'server': ('localhost', 80),
+    }
+    chunk_size = chunk_size or len(body) or 1
+    messages = []
+    for start in range(0, max(len(body), 1), chunk_size):
+        end = start + chunk_size
+        messages.append({'type': 'http.request', 'body': body[start:end], 'more_body': True})
+    messages[-1]['more_body'] = False
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    await asgi_app(scope, receive, send)
+    assert sent[0]['type'] == 'http.response.start'
+    response_headers = {
+        name.decode('latin-1'): value.decode('latin-1') for name, value in sent[0]['headers']
+    }
+    return sent[0]['status'], response_headers, sent[1]['body']
+
+
+def _request(asgi_app, *args, **kwargs):
+    """Send a request to the ASGI application in a new event loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(send_request(asgi_app, *args, **kwargs))
+    finally:
+        loop.close()
+
+
+@pytest.fixture(scope='function')
+def asgi_app(app, mock_ad):
+    """Pytest fixture that creates an ASGI application that uses the mock LDAP directory."""
+
+    def _create_connection():
+        # Share the mock directory with the WSGI routes served by the mock_ad fixture
+        return ldap3.Connection(mock_ad.connection.server, client_strategy=ldap3.MOCK_ASYNC)
+
+    with mock.patch.object(AsyncAD, '_create_connection', side_effect=_create_connection):
+        asgi_app = ASGIApp(app, max_workers=4)
+        yield asgi_app
+        asgi_app.executor.shutdown(wait=True)
+
+
+def test_account_status(client, asgi_app):
+    """Test that the account status route returns the same result as the Flask application."""
+    status, headers, body = _request(asgi_app, 'GET', '/api/v1/account-status/lockeduser')
+    assert status == 200
+    assert headers['content-type'] == 'application/json'
+    rv = client.get('/api/v1/account-status/lockeduser')
+    assert json.loads(body.decode('utf-8')) == json.loads(rv.data.decode('utf-8'))
+
+
+def test_account_status_error(client, asgi_app):
+    """Test that the Flask application's error handlers format the errors of the native views."""
+    status, _, body = _request(asgi_app, 'GET', '/api/v1/account-status/nobody')
+    rv = client.get('/api/v1/account-status/nobody')
+    assert status == rv.status_code == 404
+    assert json.loads(body.decode('utf-8')) == json.loads(rv.data.decode('utf-8'))
+
+
+def test_reset(asgi_app, mock_ad):
+    """Test that the reset route sets the new password in Active Directory."""
+    _configure_user()
+    status, _, body = _request(
+        asgi_app,
+        'POST',
+        '/api/v1/reset',
+        body=_reset_data.encode('utf-8'),
+        headers={'Content-Type': 'application/json'},
+    )
+    assert status == 204
+    assert body == b''
+    entry = mock_ad.connection.server.dit['CN=testuser2,OU=ADReset,DC=adreset,DC=local']
+    assert entry['unicodePwd'] == ['"RedSoxWorldSeriesCh@mps"'.encode('utf-16-le')]
+
+
+def test_reset_renamed_user(asgi_app, mock_ad):
+    """Test that a cached identity of a renamed user isn't used to reset another user."""
+    _configure_user()
+    # testuser2 was named testuser3 when they were cached, and another user now has that name
+    mock_ad._cache_identity(
+        {
+            'guid': '10385a23-6def-4990-84a8-32444e36e496',
+            'sam_account_name': 'testuser3',
+            'dn': 'CN=testuser2,OU=ADReset,DC=adreset,DC=local',
+        }
+    )
+    reset_data = dict(json.loads(_reset_data), username='testuser3')
+    status, _, _ = _request(
+        asgi_app,
+        'POST',
+        '/api/v1/reset',
+        body=json.dumps(reset_data).encode('utf-8'),
+        headers={'Content-Type': 'application/json'},
+    )
+    assert status == 400
+    for dn in (
+        'CN=testuser2,OU=ADReset,DC=adreset,DC=local',
+        'CN=testuser3,OU=ADReset,DC=adreset,DC=local',
+    ):
+        assert 'unicodePwd' not in mock_ad.connection.server.dit[dn]
+
+
+def test_reset_incorrect_answer(asgi_app):
+    """Test that an incorrect answer is rejected and counted as a failed attempt."""
+    _configure_user()
+    data = json.loads(_reset_data)
+    data['answers'][0]['answer'] = 'chocolate'
+    status, _, body = _request(
+        asgi_app,
+        'POST',
+        '/api/v1/reset',
+        body=json.dumps(data).encode('utf-8'),
+        headers={'Content-Type': 'application/json'},
+    )
+    assert status == 401
+    assert json.loads(body.decode('utf-8'))['message'] == (
+        'One or more answers were incorrect. Please try again.'
+    )
+    assert FailedAttempt.query.filter_by(user_id=1).count() == 1
+
+
+def test_reset_invalid_json(asgi_app):
+    """Test that a body that isn't JSON is rejected."""
+    status, _, _ = _request(asgi_app, 'POST', '/api/v1/reset', body=b'{')
+    assert status == 400
+
+
+@pytest.mark.parametrize(
+    'headers, chunk_size', (({'Content-Length': '2048'}, None), ({}, 100)),
+)
+def test_request_too_large(app, asgi_app, headers, chunk_size):
+    """Test that a body longer than MAX_CONTENT_LENGTH is rejected whether or not it's announced."""
+    body = b'{"answers": "' + b'a' * 2030 + b'"}'
+    with mock.patch.dict(app.config, {'MAX_CONTENT_LENGTH': 1024}):
+        status, headers, body = _request(
+            asgi_app, 'POST', '/api/v1/reset', body=body, headers=headers, chunk_size=chunk_size
+        )
+    assert status == 413
+    assert headers['content-type'] == 'application/json'
+    assert json.loads(body.decode('utf-8'))['status'] == 413
+
+
+@pytest.mark.parametrize(
+    'path', ['/api/v1/about', '/api/v1/account-status/lockeduser', '/api/v1/not-a-route']
+)
+def test_cors_headers(client, asgi_app, path):
+    """Test that the routes served natively and by Flask have the same headers."""
+    headers = {'Origin': 'http://localhost'}
+    status, asgi_headers, _ = _request(asgi_app, 'GET', path, headers=headers)
+    rv = client.get(path, headers=headers)
+    assert status == rv.status_code
+    assert asgi_headers['access-control-allow-origin'] == 'http://localhost'
+    assert asgi_headers['access-control-allow-methods'] == (
+        rv.headers['Access-Control-Allow-Methods']
+    )
+
+
+def test_lifespan(app):
+    """Test that the ASGI lifespan events start the worker and shut down the thread pool."""
+    on_startup = mock.Mock()
+    asgi_app = ASGIApp(app, max_workers=1, on_startup=on_startup)
+    messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(asgi_app({'type': 'lifespan'}, receive, send))
+    finally:
+        loop.close()
+
+    assert sent == [{'type': 'lifespan.startup.complete'}, {'type': 'lifespan.shutdown.complete'}]
+    on_startup.assert_called_once_with(app)
+    with pytest.raises(RuntimeError):
+        asgi_app.executor.submit(print)
@@ -0,0 +1,75 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import os
+
+import mock
+
+from adreset.cache import TTLCache
+
+
+def test_cache_get_and_set():
+    """Test that cached entries are returned and the hits and misses are counted."""
+    cache = TTLCache('test', maxsize=2, ttl=60)
+    assert cache.get('key') is None
+    cache.set('key', 'value')
+    assert cache.get('key') == 'value'
+    assert cache.stats() == {
+        'evictions': 0,
+        'hit_ratio': 0.5,
+        'hits': 1,
+        'maxsize': 2,
+        'misses': 1,
+        'size': 1,
+    }
+
+
+def test_cache_expiration():
+    """Test that entries expire after their time to live."""
+    cache = TTLCache('test', ttl=60)
+    cache.set('key', 'value')
+    cache.set('key2', 'value2', ttl=120)
+    with mock.patch('adreset.cache.time.monotonic') as mock_monotonic:
+        mock_monotonic.return_value = 10 ** 9
+        assert cache.get('key') is None
+        assert cache.get('key2') is None
+    assert len(cache) == 0
+
+
+def test_cache_lru_eviction():
+    """Test that the least recently used entry is evicted when the cache is full."""
+    cache = TTLCache('test', maxsize=2)
+    cache.set('one', 1)
+    cache.set('two', 2)
+    # Use "one" so that "two" is the least recently used entry
+    assert cache.get('one') == 1
+    cache.set('three', 3)
+    assert cache.get('two') is None
+    assert cache.get('one') == 1
+    assert cache.get('three') == 3
+    assert cache.stats()['evictions'] == 1
+
+
+def test_cache_caches_none():
+    """Test that falsy values can be cached and distinguished from a miss."""
+    cache = TTLCache('test')
+    missing = object()
+    cache.set('key', None)
+    assert cache.get('key', missing) is None
+    assert cache.pop('key', missing) is None
+    assert cache.get('key', missing) is missing
+
+
+def test_cache_invalidation_file(tmpdir):
+    """Test that invalidating a cache in another process clears this process' cache."""
+    cache = TTLCache('test')
+    other_process_cache = TTLCache('test')
+    for c in (cache, other_process_cache):
+        c.invalidation_file = os.path.join(str(tmpdir), 'test.invalidated')
+    cache.set('key', 'value')
+    other_process_cache.invalidate()
+    assert os.path.isfile(cache.invalidation_file)
+    # Make the invalidation file appear newer than when the cache was last cleared
+    cache._cleared_at -= 10
+    assert cache.get('key') is None
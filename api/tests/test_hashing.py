@@ -0,0 +1,107 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import os
+import signal
+
+from passlib.context import CryptContext
+import pytest
+
+from adreset.hashing import HashingPool
+
+
+# Use few rounds so that the tests are fast
+_context = CryptContext(schemes=['sha512_crypt'], deprecated='auto', sha512_crypt__rounds=1000)
+_hashes = [_context.hash(answer) for answer in ('a', 'b', 'c')]
+
+
+@pytest.mark.parametrize('size', (0, 2))
+def test_verify_answers(size):
+    """Test that every answer is verified in order whether or not worker processes are used."""
+    pool = HashingPool(_context, size)
+    try:
+        assert pool.verify_answers(['a', 'b', 'c'], _hashes) == [(True, None)] * 3
+        assert pool.verify_answers(['wrong', 'b', 'wrong'], _hashes) == [
+            (False, None),
+            (True, None),
+            (False, None),
+        ]
+    finally:
+        pool.shutdown()
+
+
+def test_hashing_pool_starts_lazily():
+    """Test that the worker processes are only started on first use and can be restarted."""
+    pool = HashingPool(_context, 1)
+    assert pool._executor is None
+    assert pool.verify_answers(['a'], _hashes[:1]) == [(True, None)]
+    assert pool._executor is not None
+    pool.shutdown()
+    assert pool._executor is None
+    assert pool.verify_answers(['b'], _hashes[1:2]) == [(True, None)]
+    pool.shutdown()
+
+
+def test_hashing_pool_does_not_fork_the_application():
+    """Test that the worker processes aren't forked and don't import the Flask application."""
+    pool = HashingPool(_context, 1)
+    try:
+        assert pool.verify_answers(['a'], _hashes[:1]) == [(True, None)]
+        assert pool.executor._mp_context.get_start_method() in ('forkserver', 'spawn')
+        # Check the modules loaded by the worker process after it verified an answer
+        loaded = pool.executor.submit(
+            eval, "[m in __import__('sys').modules for m in ('flask', 'pkg_resources')]"
+        )
+        assert loaded.result() == [False, False]
+    finally:
+        pool.shutdown()
+
+
+def test_hashing_pool_recovers_from_a_dead_worker():
+    """Test that the pool is replaced and the work is retried when a worker process dies."""
+    pool = HashingPool(_context, 1)
+    try:
+        assert pool.verify_answers(['a'], _hashes[:1]) == [(True, None)]
+        broken_executor = pool._executor
+        for process in list(broken_executor._processes.values()):
+            os.kill(process.pid, signal.SIGKILL)
+            process.join()
+        assert pool.verify_answers(['a', 'b'], _hashes[:2]) == [(True, None)] * 2
+        assert pool._executor is not broken_executor
+    finally:
+        pool.shutdown()
+
+
+@pytest.mark.parametrize('size', (0, 1))
+def test_verify_answers_rehashes_outdated_hashes(size):
+    """Test that correct answers hashed with an outdated policy are rehashed."""
+    new_context = CryptContext(
+        schemes=['sha512_crypt'], deprecated='auto', sha512_crypt__rounds=2000
+    )
+    pool = HashingPool(new_context, size)
+    try:
+        (verified, new_hash), (wrong, no_hash) = pool.verify_answers(['a', 'wrong'], _hashes[:2])
+    finally:
+        pool.shutdown()
+    assert verified is True
+    assert new_hash.startswith('$6$rounds=2000$')
+    assert new_context.verify('a', new_hash) is True
+    assert wrong is False
+    assert no_hash is None
+
+
+@pytest.mark.parametrize('size', (0, 2))
+def test_hash_answers(size):
+    """Test that the answers are hashed in order with the policy of the pool."""
+    pool = HashingPool(_context, size)
+    try:
+        hashed_answers = pool.hash_answers(['a', 'b'])
+    finally:
+        pool.shutdown()
+    assert [hashed_answer.startswith('$6$rounds=1000$') for hashed_answer in hashed_answers] == [
+        True,
+        True,
+    ]
+    assert _context.verify('a', hashed_answers[0]) is True
+    assert _context.verify('b', hashed_answers[1]) is True
@@ -0,0 +1,112 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import json
+import logging
+
+from flask import g
+import mock
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from adreset.instrumentation import get_filter_shape, RequestMetrics, timed
+from adreset.models import db
+from tests.api.test_v1 import _configure_user
+
+
+def _get_request_logs(caplog):
+    """Get the metrics logged after each request."""
+    return [
+        record.msg
+        for record in caplog.records
+        if isinstance(record.msg, dict) and record.msg.get('message') == 'The request was processed'
+    ]
+
+
+@pytest.mark.parametrize(
+    'search_filter, expected',
+    [
+        ('(sAMAccountName=testuser)', '(sAMAccountName=?)'),
+        (
+            '(&(objectClass=user)(|(memberOf=CN=Admins,DC=adreset,DC=local)(pwdLastSet>=0)))',
+            '(&(objectClass=?)(|(memberOf=?)(pwdLastSet>=?)))',
+        ),
+    ],
+)
+def test_get_filter_shape(search_filter, expected):
+    """Test that the values are removed from LDAP filters."""
+    assert get_filter_shape(search_filter) == expected
+
+
+def test_timed_outside_request(app):
+    """Test that operations outside of a request are not recorded and errors are raised."""
+    with pytest.raises(ValueError):
+        with timed('ldap', 'search'):
+            raise ValueError('some error')
+
+
+def test_failed_sql_statement_not_leaked(app):
+    """Test that a failed SQL statement leaves nothing on the connection and isn't timed."""
+    with app.test_request_context():
+        metrics = RequestMetrics()
+        g.adreset_metrics = metrics
+        with db.engine.connect() as connection:
+            with pytest.raises(OperationalError):
+                connection.execute('SELECT * FROM not_a_table')
+            connection.execute('SELECT 1')
+            assert 'adreset_query_start' not in connection.info
+    assert metrics.summary()['sql']['count'] == 1
+
+
+def test_request_metrics_logged(client, mock_ad, caplog):
+    """Test that the LDAP and SQL operations of a request are logged with the request."""
+    caplog.set_level(logging.INFO, logger='adreset')
+    rv = client.get('/api/v1/account-status/lockeduser')
+    assert rv.status_code == 200
+    assert 'Server-Timing' not in rv.headers
+
+    logs = _get_request_logs(caplog)
+    assert len(logs) == 1
+    metrics = logs[0]
+    assert metrics['method'] == 'GET'
+    assert metrics['path'] == '/api/v1/account-status/lockeduser'
+    assert metrics['status'] == 200
+    assert metrics['duration_ms'] > 0
+    operations = metrics['ldap']['operations']
+    assert metrics['ldap']['count'] == len(operations)
+    searches = [operation for operation in operations if operation['operation'] == 'search']
+    assert searches
+    for search in searches:
+        # The values in the filter such as the username must not be logged
+        assert 'lockeduser' not in search['filter']
+        assert 'entries' in search
+
+
+def test_request_metrics_reset(client, mock_ad, caplog):
+    """Test that the hashing of the secret answers is recorded with the request."""
+    _configure_user()
+    caplog.set_level(logging.INFO, logger='adreset')
+    data = {
+        'answers': [
+            {'question_id': 1, 'answer': 'strawberry'},
+            {'question_id': 2, 'answer': 'green'},
+            {'question_id': 3, 'answer': 'buzz lightyear'},
+        ],
+        'new_password': 'RedSoxWorldSeriesCh@mps',
+        'username': 'testuser2',
+    }
+    with mock.patch.dict(client.application.config, {'SERVER_TIMING_ENABLED': True}):
+        rv = client.post(
+            '/api/v1/reset', headers={'Content-Type': 'application/json'}, data=json.dumps(data)
+        )
+    assert rv.status_code == 204, rv.data
+
+    metrics = _get_request_logs(caplog)[-1]
+    assert metrics['hash']['count'] == 1
+    assert metrics['sql']['count'] > 0
+    operations = [operation['operation'] for operation in metrics['ldap']['operations']]
+    assert 'modify_password' in operations
+    assert 'unlock_account' in operations
+    server_timing = rv.headers['Server-Timing'].split(', ')
+    assert [metric.split(';')[0] for metric in server_timing] == ['hash', 'ldap', 'sql', 'total']
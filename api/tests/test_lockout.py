@@ -0,0 +1,122 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+from datetime import datetime, timedelta
+
+import mock
+
+from adreset.lockout import LockoutTracker
+from adreset.models import db, FailedAttempt, User
+
+
+def _add_user():
+    """Add a user to the database and return their ID."""
+    user = User(ad_guid='10385a23-6def-4990-84a8-32444e36e496')
+    db.session.add(user)
+    db.session.commit()
+    return user.id
+
+
+def _add_failed_attempt(user_id, minutes_ago=0, row_id=None):
+    """Add a failed attempt to the database as if another process wrote it."""
+    attempt_time = datetime.utcnow() - timedelta(minutes=minutes_ago)
+    db.session.add(FailedAttempt(id=row_id, user_id=user_id, time=attempt_time))
+    db.session.commit()
+
+
+def test_lockout_tracker_rebuilds_from_database(app):
+    """Test that the tracker only loads the failed attempts within the lockout window."""
+    user_id = _add_user()
+    _add_failed_attempt(user_id, minutes_ago=20)
+    _add_failed_attempt(user_id, minutes_ago=5)
+    _add_failed_attempt(user_id, minutes_ago=1)
+    tracker = LockoutTracker(app, lockout_minutes=15, attempts_before_lockout=3)
+    assert tracker.is_locked_out(user_id) is False
+    assert list(tracker._attempts[user_id]) == [
+        attempt.time for attempt in FailedAttempt.query.order_by(FailedAttempt.time)[1:]
+    ]
+    _add_failed_attempt(user_id, minutes_ago=10)
+    tracker.reset()
+    assert tracker.is_locked_out(user_id) is True
+
+
+def test_lockout_tracker_window_is_bounded(app):
+    """Test that only the most recent attempts are kept and that the lockout expires."""
+    user_id = _add_user()
+    tracker = LockoutTracker(app, lockout_minutes=15, attempts_before_lockout=3, flush_interval=0)
+    for _ in range(5):
+        tracker.add_failed_attempt(user_id)
+    assert len(tracker._attempts[user_id]) == 3
+    assert tracker.is_locked_out(user_id) is True
+    assert FailedAttempt.query.count() == 5
+    an_hour_from_now = datetime.utcnow() + timedelta(hours=1)
+    with mock.patch('adreset.lockout.datetime') as mock_datetime:
+        mock_datetime.utcnow.return_value = an_hour_from_now
+        assert tracker.is_locked_out(user_id) is False
+
+
+def test_lockout_tracker_loads_other_processes(app):
+    """Test that attempts from other processes are loaded and that its own aren't duplicated."""
+    user_id = _add_user()
+    tracker = LockoutTracker(app, attempts_before_lockout=3, refresh_interval=0, flush_interval=0)
+    tracker.add_failed_attempt(user_id)
+    _add_failed_attempt(user_id)
+    assert tracker.is_locked_out(user_id) is False
+    assert len(tracker._attempts[user_id]) == 2
+    assert len(tracker._seen_ids) == 2
+    _add_failed_attempt(user_id)
+    assert tracker.is_locked_out(user_id) is True
+
+
+def test_lockout_tracker_loads_out_of_order_commits(app):
+    """Test that a row with a lower ID that is committed after a higher one is still loaded."""
+    user_id = _add_user()
+    tracker = LockoutTracker(app, attempts_before_lockout=3, refresh_interval=0, refresh_overlap=5)
+    _add_failed_attempt(user_id, row_id=1)
+    _add_failed_attempt(user_id, row_id=3)
+    assert tracker.is_locked_out(user_id) is False
+    assert tracker._watermark == 3
+    # The transaction that was allocated ID 2 commits after the one with ID 3
+    _add_failed_attempt(user_id, row_id=2)
+    assert tracker.is_locked_out(user_id) is True
+    assert len(tracker._attempts[user_id]) == 3
+    # Re-scanning the overlapping range doesn't count the same rows twice
+    assert tracker.is_locked_out(user_id) is True
+    assert tracker._seen_ids == {1, 2, 3}
+    # The IDs below the re-scanned range are forgotten
+    _add_failed_attempt(user_id, row_id=10)
+    tracker.refresh()
+    assert tracker._seen_ids == {10}
+
+
+def test_lockout_tracker_persists_in_batches(app):
+    """Test that the failed attempts are queued and written to the database in one batch."""
+    user_id = _add_user()
+    tracker = LockoutTracker(app, attempts_before_lockout=5, flush_interval=60)
+    with mock.patch.object(tracker, '_start_flush_thread') as mock_start_flush_thread:
+        for _ in range(3):
+            tracker.add_failed_attempt(user_id)
+    assert mock_start_flush_thread.call_count == 3
+    assert len(tracker._attempts[user_id]) == 3
+    assert FailedAttempt.query.count() == 0
+    assert len(tracker._pending) == 3
+    tracker.flush()
+    assert FailedAttempt.query.count() == 3
+    assert tracker._pending == []
+    # The flushed attempts are not counted again when they are loaded from the database
+    tracker._next_refresh = 0
+    tracker.refresh()
+    assert len(tracker._attempts[user_id]) == 3
+    assert len(tracker._seen_ids) == 3
+
+
+def test_lockout_tracker_batch_size_wakes_flush_thread(app):
+    """Test that reaching the batch size triggers an early write."""
+    user_id = _add_user()
+    tracker = LockoutTracker(app, flush_interval=60, flush_batch_size=2)
+    with mock.patch.object(tracker, '_start_flush_thread'):
+        tracker.add_failed_attempt(user_id)
+        assert tracker._flush_event.is_set() is False
+        tracker.add_failed_attempt(user_id)
+        assert tracker._flush_event.is_set() is True
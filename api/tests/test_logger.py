@@ -0,0 +1,115 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+import io
+import json
+import logging
+import os
+import queue
+import tempfile
+
+import mock
+from pythonjsonlogger import jsonlogger
+
+from adreset.logger import BatchQueueListener, BatchStreamHandler, BoundedQueueHandler
+import adreset.logger
+from adreset.metrics import LOG_MESSAGES_DROPPED
+
+
+def _get_logger(handler):
+    """Get a logger that only logs to the handler."""
+    logger = logging.getLogger('adreset.tests.logger')
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    return logger
+
+
+def test_queue_listener_writes_batches():
+    """Test that the queued records are formatted as JSON and written in batches."""
+    stream = io.StringIO()
+    stream_handler = BatchStreamHandler(stream)
+    stream_handler.setLevel(logging.INFO)
+    stream_handler.setFormatter(jsonlogger.JsonFormatter('%(levelname)s %(user)s %(message)s'))
+    log_queue = queue.Queue(maxsize=100)
+    logger = _get_logger(BoundedQueueHandler(log_queue))
+    for i in range(5):
+        logger.info({'message': 'The user logged in successfully', 'user': f'user{i}'})
+    logger.debug('This is filtered out by the level of the stream handler')
+    logger.info('Message %d of %s', 6, 'six')
+
+    listener = BatchQueueListener(log_queue, stream_handler, batch_size=4)
+    with mock.patch.object(stream, 'write', wraps=stream.write) as mock_write:
+        listener.start()
+        listener.stop()
+
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert lines[0] == {
+        'levelname': 'INFO',
+        'user': 'user0',
+        'message': 'The user logged in successfully',
+    }
+    assert lines[-1]['message'] == 'Message 6 of six'
+    assert len(lines) == 6
+    # The seven records were dequeued in batches of four and three
+    assert mock_write.call_count == 2
+
+
+def test_queue_handler_drops_records_when_full():
+    """Test that the records are dropped and counted when the queue is full."""
+    handler = BoundedQueueHandler(queue.Queue(maxsize=1))
+    logger = _get_logger(handler)
+    dropped = LOG_MESSAGES_DROPPED.get(level='WARNING')
+    for _ in range(3):
+        logger.warning('The queue is full')
+    assert handler.queue.qsize() == 1
+    assert handler.dropped == 2
+    assert LOG_MESSAGES_DROPPED.get(level='WARNING') == dropped + 2
+
+
+def test_queue_handler_blocks_when_full():
+    """Test that the logging thread waits for room in the queue with the block policy."""
+    stream = io.StringIO()
+    log_queue = queue.Queue(maxsize=1)
+    listener = BatchQueueListener(log_queue, BatchStreamHandler(stream), batch_size=1)
+    listener.start()
+    handler = BoundedQueueHandler(log_queue, block=True)
+    logger = _get_logger(handler)
+    for i in range(50):
+        logger.info('Message %d', i)
+    listener.stop()
+    assert handler.dropped == 0
+    assert len(stream.getvalue().splitlines()) == 50
+
+
+def test_log_to_stdout_replaces_handler():
+    """Test that configuring the logging again doesn't add another handler."""
+    adreset.logger.log_to_stdout(logging.DEBUG)
+    adreset.logger.log_to_stdout(logging.DEBUG)
+    handlers = [
+        handler
+        for handler in logging.getLogger().handlers
+        if isinstance(handler, (BoundedQueueHandler, BatchStreamHandler))
+    ]
+    assert handlers == [adreset.logger._handler]
+    assert adreset.logger._listener._thread.is_alive()
+
+
+def test_listener_restarted_after_fork():
+    """Test that a process forked after logging was configured writes its records."""
+    with tempfile.TemporaryFile('w+') as log_file:
+        with mock.patch('adreset.logger.sys.stdout', log_file):
+            adreset.logger.log_to_stdout(logging.INFO)
+        pid = os.fork()
+        if pid == 0:
+            try:
+                logging.getLogger('adreset.tests.fork').warning('Logged by the forked process')
+                adreset.logger._stop_listener()
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        adreset.logger.log_to_stdout(logging.INFO)
+        log_file.seek(0)
+        messages = [json.loads(line)['message'] for line in log_file.read().splitlines()]
+    assert messages == ['Logged by the forked process']
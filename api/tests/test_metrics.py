@@ -0,0 +1,111 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+from flask import Flask
+import mock
+import pytest
+
+from adreset.metrics import (
+    Counter,
+    Histogram,
+    init_metrics,
+    LDAP_OPERATION_DURATION,
+    LOCKOUT_EVENTS,
+    REVOCATION_CACHE_LOOKUPS,
+)
+
+
+def test_counter_render():
+    """Test that a counter is formatted in the Prometheus text exposition format."""
+    counter = Counter('adreset_test_total', 'A test counter', ('result',))
+    counter.inc(result='hit')
+    counter.inc(2, result='hit')
+    counter.inc(result='say "miss"')
+    assert counter.get(result='hit') == 3
+    assert counter.render() == [
+        '# HELP adreset_test_total A test counter',
+        '# TYPE adreset_test_total counter',
+        'adreset_test_total{result="hit"} 3.0',
+        'adreset_test_total{result="say \\"miss\\""} 1.0',
+    ]
+
+
+def test_histogram_render():
+    """Test that a histogram has cumulative buckets, a sum, and a count."""
+    histogram = Histogram('adreset_test_seconds', 'A test histogram', buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value)
+    assert histogram.get_count() == 4
+    assert histogram.render() == [
+        '# HELP adreset_test_seconds A test histogram',
+        '# TYPE adreset_test_seconds histogram',
+        'adreset_test_seconds_bucket{le="0.1"} 2.0',
+        'adreset_test_seconds_bucket{le="1.0"} 3.0',
+        'adreset_test_seconds_bucket{le="+Inf"} 4.0',
+        'adreset_test_seconds_sum 3.65',
+        'adreset_test_seconds_count 4.0',
+    ]
+
+
+def test_metrics_endpoint(client, mock_ad):
+    """Test that the /metrics endpoint exposes the request, LDAP, and database metrics."""
+    searches = LDAP_OPERATION_DURATION.get_count(operation='search')
+    rv = client.get('/api/v1/account-status/lockeduser')
+    assert rv.status_code == 200
+    assert LDAP_OPERATION_DURATION.get_count(operation='search') > searches
+    assert client.get('/api/v1/questions').status_code == 200
+
+    rv = client.get('/metrics')
+    assert rv.status_code == 200
+    assert rv.headers['Content-Type'] == 'text/plain; version=0.0.4; charset=utf-8'
+    metrics = rv.data.decode('utf-8')
+    assert (
+        'adreset_request_duration_seconds_count{endpoint="api_v1.account_status",'
+        'method="GET",status="200"}'
+    ) in metrics
+    assert 'adreset_ldap_operation_duration_seconds_bucket{operation="search",le="+Inf"}' in metrics
+    assert 'adreset_db_queries_total{statement="SELECT"}' in metrics
+    assert 'adreset_cache_lookups_total{cache="account_status",result="miss"}' in metrics
+    assert 'adreset_cache_entries{cache="identities"}' in metrics
+
+
+@pytest.mark.parametrize(
+    'remote_addr, allowed_networks, expected_status',
+    (
+        ('127.0.0.1', ['127.0.0.1/32', '::1/128'], 200),
+        ('192.168.1.5', ['127.0.0.1/32', '::1/128'], 403),
+        ('192.168.1.5', ['192.168.1.0/24'], 200),
+        ('192.168.1.5', None, 200),
+        ('not-an-address', ['127.0.0.1/32'], 403),
+    ),
+)
+def test_metrics_allowed_networks(app, client, remote_addr, allowed_networks, expected_status):
+    """Test that only the clients in the allowed networks can read the metrics."""
+    with mock.patch.dict(app.config, {'METRICS_ALLOWED_NETWORKS': allowed_networks}):
+        rv = client.get('/metrics', environ_base={'REMOTE_ADDR': remote_addr})
+    assert rv.status_code == expected_status
+
+
+def test_lockout_and_revocation_metrics(app, client, logged_in_headers):
+    """Test that failed attempts and revoked token lookups are counted."""
+    failed_attempts = LOCKOUT_EVENTS.get(event='failed_attempt')
+    app.extensions['adreset_lockout'].add_failed_attempt(1)
+    assert LOCKOUT_EVENTS.get(event='failed_attempt') == failed_attempts + 1
+
+    lookups = REVOCATION_CACHE_LOOKUPS.get(result='hit') + REVOCATION_CACHE_LOOKUPS.get(
+        result='miss'
+    )
+    client.get('/api/v1/answers', headers=logged_in_headers)
+    assert (
+        REVOCATION_CACHE_LOOKUPS.get(result='hit') + REVOCATION_CACHE_LOOKUPS.get(result='miss')
+        == lookups + 1
+    )
+
+
+def test_metrics_disabled():
+    """Test that the /metrics endpoint isn't added when the metrics are disabled."""
+    app = Flask(__name__)
+    app.config['METRICS_ENABLED'] = False
+    init_metrics(app)
+    assert app.test_client().get('/metrics').status_code == 404
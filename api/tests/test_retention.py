@@ -0,0 +1,80 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+from datetime import datetime, timedelta
+
+import mock
+
+from adreset.models import db, BlacklistedToken, FailedAttempt, User
+from adreset.retention import delete_in_batches, prune, schedule_pruning
+
+
+def _add_rows():
+    """Add expired and unexpired tokens and failed attempts to the database."""
+    user = User(ad_guid='10385a23-6def-4990-84a8-32444e36e496')
+    db.session.add(user)
+    now = datetime.now()
+    utc_now = datetime.utcnow()
+    for i in range(5):
+        db.session.add(
+            BlacklistedToken(jti=f'expired-{i}', user=user, expires=now - timedelta(hours=1))
+        )
+        db.session.add(FailedAttempt(user=user, time=utc_now - timedelta(days=31)))
+    db.session.add(BlacklistedToken(jti='unexpired', user=user, expires=now + timedelta(hours=1)))
+    # This attempt no longer counts towards a lockout but is still retained
+    db.session.add(FailedAttempt(user=user, time=utc_now - timedelta(days=1)))
+    db.session.commit()
+
+
+def test_delete_in_batches(app):
+    """Test that the matching rows are deleted with one statement per batch."""
+    _add_rows()
+    condition = BlacklistedToken.expires < datetime.now()
+    with mock.patch.object(db.session, 'commit', wraps=db.session.commit) as mock_commit:
+        assert delete_in_batches(BlacklistedToken, condition, batch_size=2) == 5
+    assert mock_commit.call_count == 3
+    assert [token.jti for token in BlacklistedToken.query.all()] == ['unexpired']
+
+
+def test_prune(app):
+    """Test that the expired tokens and the failed attempts past their retention are deleted."""
+    _add_rows()
+    results = prune()
+    assert results['blacklisted_token']['deleted'] == 5
+    assert results['failed_attempt']['deleted'] == 5
+    assert BlacklistedToken.query.count() == 1
+    assert FailedAttempt.query.count() == 1
+
+
+def test_prune_command(app):
+    """Test that the prune command reports what it deleted."""
+    _add_rows()
+    rv = app.test_cli_runner().invoke(args=['prune'])
+    assert rv.exit_code == 0
+    lines = rv.output.splitlines()
+    assert lines[0].startswith('Removed 5 rows from blacklisted_token in ')
+    assert lines[1].startswith('Removed 5 rows from failed_attempt in ')
+    assert lines[1].endswith(' rows/second)')
+
+
+def test_prune_blacklisted_tokens_command(app):
+    """Test that the prune-blacklisted-tokens command only deletes the expired tokens."""
+    _add_rows()
+    rv = app.test_cli_runner().invoke(args=['prune-blacklisted-tokens'])
+    assert rv.exit_code == 0
+    assert rv.output == 'Removed 5 expired blacklisted tokens\n'
+    assert FailedAttempt.query.count() == 6
+    rv = app.test_cli_runner().invoke(args=['prune-blacklisted-tokens'])
+    assert rv.output == 'No expired blacklisted tokens to remove\n'
+
+
+@mock.patch('adreset.retention.threading.Thread')
+def test_schedule_pruning(mock_thread, app):
+    """Test that pruning is only scheduled in the application process when it's configured."""
+    assert schedule_pruning(app) is None
+    mock_thread.assert_not_called()
+    with mock.patch.dict(app.config, {'PRUNE_INTERVAL_SECONDS': 3600}):
+        assert schedule_pruning(app) is mock_thread.return_value
+    mock_thread.return_value.start.assert_called_once_with()
+    assert mock_thread.call_args[1]['args'] == (app, 3600)
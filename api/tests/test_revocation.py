@@ -0,0 +1,157 @@
+# SPDX-License-Identifier: GPL-3.0+
+
+from __future__ import unicode_literals
+
+from datetime import datetime, timedelta
+import time
+
+import mock
+import pytest
+
+from adreset.error import ConfigurationError
+from adreset.models import db, BlacklistedToken, User
+from adreset.revocation import (
+    init_revocation,
+    MemoryRevocationBackend,
+    RedisRevocationBackend,
+    SQLRevocationBackend,
+)
+
+
+class MockRedis(object):
+    """Mock the subset of the redis.Redis client used by the revocation backend."""
+
+    def __init__(self):
+        """Initialize the mock Redis client."""
+        # Maps the key to the UNIX timestamp of when it expires
+        self.keys = {}
+
+    def set(self, key, value, ex):
+        """Set the key with an expiration in seconds."""
+        self.keys[key] = time.time() + ex
+
+    def exists(self, key):
+        """Return the number of the keys that exist and are unexpired."""
+        return int(self.keys.get(key, 0) > time.time())
+
+
+def _token(jti, exp):
+    """Create a decoded JSON web token for testuser."""
+    return {'jti': jti, 'exp': exp, 'sub': {'guid': '10385a23-6def-4990-84a8-32444e36e496'}}
+
+
+def _add_blacklisted_token(jti, expires, row_id=None):
+    """Add a blacklisted token to the database as if another process revoked it."""
+    user = User.query.filter_by(ad_guid='10385a23-6def-4990-84a8-32444e36e496').first()
+    if not user:
+        user = User(ad_guid='10385a23-6def-4990-84a8-32444e36e496')
+        db.session.add(user)
+    db.session.add(BlacklistedToken(id=row_id, jti=jti, user=user, expires=expires))
+    db.session.commit()
+
+
+def test_revocation_store_incremental_refresh():
+    """Test that tokens revoked by other processes are loaded after the first full refresh."""
+    store = SQLRevocationBackend(refresh_interval=0, full_refresh_interval=300)
+    an_hour_from_now = datetime.now() + timedelta(hours=1)
+    _add_blacklisted_token('1f9cc3e2-6f0b-4d3c-bb2a-0c5b2c9dfa01', an_hour_from_now)
+    assert store.is_revoked('1f9cc3e2-6f0b-4d3c-bb2a-0c5b2c9dfa01') is True
+    _add_blacklisted_token('1f9cc3e2-6f0b-4d3c-bb2a-0c5b2c9dfa02', an_hour_from_now)
+    with mock.patch.object(store, '_full_refresh') as mock_full_refresh:
+        assert store.is_revoked('1f9cc3e2-6f0b-4d3c-bb2a-0c5b2c9dfa02') is True
+        assert store.is_revoked('1f9cc3e2-6f0b-4d3c-bb2a-0c5b2c9dfa03') is False
+    mock_full_refresh.assert_not_called()
+
+
+def test_revocation_store_incremental_refresh_out_of_order():
+    """Test that a row with a lower ID that is committed after a higher one is still loaded."""
+    store = SQLRevocationBackend(refresh_interval=0, full_refresh_interval=300, refresh_overlap=5)
+    an_hour_from_now = datetime.now() + timedelta(hours=1)
+    _add_blacklisted_token('1f9cc3e2-6f0b-4d3c-bb2a-0c5b2c9dfa01', an_hour_from_now, row_id=1)
+    _add_blacklisted_token('1f9cc3e2-6f0b-4d3c-bb2a-0c5b2c9dfa03', an_hour_from_now, row_id=3)
+    assert store.is_revoked('1f9cc3e2-6f0b-4d3c-bb2a-0c5b2c9dfa03') is True
+    assert store._watermark == 3
+    # The transaction that was allocated ID 2 commits after the one with ID 3
+    _add_blacklisted_token('1f9cc3e2-6f0b-4d3c-bb2a-0c5b2c9dfa02', an_hour_from_now, row_id=2)
+    with mock.patch.object(store, '_full_refresh') as mock_full_refresh:
+        assert store.is_revoked('1f9cc3e2-6f0b-4d3c-bb2a-0c5b2c9dfa02') is True
+    mock_full_refresh.assert_not_called()
+    assert store._watermark == 3
+
+
+def test_revocation_store_full_refresh_drops_expired():
+    """Test that a full refresh only loads the unexpired tokens."""
+    store = SQLRevocationBackend(refresh_interval=0, full_refresh_interval=0)
+    _add_blacklisted_token('1f9cc3e2-6f0b-4d3c-bb2a-0c5b2c9dfa01', datetime.now())
+    _add_blacklisted_token(
+        '1f9cc3e2-6f0b-4d3c-bb2a-0c5b2c9dfa02', datetime.now() + timedelta(hours=1)
+    )
+    assert store.is_revoked('1f9cc3e2-6f0b-4d3c-bb2a-0c5b2c9dfa01') is False
+    assert store.is_revoked('1f9cc3e2-6f0b-4d3c-bb2a-0c5b2c9dfa02') is True
+
+
+def test_revocation_store_refresh_interval():
+    """Test that the database isn't queried again before the refresh interval has passed."""
+    db.session.add(User(ad_guid='10385a23-6def-4990-84a8-32444e36e496'))
+    db.session.commit()
+    store = SQLRevocationBackend(refresh_interval=60, full_refresh_interval=300)
+    assert store.is_revoked('1f9cc3e2-6f0b-4d3c-bb2a-0c5b2c9dfa02') is False
+    store.add(_token('1f9cc3e2-6f0b-4d3c-bb2a-0c5b2c9dfa01', time.time() + 3600))
+    with mock.patch.object(store, '_incremental_refresh') as mock_refresh:
+        assert store.is_revoked('1f9cc3e2-6f0b-4d3c-bb2a-0c5b2c9dfa01') is True
+    mock_refresh.assert_not_called()
+    assert BlacklistedToken.query.count() == 1
+
+
+def test_memory_backend_expires_tokens():
+    """Test that the in-memory backend forgets tokens once they expire."""
+    backend = MemoryRevocationBackend(purge_interval=0)
+    backend.add(_token('1f9cc3e2-6f0b-4d3c-bb2a-0c5b2c9dfa01', time.time() - 1))
+    backend.add(_token('1f9cc3e2-6f0b-4d3c-bb2a-0c5b2c9dfa02', time.time() + 3600))
+    assert backend.is_revoked('1f9cc3e2-6f0b-4d3c-bb2a-0c5b2c9dfa01') is False
+    assert backend.is_revoked('1f9cc3e2-6f0b-4d3c-bb2a-0c5b2c9dfa02') is True
+    # The expired token was purged when the second token was added
+    assert list(backend._revoked) == ['1f9cc3e2-6f0b-4d3c-bb2a-0c5b2c9dfa02']
+    assert BlacklistedToken.query.count() == 0
+
+
+def test_redis_backend_expires_keys_with_token():
+    """Test that the Redis backend sets keys that expire when the token expires."""
+    client = MockRedis()
+    backend = RedisRevocationBackend(client, prefix='test:')
+    exp = time.time() + 3600
+    backend.add(_token('1f9cc3e2-6f0b-4d3c-bb2a-0c5b2c9dfa01', exp))
+    backend.add(_token('1f9cc3e2-6f0b-4d3c-bb2a-0c5b2c9dfa02', time.time() - 1))
+    assert list(client.keys) == ['test:1f9cc3e2-6f0b-4d3c-bb2a-0c5b2c9dfa01']
+    assert client.keys['test:1f9cc3e2-6f0b-4d3c-bb2a-0c5b2c9dfa01'] == pytest.approx(exp, abs=2)
+    assert backend.is_revoked('1f9cc3e2-6f0b-4d3c-bb2a-0c5b2c9dfa01') is True
+    assert backend.is_revoked('1f9cc3e2-6f0b-4d3c-bb2a-0c5b2c9dfa02') is False
+
+
+@pytest.mark.parametrize(
+    'backend_name, backend_class',
+    [('sql', SQLRevocationBackend), ('memory', MemoryRevocationBackend)],
+)
+def test_init_revocation(app, backend_name, backend_class):
+    """Test that the configured revocation backend is used."""
+    with mock.patch.dict(app.config, {'JWT_REVOCATION_BACKEND': backend_name}):
+        with mock.patch.dict(app.extensions):
+            init_revocation(app)
+            assert type(app.extensions['adreset_revocation']) is backend_class
+
+
+def test_init_revocation_invalid_backend(app):
+    """Test that an invalid revocation backend is rejected."""
+    with mock.patch.dict(app.config, {'JWT_REVOCATION_BACKEND': 'mongodb'}):
+        with pytest.raises(ConfigurationError, match='is invalid'):
+            init_revocation(app)
+
+
+def test_logout_with_memory_backend(client, logged_in_headers, app):
+    """Test that a token revoked with the in-memory backend is rejected."""
+    with mock.patch.dict(app.extensions, {'adreset_revocation': MemoryRevocationBackend()}):
+        rv = client.post('/api/v1/logout', headers=logged_in_headers)
+        assert rv.status_code == 200
+        rv = client.post('/api/v1/logout', headers=logged_in_headers)
+        assert rv.status_code == 401
+    assert BlacklistedToken.query.count() == 0